@@ -0,0 +1,113 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : down_bench.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+
+Downloader下载速度测试, 在本地起一个HTTP服务, 对比旧的1KiB分块写法和新的下载方式
+运行方式(在项目根目录): python -m bench.down_bench [文件大小MB]
+"""
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from common.down import Downloader
+
+SIZE_MB = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+PAYLOAD = os.urandom(1024 * 1024) * SIZE_MB
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _range(self):
+        m = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if not m:
+            return None
+        start = int(m.group(1))
+        end = int(m.group(2)) if m.group(2) else len(PAYLOAD) - 1
+        return start, min(end, len(PAYLOAD) - 1)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(PAYLOAD)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        rng = self._range()
+        if rng is None:
+            start, end = 0, len(PAYLOAD) - 1
+            self.send_response(200)
+        else:
+            start, end = rng
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD)}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        view = memoryview(PAYLOAD)
+        pos = start
+        while pos <= end:
+            n = min(1024 * 1024, end + 1 - pos)
+            self.wfile.write(view[pos:pos + n])
+            pos += n
+
+
+def legacy_download(url, file_path):
+    """
+    旧版Downloader的写法: 额外的GET请求获取大小, 1KiB分块, 每块flush并刷新进度
+    """
+    total_size = int(requests.get(url, stream=True).headers['Content-Length'])
+    res_left = requests.get(url, stream=True, headers={'Range': 'bytes=0-'})
+    temp_size = 0
+    with open(file_path, "ab") as f:
+        for chunk in res_left.iter_content(chunk_size=1024):
+            temp_size += len(chunk)
+            f.write(chunk)
+            f.flush()
+            done = int(50 * temp_size / total_size)
+            "\r[%s%s] %d%%" % ('█' * done, ' ' * (50 - done), 100 * temp_size / total_size)
+
+
+def new_download(url, file_path, segments=1):
+    Downloader(url, file_path, segments=segments).start()
+
+
+def _timeit(name, func, url, tmp_dir, **kwargs):
+    file_path = os.path.join(tmp_dir, name)
+    start = time.perf_counter()
+    func(url, file_path, **kwargs)
+    cost = time.perf_counter() - start
+    assert os.path.getsize(file_path) == len(PAYLOAD)
+    os.remove(file_path)
+    speed = SIZE_MB / cost
+    print(f"{name:<16}{cost:>8.2f}s{speed:>10.1f} MB/s")
+    return speed
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/file.bin"
+    print(f"文件大小: {SIZE_MB} MB")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        legacy = _timeit("legacy", legacy_download, url, tmp_dir)
+        single = _timeit("downloader", new_download, url, tmp_dir)
+        segmented = _timeit("downloader x4", new_download, url, tmp_dir, segments=4)
+    print(f"单连接提升: {single / legacy:.1f}x, 分段提升: {segmented / legacy:.1f}x")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
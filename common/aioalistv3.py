@@ -0,0 +1,896 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : aioalistv3.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+"""
+import asyncio
+import functools
+import json
+import os
+import shutil
+import threading
+import traceback
+import weakref
+from urllib import parse
+
+try:
+    import aiohttp
+except ImportError:     # 未安装aiohttp时只能使用同步版AlistV3
+    aiohttp = None
+
+from common.log import log
+from common.alistv3 import AlistException, AlistV3, TrackPrintEnable
+from common.cache import ListCache
+from common.diff import SyncFilter, compare_dir
+from common.storage import cloud189_sub_path, local_path
+
+
+class AioAlistException(AlistException):
+    """
+    AioAlistV3的错误处理类型, 与AlistException相同, 用于装饰协程
+    """
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            except self.exp as e:
+                raise e
+            except aiohttp.InvalidURL:
+                raise self.exp("Alist的URL输入错误")
+            except aiohttp.ClientConnectionError:
+                raise self.exp("Alist连接失败")
+            except KeyError:
+                raise self.exp("Alist响应结果异常")
+            except self.BaseError as e:  # 属于Exp类的异常
+                raise self.exp(e)
+            except Exception:
+                # 未知异常
+                if TrackPrintEnable is True:
+                    traceback.print_exc()  # 打印异常
+                raise self.exp
+
+        return wrapper
+
+
+class AioAlistV3:
+    """
+    asyncio版的精简alist客户端, 所有请求在一个事件循环中并发执行, 适合大量小文件的并发传输
+    只包含基本的文件操作和一个简化的sync, 不是AlistV3的替代, 完整功能请使用AlistV3:
+        - 不支持rate_limit、consistency、metrics等实例配置, 操作后不等待结果生效
+        - 目录一次列出, 不分页
+        - sync只通过alist接口比较大小, 不支持rclone、同步状态索引、任务日志、哈希比较、移动检测和跳过子树,
+          不需要确认, 总是同步所有差异
+    使用方式:
+        async with AioAlistV3(user, passwd) as a:
+            await a.sync(src_path, dst_path_list)
+    """
+    _MAIN_URL = AlistV3._MAIN_URL
+    _HEADERS = AlistV3._HEADERS
+    _DOWN_HEADERS = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:81.0) Gecko/20100101 Firefox/81.0",
+        "Accept-Encoding": "identity",
+    }
+
+    def __init__(self, user, passwd, alist_url=None, local_driver=None, cache_ttl=60, cache_size=4096,
+                 max_requests=64, max_transfers=16):
+        """
+        :param user: alist用户名
+        :param passwd: alist密码
+        :param alist_url: alist地址
+        :param local_driver: 本地挂载的存储, {alist目录: 本地目录}
+        :param cache_ttl: 路径信息缓存有效时间(秒), 为0时不缓存
+        :param cache_size: 路径信息缓存最大条目数
+        :param max_requests: 同时进行的alist接口请求数
+        :param max_transfers: 同时进行的下载/上传数
+        """
+        if aiohttp is None:
+            raise AlistException.InitError("AioAlistV3需要安装aiohttp: pip install aiohttp")
+        if alist_url is not None:
+            self._MAIN_URL = alist_url
+        self.local_driver = {} if local_driver is None else local_driver
+        self.cache = ListCache(ttl=cache_ttl, max_size=cache_size)
+        self.max_requests = max_requests
+        self.max_transfers = max_transfers
+        self._user = user
+        self._passwd = passwd
+        self._known_dirs = set()    # 已确认存在的目录, 上传时不再检查
+        self._dir_locks = weakref.WeakValueDictionary()     # 目录 -> asyncio.Lock, 同一目录只创建一次, 用完自动释放
+        self.s = None               # alist接口会话, 带登录token
+        self._down_s = None         # 下载raw_url用的会话, 不带登录token
+        self._LIST_URL = f"{self._MAIN_URL}/api/fs/list"
+        self._GET_URL = f"{self._MAIN_URL}/api/fs/get"
+        self._LOGIN_URL = f"{self._MAIN_URL}/api/auth/login"
+        self._RENAME_URL = f"{self._MAIN_URL}/api/fs/rename"
+        self._MKDIR_URL = f"{self._MAIN_URL}/api/fs/mkdir"
+        self._DEL_URL = f"{self._MAIN_URL}/api/fs/remove"
+        self._MOVE_URL = f"{self._MAIN_URL}/api/fs/move"
+        self._COPY_URL = f"{self._MAIN_URL}/api/fs/copy"
+        self._PUT_URL = f"{self._MAIN_URL}/api/fs/put"
+
+    @AioAlistException(AlistException.InitError)
+    async def open(self):
+        """
+        创建连接池并登录
+        """
+        if self.s is not None:
+            return self
+        self._req_sem = asyncio.Semaphore(self.max_requests)
+        self._transfer_sem = asyncio.Semaphore(self.max_transfers)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30)
+        self.s = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_requests + self.max_transfers),
+                                       headers=self._HEADERS, timeout=timeout)
+        self._down_s = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_transfers),
+                                             headers=self._DOWN_HEADERS, timeout=timeout, auto_decompress=False)
+        json_data = {
+            'username': self._user,
+            'password': self._passwd,
+            'otp_code': '',
+        }
+        async with self.s.post(self._LOGIN_URL, json=json_data) as res:
+            result = json.loads(await res.text()) if res.status == 200 else {}
+        if result.get('code') != 200:
+            await self.close()
+            raise AlistException.InitError("登录失败，密码可能错误，或者账号权限不足。")
+        self.s.headers['Authorization'] = result['data']['token']
+        return self
+
+    async def close(self):
+        """
+        关闭连接池
+        """
+        for s in (self.s, self._down_s):
+            if s is not None:
+                await s.close()
+        self.s = self._down_s = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def _post(self, url, json_data) -> dict:
+        """
+        请求alist接口, 同时进行的请求数由max_requests限制
+
+        :return: 响应的json
+        """
+        async with self._req_sem:
+            async with self.s.post(url, json=json_data) as res:
+                return json.loads(await res.text())
+
+    @staticmethod
+    def _norm(path):
+        return path.replace("\\", "/").rstrip("/") or "/"
+
+    def local_path(self, path):
+        """
+        alist路径在local_driver中对应的本地路径, 不在local_driver中时返回None
+        """
+        return local_path(path, self.local_driver)
+
+    def _forget_dirs(self, path):
+        """
+        路径被删除或移动后, 清除该路径及其子目录的已存在记录
+        """
+        path = self._norm(path)
+        self._known_dirs = {d for d in self._known_dirs if d != path and not d.startswith(path + "/")}
+
+    @AioAlistException(AlistException.RenameError)
+    async def rename(self, file_p, newname):
+        """
+        重命名
+        :param file_p: 需要重命名的文件
+        :param newname: 新名字
+        :return:
+        """
+        json_data = {
+            'name': newname,
+            'path': file_p,
+        }
+        res = await self._post(self._RENAME_URL, json_data)
+        if res['code'] != 200:
+            raise AlistException.RenameError(f"重命名失败, 响应结果: {res}")
+        log.info(f"{file_p} --已重命名--> {newname}")
+        self._forget_dirs(file_p)
+        self.cache.invalidate(file_p, recursive=True)
+        self.cache.invalidate(f"{os.path.dirname(file_p)}/{newname}")
+
+    @AioAlistException(AlistException.GetPathError)
+    async def getpath(self, dst_path, refresh=False) -> dict:
+        """
+        获取alist的路径信息, 优先读取缓存, 缓存未命中或过期时才请求alist
+
+        :param dst_path: 需要获取的目标路径信息
+        :param refresh: 为True时跳过缓存, 并让alist刷新上级目录和本目录
+        :return:
+        """
+        if refresh is False:
+            res = self.cache.get(dst_path)
+            if res is not None:
+                return res
+        dst_dir = os.path.dirname(dst_path)
+        if refresh is True:
+            json_data = {
+                'path': dst_dir,
+                'password': '',
+                'page': 1,
+                'per_page': 0,
+                'refresh': True,
+            }
+            res_list = await self._post(self._LIST_URL, json_data)
+            if res_list.get('code') != 200:  # 上级目录刷新失败，说明不存在上级目录，则刷新再上一级目录
+                await self.getpath(dst_dir, refresh=True)
+        res = await self._post(self._GET_URL, {'path': dst_path, 'password': ''})
+        if res.get('code') == 200 and res.get('data').get('is_dir') is True:
+            res['data']['files'] = await self.listdir(dst_path, refresh=refresh)
+        if res.get('code') == 200:
+            self.cache.set(dst_path, res)
+        return res
+
+    @AioAlistException(AlistException.GetPathError)
+    async def listdir(self, dir_path, refresh=False):
+        """
+        列出目录下的文件和文件夹, 只请求一次/api/fs/list
+
+        :param dir_path: 目录路径
+        :param refresh: 是否让alist刷新目录
+        :return: 目录内容列表, 目录不存在时返回None
+        """
+        if refresh is False:
+            res = self.cache.get(dir_path)
+            if res is not None and 'files' in res['data']:
+                return res['data']['files'] or []
+        json_data = {
+            'path': dir_path,
+            'password': '',
+            'page': 1,
+            'per_page': 0,
+            'refresh': refresh,
+        }
+        res = await self._post(self._LIST_URL, json_data)
+        if res.get('code') != 200:
+            return None
+        return res['data']['content'] or []
+
+    @AioAlistException(AlistException.MkdirError)
+    async def mkdir(self, file_path):
+        """
+        先检查上级目录是否存在，不存在则先创建上级目录, 同一目录同时只有一个协程在创建
+        :param file_path:
+        :return:
+        """
+        file_path = self._norm(file_path)
+        if file_path in self._known_dirs:
+            return f"目录已存在: {file_path}"
+        dir_lock = self._dir_locks.get(file_path)
+        if dir_lock is None:
+            dir_lock = self._dir_locks[file_path] = asyncio.Lock()
+        async with dir_lock:
+            if file_path in self._known_dirs:
+                return f"目录已存在: {file_path}"
+            # 检测目录是否存在
+            res = await self.getpath(file_path)
+            if res['code'] == 200:
+                if res['data']['is_dir'] is True:
+                    self._known_dirs.add(file_path)
+                return f"目录已存在: {file_path}"
+
+            # 检测上级目录是否存在, 不存在则创建
+            await self.mkdir(os.path.dirname(file_path))
+
+            # 创建目录操作
+            res = await self._post(self._MKDIR_URL, {'path': file_path})
+            if res['code'] != 200:
+                raise AlistException.MkdirError(f"创建alist文件夹失败: {file_path}, 响应结果: {res}")
+            log.info(f"已创建alist文件夹: {file_path}")
+            self._known_dirs.add(file_path)
+            self.cache.invalidate(file_path)
+            return f"已创建alist文件夹: {file_path}"
+
+    async def _prepare_dst_dir(self, dst_dir, mkdir_flag, exp):
+        """
+        检查目标目录, 不存在时按mkdir_flag创建
+        """
+        if self._norm(dst_dir) in self._known_dirs:
+            return
+        res = await self.getpath(dst_dir)
+        if res['code'] != 200:
+            if mkdir_flag is False:
+                raise exp("目标路径不存在，请检查目标路径是否正确，或选择启用本函数mkdir_flag")
+            await self.mkdir(dst_dir)
+        elif res['data']['is_dir'] is False:
+            raise exp("目标路径实际为文件，请确认输入是否正确")
+        else:
+            self._known_dirs.add(self._norm(dst_dir))
+
+    @AioAlistException(AlistException.DelError)
+    async def delete(self, file_path):
+        """
+        删除操作
+        :param file_path: 文件路径
+        :return:
+        """
+        res = await self.getpath(file_path)
+        if res['code'] != 200:
+            raise AlistException.DelError("目标的文件不存在，请检查目标路径是否正确")
+        json_data = {
+            'names': [
+                os.path.basename(file_path),
+            ],
+            'dir': os.path.dirname(file_path),
+        }
+        res = await self._post(self._DEL_URL, json_data)
+        if res['code'] != 200:
+            raise AlistException.DelError(f"删除失败, 响应结果: {res}")
+        log.info(f"已删除alist文件: {file_path}")
+        self._forget_dirs(file_path)
+        self.cache.invalidate(file_path, recursive=True)
+
+    @AioAlistException(AlistException.DelError)
+    async def delete_many(self, file_path_list, batch_size=1000) -> list:
+        """
+        批量删除, 按所在目录分组, 各目录同时删除, 每个目录只列出一次目录内容检查是否存在
+
+        :param file_path_list: 文件路径列表
+        :param batch_size: 每个删除请求最多包含的文件数
+        :return: 不存在的文件路径列表
+        """
+        groups = {}     # 目录 -> 文件名列表
+        for file_path in file_path_list:
+            file_path = file_path.replace("\\", "/")
+            groups.setdefault(os.path.dirname(file_path), []).append(os.path.basename(file_path))
+        missing = []
+
+        async def delete_dir(folder_path, names):
+            files = await self.listdir(folder_path)
+            exist_names = set() if files is None else {f['name'] for f in files}
+            for name in names:
+                if name not in exist_names:
+                    log.warning(f"要删除的文件不存在: {folder_path}/{name}")
+                    missing.append(f"{folder_path}/{name}")
+            names = [name for name in dict.fromkeys(names) if name in exist_names]
+            for i in range(0, len(names), batch_size):
+                batch = names[i:i + batch_size]
+                res = await self._post(self._DEL_URL, {'names': batch, 'dir': folder_path})
+                if res['code'] != 200:
+                    raise AlistException.DelError(f"批量删除失败, 目录: {folder_path}, 响应结果: {res}")
+                log.info(f"已删除alist文件夹{folder_path}中的{len(batch)}个文件")
+                for name in batch:
+                    self._forget_dirs(f"{folder_path}/{name}")
+                    self.cache.invalidate(f"{folder_path}/{name}", recursive=True)
+
+        await asyncio.gather(*(delete_dir(folder_path, names) for folder_path, names in groups.items()))
+        return missing
+
+    @AioAlistException(AlistException.MoveError)
+    async def move(self, src_path, dst_dir, mkdir_flag=True, local_move=True):
+        """
+        移动文件, 支持跨账号移动
+
+        :param src_path: 源文件地址
+        :param dst_dir: 目标目录地址
+        :param mkdir_flag: 没有文件夹时是否创建文件夹
+        :param local_move: 跨账号移动时是否中转。为True时，源文件中转上传到目标目录后删除源文件。为False时直接返回0
+        :return: =1成功，=0失败
+        """
+        log.info(f"{src_path} --move--> {dst_dir}")
+        await self._prepare_dst_dir(dst_dir, mkdir_flag, AlistException.MoveError)
+        name = os.path.basename(src_path)
+        json_data = {
+            'src_dir': os.path.dirname(src_path),
+            'dst_dir': dst_dir,
+            'names': [
+                name,
+            ],
+        }
+        res = await self._post(self._MOVE_URL, json_data)
+        if res["code"] == 200:
+            log.info("同账号文件移动操作成功")
+            self._forget_dirs(src_path)
+            self.cache.invalidate(src_path, recursive=True)
+            self.cache.invalidate(f"{dst_dir}/{name}")
+            return 1
+        elif res["code"] == 500 and "between two storages" in res["message"]:   # 跨存储账号移动
+            log.info("这是跨账号移动")
+            if local_move is False:
+                return 0
+            await self.relay(src_path, dst_dir, mkdir_flag)
+            await self.delete(src_path)     # 因为是移动操作，在复制成功后，删除源文件
+            return 1
+        else:
+            raise AlistException.MoveError(res)
+
+    @AioAlistException(AlistException.CopyError)
+    async def copy(self, src_path, dst_dir, mkdir_flag=True):
+        """
+        复制文件, 使用alist的复制接口, 跨账号时由alist在后台完成复制
+
+        :param src_path: 源文件地址
+        :param dst_dir: 目标目录地址
+        :param mkdir_flag: 没有文件夹时是否创建文件夹
+        :return: =1成功
+        """
+        log.info(f"{src_path} --copy--> {dst_dir}")
+        await self._prepare_dst_dir(dst_dir, mkdir_flag, AlistException.CopyError)
+        name = os.path.basename(src_path)
+        json_data = {
+            'src_dir': os.path.dirname(src_path),
+            'dst_dir': dst_dir,
+            'names': [
+                name,
+            ],
+        }
+        res = await self._post(self._COPY_URL, json_data)
+        if res["code"] != 200:
+            raise AlistException.CopyError(res)
+        self.cache.invalidate(f"{dst_dir}/{name}")
+        return 1
+
+    @AioAlistException(AlistException.DownloadError)
+    async def download_file(self, file_path: str, save_path: str, mkdir_flag=False, rename=None,
+                            chunk_size=1024 * 1024):
+        """
+        下载单个文件, 写文件在线程池中进行, 不阻塞事件循环
+
+        :param file_path: 需要下载的文件路径
+        :param save_path: 保存路径
+        :param mkdir_flag: 当保存路径不存在时是否创建路径，如果为True则自动创建路径，默认为False
+        :param rename: 下载文件是否重命名，默认为None, 不重命名
+        :param chunk_size: 每次读取的数据大小(字节)
+        :return:
+        """
+        log.info(f'{file_path} --正在下载--> {save_path}')
+        if not os.path.exists(save_path):
+            if mkdir_flag is True:
+                os.makedirs(save_path, exist_ok=True)
+            else:
+                raise AlistException.DownloadError("保存路径不存在，请检查路径是否正确，或选择启用本函数mkdir_flag")
+        elif not os.path.isdir(save_path):
+            raise AlistException.DownloadError("保存路径不是文件夹，请检查路径是否正确")
+        save_path = os.path.abspath(save_path)
+
+        res = await self.getpath(file_path)
+        if res["code"] != 200:
+            raise AlistException.DownloadError("输入的文件路径不存在")
+        save_file_p = os.path.join(save_path, os.path.basename(file_path) if rename is None else rename)
+        total_size = res['data']['size']
+        loop = asyncio.get_running_loop()
+        async with self._transfer_sem:
+            async with self._down_s.get(res['data']['raw_url']) as down_res:
+                down_res.raise_for_status()
+                with open(save_file_p, "wb", buffering=chunk_size) as f:
+                    async for chunk in down_res.content.iter_chunked(chunk_size):
+                        await loop.run_in_executor(None, f.write, chunk)
+        size = os.path.getsize(save_file_p)
+        if size != total_size:
+            raise AlistException.DownloadError(f"下载文件大小不一致, 应为{total_size}字节, 实际为{size}字节")
+        log.info(f"下载完毕, 文件地址: {save_file_p}")
+
+    async def _put(self, data, size, filename, dst_path):
+        """
+        用/api/fs/put流式上传
+
+        :param data: 上传数据, bytes或异步生成器
+        :param size: 文件大小, 作为Content-Length
+        :param filename: 文件名
+        :param dst_path: 目标路径
+        :return: 响应结果
+        """
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'Content-Length': str(size),
+            'File-Path': parse.quote(dst_path + "/" + filename, safe="/"),
+            'As-Task': 'false',
+        }
+        async with self.s.put(self._PUT_URL, headers=headers, data=data) as res:
+            result = await res.text()
+        try:
+            res_code = json.loads(result)['code']
+        except json.decoder.JSONDecodeError:
+            raise AlistException.UploadError(f"json读取异常, result: {result}")
+        if res_code != 200:
+            raise AlistException.UploadError(result)
+        self.cache.invalidate(f'{dst_path}/{filename}')
+        return result
+
+    @staticmethod
+    async def _read_file(file_path, chunk_size):
+        """
+        在线程池中分块读取本地文件
+        """
+        loop = asyncio.get_running_loop()
+        with open(file_path, 'rb') as f:
+            while True:
+                chunk = await loop.run_in_executor(None, f.read, chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    @AioAlistException(AlistException.UploadError)
+    async def upload(self, file_path: str, dst_path: str, mkdir_flag: bool = False, rename=None,
+                     chunk_size=1024 * 1024):
+        """
+        上传文件
+        :param file_path: 上传的文件路径
+        :param dst_path: 目标路径
+        :param mkdir_flag: 当目标路径不存在时是否创建路径，如果为True则自动创建路径，默认为False
+        :param rename: 上传文件后重命名
+        :param chunk_size: 每次读取的数据大小(字节)
+        :return:
+        """
+        log.info(f"正在上传: {file_path} -> {dst_path}")
+        filename = os.path.basename(file_path)
+        dst_path = dst_path[:-1] if dst_path[-1] == "/" else dst_path
+        if not os.path.exists(file_path):
+            raise AlistException.UploadError("需要上传的文件不存在, 请检查上传的文件路径是否正确")
+        await self._prepare_dst_dir(dst_path, mkdir_flag, AlistException.UploadError)
+
+        file_size = os.path.getsize(file_path)
+        try:
+            async with self._transfer_sem:
+                await self._put(self._read_file(file_path, chunk_size), file_size, filename, dst_path)
+        except AlistException.UploadError as e:
+            # 天翼云盘判定，改非秒传上传
+            new_dst_path = cloud189_sub_path(dst_path, str(e))
+            if new_dst_path is None:
+                raise e
+            return await self.upload(file_path, new_dst_path, mkdir_flag, rename, chunk_size=chunk_size)
+        log.info(f"上传完毕, 文件地址: {dst_path}/{filename}")
+
+        if rename is not None:  # 需要rename
+            await self.rename(dst_path + '/' + filename, rename)
+
+    @AioAlistException(AlistException.UploadError)
+    async def relay(self, src_path: str, dst_path, mkdir_flag: bool = False, chunk_size=1024 * 1024, max_chunks=16):
+        """
+        中转上传, 源文件的下载数据经过有界内存缓冲直接上传到目标路径, 不写入本地磁盘
+        有多个目标路径时只下载一次, 同时上传到所有目标路径
+
+        :param src_path: 源文件路径(alist路径)
+        :param dst_path: 目标路径(可以是多个目标路径的列表)
+        :param mkdir_flag: 当目标路径不存在时是否创建路径，如果为True则自动创建路径，默认为False
+        :param chunk_size: 每块数据大小(字节)
+        :param max_chunks: 内存中每个目标最多缓存的块数
+        :return:
+        """
+        if type(dst_path) != list:
+            dst_path = [dst_path]
+        errors = await self._relay(src_path, dst_path, mkdir_flag, chunk_size, max_chunks)
+        if errors:
+            raise AlistException.UploadError(f"中转失败: { {dst: str(e) for dst, e in errors.items()} }")
+
+    async def _relay(self, src_path, dst_path_list, mkdir_flag=False, chunk_size=1024 * 1024, max_chunks=16):
+        """
+        中转上传到多个目标路径
+
+        :return: 失败的目标路径 {目标路径: 异常}
+        """
+        errors = {}
+        dst_path_list = [dst[:-1] if dst[-1] == "/" else dst for dst in dst_path_list]
+        local_path = self.local_path(src_path)
+        if local_path is not None:  # 本地存在, 直接上传本地文件
+            results = await asyncio.gather(*(self.upload(local_path, dst, mkdir_flag=mkdir_flag)
+                                             for dst in dst_path_list), return_exceptions=True)
+            return {dst: r for dst, r in zip(dst_path_list, results) if isinstance(r, Exception)}
+
+        log.info(f"正在中转: {src_path} -> {dst_path_list}")
+        filename = os.path.basename(src_path)
+        src_res = await self.getpath(src_path)
+        if src_res['code'] != 200 or src_res['data']['is_dir'] is True:
+            raise AlistException.UploadError("需要中转的源文件不存在, 请检查源文件路径是否正确")
+        file_size = src_res['data']['size']
+
+        results = await asyncio.gather(*(self._prepare_dst_dir(dst, mkdir_flag, AlistException.UploadError)
+                                         for dst in dst_path_list), return_exceptions=True)
+        for dst, r in zip(dst_path_list, results):
+            if isinstance(r, Exception):
+                errors[dst] = r
+        dst_path_list = [dst for dst in dst_path_list if dst not in errors]
+        if not dst_path_list:
+            return errors
+
+        queues = [asyncio.Queue(maxsize=max_chunks) for _ in dst_path_list]
+        closed = [False] * len(dst_path_list)
+
+        async def reader(res):
+            async for chunk in res.content.iter_chunked(chunk_size):
+                alive = False
+                for i, q in enumerate(queues):
+                    if not closed[i]:
+                        await q.put(chunk)
+                        alive = True
+                if not alive:
+                    return
+
+        async def branch(i):
+            sent = 0
+            while True:
+                chunk = await queues[i].get()
+                if chunk is None:
+                    break
+                sent += len(chunk)
+                yield chunk
+            if sent != file_size:
+                raise IOError(f"中转数据大小不一致, 应为{file_size}字节, 实际为{sent}字节")
+
+        async def put(i, dst):
+            try:
+                await self._put(branch(i) if file_size > 0 else b"", file_size, filename, dst)
+                log.info(f"中转完毕, 文件地址: {dst}/{filename}")
+            except Exception as e:
+                log.error(e)
+                errors[dst] = e
+            finally:
+                closed[i] = True
+                while not queues[i].empty():    # 放弃剩余数据, 不阻塞下载
+                    queues[i].get_nowait()
+
+        async with self._transfer_sem:
+            if file_size > 0:
+                async with self._down_s.get(src_res['data']['raw_url']) as res:
+                    res.raise_for_status()
+                    puts = [asyncio.ensure_future(put(i, dst)) for i, dst in enumerate(dst_path_list)]
+                    try:
+                        await reader(res)
+                    except Exception as e:  # 下载中断, 各分支会因数据大小不一致而失败
+                        log.error(e)
+                    finally:
+                        for i, q in enumerate(queues):
+                            if not closed[i]:
+                                await q.put(None)
+                    await asyncio.gather(*puts)
+            else:   # 空文件不需要中转
+                await asyncio.gather(*(put(i, dst) for i, dst in enumerate(dst_path_list)))
+
+        # 天翼云盘判定，改非秒传上传
+        for dst, e in list(errors.items()):
+            sub_dst = cloud189_sub_path(dst, str(e))
+            if sub_dst is not None:
+                sub_errors = await self._relay(src_path, [sub_dst], mkdir_flag, chunk_size, max_chunks)
+                if not sub_errors:
+                    errors.pop(dst)
+        return errors
+
+    async def _list(self, root, rel):
+        """
+        列出目录内容
+
+        :return: {名称: 文件信息}, 目录不存在或读取失败时返回None
+        """
+        files = await self.listdir(f"{root.rstrip('/')}/{rel}" if rel else root)
+        if files is None:
+            return None
+        return {f['name']: f for f in files}
+
+    async def check(self, src_path, dst_path, filter_file=None) -> list:
+        """
+        比较源目录和目标目录, 同一层的子目录同时比较, 结果格式与AlistDiff.check相同
+
+        :param src_path: 源目录
+        :param dst_path: 目标目录
+        :param filter_file: 排除目录文件, 与rclone的--filter-from格式相同
+        :return: 差异文件信息列表
+        """
+        log.info(f"正在比较: {src_path} <-> {dst_path}")
+        flt = SyncFilter(filter_file)
+        result = []
+
+        async def empty():
+            return {}
+
+        async def walk(rel, in_src, in_dst):
+            src_files, dst_files = await asyncio.gather(
+                self._list(src_path, rel) if in_src else empty(),
+                self._list(dst_path, rel) if in_dst else empty(),
+            )
+            lines, sub_dirs = compare_dir(rel, src_files, dst_files, flt)
+            result.extend(lines)
+            await asyncio.gather(*(walk(*sub_dir) for sub_dir in sub_dirs))
+
+        await walk("", True, True)
+        return result
+
+    @staticmethod
+    async def _try_again(sync_type, func, *args, retry_times=3):
+        """
+        同步操作重试, 失败后等待15s, 30s...再重试
+        """
+        for n in range(retry_times):
+            try:
+                return await func(*args)
+            except Exception as e:
+                log.error(e)
+                if n + 1 < retry_times:
+                    wait_time = 15 * (n + 1)
+                    log.warning(f"第{n + 1}次执行失败, 等到{wait_time}s后尝试执行第{n + 2}次")
+                    await asyncio.sleep(wait_time)
+        log.error(f"失败{retry_times}次")
+        raise AlistException.SyncError(f"进行同步操作「{sync_type}」时失败, 已重试{retry_times}次")
+
+    @AioAlistException(AlistException.SyncError)
+    async def sync(self, src_path, dst_path_list, filter_file=None, relay=False, max_workers=16):
+        """
+        简化的同步命令, 通过alist接口比较大小后自动同步所有差异, 不需要确认, 可选功能见类的说明
+        同步项失败时在全部执行完后抛出SyncError
+
+        :param src_path: 源路径
+        :param dst_path_list: 目标路径列表(可以同步多个路径，如果只输入1个路径，可以不以列表形式输入)
+        :param filter_file: 同步文件过滤器
+        :param relay: =True 使用中转上传, 源文件直接转发到目标路径, 不下载到本地缓存 默认为False
+        :param max_workers: 同时进行的同步项数量
+        """
+        if max_workers < 1:
+            raise AlistException.SyncError("你输入的并行数有问题, 最小设置为1")
+        if type(dst_path_list) != list:
+            dst_path_list = [dst_path_list]
+        if filter_file is not None:
+            filter_file = os.path.abspath(filter_file)
+
+        # 检查源同步目录和目标同步目录是否正确
+        src_res = await self.getpath(src_path, refresh=True)
+        if src_res.get('code') != 200:
+            raise AlistException.SyncError("输入的文件夹路径不存在，或输入的不是文件夹")
+        dst_results = await asyncio.gather(*(self.getpath(dst, refresh=True) for dst in dst_path_list))
+        for dst, dst_res in zip(list(dst_path_list), dst_results):
+            if dst_res["code"] != 200:
+                log.warning(f'此目标路径存在错误: {dst}')
+                dst_path_list.remove(dst)
+
+        # 所有目标路径同时比较
+        checks = await asyncio.gather(*(self.check(src_path, dst, filter_file) for dst in dst_path_list))
+        union_sync = {}
+        for dst, lines in zip(dst_path_list, checks):
+            for file_msg in lines:
+                union_sync.setdefault(file_msg, []).append(dst)
+        if not union_sync:
+            log.info("已同步")
+            return
+        for file in union_sync:
+            print(f'{file} -> {union_sync.get(file)}')
+
+        async def transfer(f, dst_list, count):
+            src_file = f"{src_path}/{f[2:]}"
+            if relay is True:
+                pending = list(dst_list)
+
+                async def relay_pending():
+                    dst_dirs = {os.path.dirname(dst + '/' + f[2:]): dst for dst in pending}
+                    errors = await self._relay(src_file, list(dst_dirs), mkdir_flag=True)
+                    for d, dst in dst_dirs.items():
+                        if d not in errors:
+                            pending.remove(dst)
+                    if errors:
+                        raise AlistException.UploadError(f"中转失败: {list(errors)}")
+                await self._try_again("relay", relay_pending)
+                return
+            cache_path = self.local_path(src_file)
+            if cache_path is None:  # 本地不存在, 先下载到缓存
+                cache_path = f"./cache/aio/{count}{src_file}"     # 同一文件可能同时是+和*同步项, 分开缓存
+                await self._try_again("download", self.download_file, src_file,
+                                      os.path.dirname(cache_path), True)
+            try:
+                await asyncio.gather(*(
+                    self._try_again("upload", self.upload, cache_path, os.path.dirname(dst + '/' + f[2:]), True)
+                    for dst in dst_list
+                ))
+            finally:
+                if cache_path.startswith("./cache/aio"):
+                    os.remove(cache_path)
+
+        async def sync_func(f, count):
+            log.info(f"正在执行第{count}/{len(union_sync)}个同步项")
+            dst_list = union_sync[f]
+            if f[0] in ("-", "*"):
+                await asyncio.gather(*(self._try_again("delete", self.delete, f"{dst}/{f[2:]}")
+                                       for dst in dst_list))
+            if f[0] in ("+", "*"):
+                await transfer(f, dst_list, count)
+
+        # 预先创建所有需要的目标目录
+        plan_dirs = {
+            os.path.dirname(dst + '/' + file[2:])
+            for file, dst_list in union_sync.items() if file[0] in ("+", "*")
+            for dst in dst_list
+        }
+        results = await asyncio.gather(*(self.mkdir(d) for d in plan_dirs), return_exceptions=True)
+        for r in results:
+            if isinstance(r, Exception):    # 创建失败的目录在上传时会再次尝试
+                log.error(r)
+
+        # 固定数量的工作协程从有界队列中取同步项执行
+        shutil.rmtree('./cache/aio', ignore_errors=True)     # 与AlistV3分开, 不清除AlistV3任务日志保留的缓存
+        errors = []
+        q = asyncio.Queue(maxsize=max_workers * 2)
+
+        async def worker():
+            while True:
+                item = await q.get()
+                try:
+                    if item is None:
+                        return
+                    await sync_func(*item)
+                except Exception as e:
+                    log.error(e)
+                    errors.append((item, e))
+                finally:
+                    q.task_done()
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(max_workers)]
+        try:
+            for c, file in enumerate(union_sync, start=1):
+                if file[0] == "!":
+                    continue
+                await q.put((file, c))
+            for _ in workers:
+                await q.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for w in workers:
+                w.cancel()
+        if errors:
+            log.error(f"同步完成, 其中{len(errors)}/{len(union_sync)}个同步项失败")
+            raise AlistException.SyncError(f"{len(errors)}/{len(union_sync)}个同步项失败")
+        else:
+            log.info(f"同步完成, 共{len(union_sync)}个同步项")
+
+
+class BlockingAlistV3:
+    """
+    AioAlistV3的同步包装, 在后台线程中运行事件循环, 方法与AioAlistV3相同, 调用时阻塞直到完成
+    功能范围与AioAlistV3相同, 不是AlistV3的替代
+    使用方式:
+        with BlockingAlistV3(user, passwd) as a:
+            a.sync(src_path, dst_path_list)
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        参数与AioAlistV3相同
+        """
+        self.client = AioAlistV3(*args, **kwargs)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="aioalist-loop", daemon=True)
+        self._thread.start()
+        try:
+            self._run(self.client.open())
+        except Exception:
+            self._stop()
+            raise
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def wrapper(*args, **kwargs):
+            return self._run(attr(*args, **kwargs))
+        return wrapper
+
+    def _stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def close(self):
+        """
+        关闭连接池并停止事件循环
+        """
+        if self._loop.is_closed():
+            return
+        self._run(self.client.close())
+        self._stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -13,13 +13,35 @@ import threading
 import random
 import time
 import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 from copy import deepcopy
 from urllib import parse
+from requests.adapters import HTTPAdapter
 from requests_toolbelt.multipart.encoder import MultipartEncoder
 
 from common.log import log
+from common.cache import ListCache
+from common.consistency import ConsistencyWait
+from common.diff import AlistDiff
+from common.hashcache import HashCache
+from common.index import SyncIndex
+from common.journal import SyncJournal
+from common.metrics import Metrics
+from common.moves import MoveDetector
 from common.down import Downloader
 from common.rclone import RcloneOperation
+from common.ratelimit import RateLimiter
+from common.relay import RelayStream
+from common.scheduler import SyncScheduler
+from common.storage import cloud189_sub_path, local_path
+from common.task import TaskWatcher
+from common.walker import AlistWalker
+
+try:
+    import ijson    # 可选依赖, 安装后逐个解析目录内容, 否则每页整体解析
+except ImportError:
+    ijson = None
 
 TrackPrintEnable = True
 
@@ -215,8 +237,6 @@ class AlistV3:
         'sec-ch-ua-mobile': '?0',
         'sec-ch-ua-platform': '"Windows"',
     }
-    # 请求会话
-    s = requests.session()
 
     @AlistException(AlistException.InitError)
     def _init(self, user, passwd):
@@ -232,6 +252,7 @@ class AlistV3:
         self._MOVE_URL = f"{self._MAIN_URL}/api/fs/move"
         self._COPY_URL = f"{self._MAIN_URL}/api/fs/copy"
         self._UPLOAD_URL = f"{self._MAIN_URL}/api/fs/form"
+        self._PUT_URL = f"{self._MAIN_URL}/api/fs/put"
         self._login(user, passwd)  # 登录
 
     def _login(self, user, passwd):
@@ -240,22 +261,124 @@ class AlistV3:
             'password': passwd,
             'otp_code': '',
         }
-        res = self.s.post(self._LOGIN_URL, headers=self._HEADERS, json=json_data)
+        res = self.s.post(self._LOGIN_URL, json=json_data)
         if res.status_code == 200:
-            self._HEADERS['Authorization'] = json.loads(res.text).get("data").get("token")
-            self.s.headers = self._HEADERS
+            self.s.headers['Authorization'] = json.loads(res.text).get("data").get("token")
         else:
             raise AlistException.InitError("登录失败，密码可能错误，或者账号权限不足。")
 
-    def __init__(self, user, passwd, alist_url=None, local_driver=None):
+    def __init__(self, user, passwd, alist_url=None, local_driver=None, cache_ttl=60, cache_size=4096,
+                 rate_limit=None, consistency=None, pool_size=16, hash_cache=None, hash_workers=None,
+                 list_per_page=1000, task_api="/api/admin/task", metrics_port=None, metrics_file=None):
+        """
+        :param user: alist用户名
+        :param passwd: alist密码
+        :param alist_url: alist地址
+        :param local_driver: 本地挂载的存储, {alist目录: 本地目录}
+        :param cache_ttl: 路径信息缓存有效时间(秒), 为0时不缓存
+        :param cache_size: 路径信息缓存最大条目数
+        :param rate_limit: 各存储的限速配置, 例如 {"/Real/Cloud189": {"rps": 5, "files_per_hour": 500, "bytes_per_day": 100 * 1024 ** 3}}
+                           按最长前缀匹配存储, "default"为其余存储的限速, 默认为None, 不限速
+        :param consistency: 各存储的一致性等待配置, 例如 {"/Real/Cloud189": {"initial": 0.5, "timeout": 30, "refresh": True}}
+                            操作后按配置轮询直到结果生效, 匹配方式同rate_limit, 默认为None, 使用ConsistencyWait.DEFAULT
+        :param pool_size: 连接池大小, sync时会按thread_max_num自动扩大
+        :param hash_cache: 本地文件哈希缓存文件(SQLite), 默认为None, 只缓存在内存中
+        :param hash_workers: 计算本地文件哈希的进程数, 默认为CPU核数
+        :param list_per_page: 列出目录时每页的数量, 为0时一次列出整个目录
+        :param task_api: alist任务接口前缀, 等待复制和上传任务时使用, 需要管理员权限
+        :param metrics_port: 指标服务端口, 设置后可以通过 http://127.0.0.1:port/metrics 读取Prometheus格式的指标, 默认为None, 不启动
+        :param metrics_file: 指标文件路径, 设置后每15秒写入一次Prometheus格式的指标, 默认为None, 不写入
+        """
         if alist_url is not None:
             self._MAIN_URL = alist_url
         if local_driver is None:
             self.local_driver = {}
         else:
             self.local_driver = local_driver
+        self.cache = ListCache(ttl=cache_ttl, max_size=cache_size)
+        self.list_per_page = list_per_page
+        self._known_dirs = set()     # 已确认存在的目录, 上传时不再检查
+        self._known_dirs_lock = threading.Lock()
+        # 请求会话, 每个实例单独使用, alist接口请求带登录token, 下载raw_url的请求不带
+        self.s = requests.session()
+        self.s.headers.update(self._HEADERS)
+        self._down_s = requests.session()
+        # 每个请求都记录请求数和耗时, 存储按限速和一致性配置中的存储路径区分
+        self.metrics = Metrics(storages=list(rate_limit or {}) + list(consistency or {}))
+        for s in (self.s, self._down_s):
+            s.hooks['response'].append(self.metrics.response_hook)
+        if metrics_port is not None:
+            self.metrics.serve(metrics_port)
+        if metrics_file is not None:
+            self.metrics.export_file(metrics_file)
+        self.pool_size = 0
+        self._resize_pool(pool_size)
+        self.hash_cache = HashCache(hash_cache, workers=hash_workers)
+        self.task_watcher = TaskWatcher(self, task_api=task_api)
+        try:
+            self.rate_limiter = RateLimiter(rate_limit)
+            self.consistency = ConsistencyWait(consistency)
+        except ValueError as e:
+            raise AlistException.InitError(str(e))
         self._init(user, passwd)
 
+    def _resize_pool(self, pool_size):
+        """
+        扩大连接池, 连接池小于同时进行的请求数时, 多出的连接用完即丢弃, 下次请求要重新建立连接
+        替换前关闭旧的连接池, 正在使用的连接在请求结束后关闭
+
+        :param pool_size: 连接池大小, 只增不减
+        """
+        if pool_size <= self.pool_size:
+            return
+        self.pool_size = pool_size
+        for s in (self.s, self._down_s):
+            for prefix in ("http://", "https://"):
+                s.get_adapter(prefix).close()
+                s.mount(prefix, HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+
+    def local_path(self, path):
+        """
+        alist路径在local_driver中对应的本地路径
+
+        :param path: alist路径
+        :return: 本地路径, 不在local_driver中时返回None
+        """
+        return local_path(path, self.local_driver)
+
+    def _wait_exists(self, path, exists=True):
+        """
+        等待路径在alist中出现(或消失), 生效后立即返回, 等待方式由consistency配置决定
+        超时仍未生效时抛出GetPathError, 由调用方的异常装饰器转换为对应操作的异常
+
+        :param path: alist路径
+        :param exists: 为True时等待路径出现, 为False时等待路径消失
+        :return:
+        """
+        refresh = self.consistency.get(path)["refresh"]
+        dir_path, name = os.path.dirname(path), os.path.basename(path)
+
+        def check():
+            self.cache.invalidate(path)
+            return (name in self._existing_names(dir_path, [name], refresh=refresh)) is exists
+        if not self.consistency.wait(path, check, desc=f"{'创建' if exists else '删除'}{path}"):
+            raise AlistException.GetPathError(f"等待{'创建' if exists else '删除'}生效超时: {path}")
+
+    def _remove_local(self, file_path):
+        """
+        删除本地临时文件, 文件仍被占用时按退避重试
+
+        :param file_path: 本地文件路径
+        """
+        def check():
+            try:
+                os.remove(file_path)
+                return True
+            except PermissionError:
+                return False
+        if not self.consistency.wait("", check, desc=f"删除临时文件{file_path}"):
+            raise PermissionError(f"临时文件被占用, 无法删除: {file_path}")
+
     @AlistException(AlistException.RenameError)
     def rename(self, file_p, newname):
         """
@@ -266,59 +389,209 @@ class AlistV3:
         """
         file_dir = os.path.dirname(file_p)
         self.getpath(file_dir)  # 刷新需要重命名的目录
-        time.sleep(0.5)     # 等待
         json_data = {
             'name': newname,
             'path': file_p,
         }
+        self.rate_limiter.request(file_p)
         res = self.s.post(self._RENAME_URL, json=json_data).text
         if json.loads(res)['code'] == 200:
             log.info(f"{file_p} --已重命名--> {newname}")
-            self.getpath(file_dir)  # 刷新需要重命名的目录
-            time.sleep(0.5)  # 等待
+            self._forget_dirs(file_p)
+            self.cache.invalidate(file_p, recursive=True)
+            self.cache.invalidate(f"{file_dir}/{newname}")
+            self._wait_exists(f"{file_dir}/{newname}")     # 等待重命名生效
             return
         else:
             raise AlistException.RenameError(f"重命名失败, 响应结果: {res}")
 
     @AlistException(AlistException.GetPathError)
-    def getpath(self, dst_path) -> dict:
+    def getpath(self, dst_path, refresh=False) -> dict:
         """
-        获取alist的路径信息, 获取时会自动刷新路径信息
+        获取alist的路径信息, 优先读取缓存, 缓存未命中或过期时才请求alist
 
         :param dst_path: 需要获取的目标路径信息
+        :param refresh: 为True时跳过缓存, 并让alist刷新上级目录和本目录
         :return:
         """
+        if refresh is False:
+            res = self.cache.get(dst_path)
+            if res is not None:
+                return res
         dst_dir = os.path.dirname(dst_path)
-        json_data = {
-            'path': dst_dir,
-            'password': '',
-            'page': 1,
-            'per_page': 0,
-            'refresh': True,
-        }
-        res_list = self.s.post(self._LIST_URL, json=json_data).text
-        res_list = json.loads(res_list)
-        if res_list.get('code') != 200:  # 上级目录刷新失败，说明不存在上级目录，则刷新再上一级目录
-            time.sleep(1)           # 防止递归嵌套频繁请求
-            self.getpath(dst_dir)
+        if refresh is True:
+            json_data = {
+                'path': dst_dir,
+                'password': '',
+                'page': 1,
+                'per_page': 0,
+                'refresh': True,
+            }
+            self.rate_limiter.request(dst_dir)
+            res_list = self.s.post(self._LIST_URL, json=json_data).text
+            res_list = json.loads(res_list)
+            if res_list.get('code') != 200:  # 上级目录刷新失败，说明不存在上级目录，则刷新再上一级目录
+                self.getpath(dst_dir, refresh=True)     # 请求频率由rate_limiter控制
         json_data = {
             'path': dst_path,
             'password': '',
         }
+        self.rate_limiter.request(dst_path)
         res = self.s.post(self._GET_URL, json=json_data).text
         res = json.loads(res)
         if res.get('code') == 200 and res.get('data').get('is_dir') is True:
+            files = self.listdir(dst_path, refresh=refresh)
+            if files is None:
+                raise AlistException.GetPathError(f"列出目录失败: {dst_path}")
+            res['data']['files'] = files
+        if res.get('code') == 200:
+            self.cache.set(dst_path, res)
+        return res
+
+    def _iter_page(self, json_data, meta):
+        """
+        请求一页目录内容, 逐个返回文件信息, 响应码和文件总数写入meta
+        安装了ijson时边接收边解析, 不需要把整个响应读入内存
+
+        :param json_data: /api/fs/list的请求参数
+        :param meta: 接收响应码(code)和文件总数(total)的字典
+        """
+        if ijson is None:
+            res = json.loads(self.s.post(self._LIST_URL, json=json_data).text)
+            meta['code'] = res.get('code')
+            if res.get('code') == 200:
+                meta['total'] = res['data']['total']
+                yield from res['data']['content'] or []
+            return
+        with self.s.post(self._LIST_URL, json=json_data, stream=True) as res:
+            res.raw.decode_content = True
+            builder = None
+            for prefix, event, value in ijson.parse(res.raw, use_float=True):
+                if builder is not None:
+                    builder.event(event, value)
+                    if prefix == 'data.content.item' and event == 'end_map':
+                        yield builder.value
+                        builder = None
+                elif prefix == 'data.content.item' and event == 'start_map':
+                    builder = ijson.ObjectBuilder()
+                    builder.event(event, value)
+                elif prefix == 'code':
+                    meta['code'] = value
+                elif prefix == 'data.total':
+                    meta['total'] = value
+
+    def _iter_pages(self, dir_path, refresh, per_page, meta):
+        """
+        按页请求/api/fs/list, 逐个返回文件信息, 响应码写入meta
+        """
+        per_page = self.list_per_page if per_page is None else per_page
+        page = 1
+        while True:
             json_data = {
-                'path': dst_path,
+                'path': dir_path,
                 'password': '',
-                'page': 1,
-                'per_page': 0,
-                'refresh': True,
+                'page': page,
+                'per_page': per_page,
+                'refresh': refresh if page == 1 else False,     # 只在第一页刷新
             }
-            res_dst_list = self.s.post(self._LIST_URL, json=json_data).text
-            res_dst_list = json.loads(res_dst_list)
-            res['data']['files'] = res_dst_list['data']['content']
-        return res
+            self.rate_limiter.request(dir_path)
+            count = 0
+            for f in self._iter_page(json_data, meta):
+                count += 1
+                yield f
+            if meta.get('code') != 200 or per_page == 0 or count < per_page or page * per_page >= meta.get('total', 0):
+                return
+            page += 1
+
+    def iterdir(self, dir_path, refresh=False, per_page=None):
+        """
+        按页列出目录下的文件和文件夹, 逐个返回, 内存占用与目录大小无关, 不读写缓存
+
+        :param dir_path: 目录路径
+        :param refresh: 是否让alist刷新目录
+        :param per_page: 每页数量, 默认为list_per_page, 为0时一次列出整个目录
+        :return: 文件信息的迭代器, 目录不存在时遍历结束后抛出GetPathError
+        """
+        meta = {}
+        yield from self._iter_pages(dir_path, refresh, per_page, meta)
+        if meta.get('code') != 200:
+            raise AlistException.GetPathError(f"目录不存在: {dir_path}")
+
+    @AlistException(AlistException.GetPathError)
+    def listdir(self, dir_path, refresh=False):
+        """
+        列出目录下的文件和文件夹, 按list_per_page分页请求/api/fs/list
+
+        :param dir_path: 目录路径
+        :param refresh: 是否让alist刷新目录
+        :return: 目录内容列表, 目录不存在时返回None
+        """
+        if refresh is False:
+            res = self.cache.get(dir_path)
+            if res is not None and 'files' in res['data']:
+                return res['data']['files'] or []
+        meta = {}
+        files = list(self._iter_pages(dir_path, refresh, None, meta))
+        if meta.get('code') != 200:
+            return None
+        return files
+
+    def walk(self, dir_path, max_workers=16):
+        """
+        并行遍历目录树, 同时列出多个目录, 详见AlistWalker
+
+        :param dir_path: 根目录
+        :param max_workers: 同时列出的最大目录数
+        :return: (路径, 大小, 修改时间, 是否为目录)的迭代器, 不包括根目录本身
+        """
+        self._resize_pool(max_workers)
+        return AlistWalker(self, max_workers=max_workers).walk(dir_path)
+
+    @AlistException(AlistException.GetPathError)
+    def _existing_names(self, dir_path, names, is_dir=None, refresh=False) -> set:
+        """
+        找出目录中存在的名称, 按页列出目录, 只保留要找的名称, 全部找到后不再请求后面的页
+
+        :param dir_path: 目录路径
+        :param names: 要找的名称
+        :param is_dir: 为True时只找目录, 为False时只找文件, 默认为None, 都找
+        :param refresh: 是否让alist刷新目录
+        :return: 存在的名称集合, 目录不存在时返回空集合
+        """
+        names = set(names)
+        files = None
+        if refresh is False:
+            res = self.cache.get(dir_path)
+            if res is not None and 'files' in res['data']:
+                files = res['data']['files'] or []
+        if files is None:
+            files = self._iter_pages(dir_path, refresh, None, {})
+        found = set()
+        for f in files:
+            if f['name'] in names and (is_dir is None or f['is_dir'] is is_dir):
+                found.add(f['name'])
+                if len(found) == len(names):
+                    break
+        return found
+
+    def _dir_known(self, dir_path):
+        """
+        目录是否已确认存在
+        """
+        with self._known_dirs_lock:
+            return dir_path.replace("\\", "/").rstrip("/") in self._known_dirs
+
+    def _add_known_dir(self, dir_path):
+        with self._known_dirs_lock:
+            self._known_dirs.add(dir_path.replace("\\", "/").rstrip("/"))
+
+    def _forget_dirs(self, path):
+        """
+        路径被删除或移动后, 清除该路径及其子目录的已存在记录
+        """
+        path = path.replace("\\", "/").rstrip("/")
+        with self._known_dirs_lock:
+            self._known_dirs = {d for d in self._known_dirs if d != path and not d.startswith(path + "/")}
 
     @AlistException(AlistException.MkdirError)
     def mkdir(self, file_path):
@@ -328,9 +601,13 @@ class AlistV3:
         :return:
         """
         file_path = file_path.replace("\\", "/")
+        if self._dir_known(file_path):
+            return f"目录已存在: {file_path}"
         # 检测目录是否存在
         res = self.getpath(file_path)
         if res['code'] == 200:
+            if res['data']['is_dir'] is True:
+                self._add_known_dir(file_path)
             return f"目录已存在: {file_path}"
 
         # 检测上级目录是否存在, 不存在则创建
@@ -341,14 +618,90 @@ class AlistV3:
         json_data = {
             'path': file_path,
         }
+        self.rate_limiter.request(file_path)
         response = self.s.post(self._MKDIR_URL, json=json_data)
         if json.loads(response.text)['code'] == 200:
             log.info(f"已创建alist文件夹: {file_path}")
-            time.sleep(3)   # 等待3秒
+            self.cache.invalidate(file_path)
+            self._add_known_dir(file_path)
+            self._wait_exists(file_path)    # 等待目录创建生效
             return
         else:
             raise AlistException.MkdirError(f"创建目录失败, 响应结果: {response.text}")
 
+    @AlistException(AlistException.MkdirError)
+    def mkdirs(self, dir_list, max_workers=4):
+        """
+        批量创建目录, 先算出所有需要的目录(包括上级目录), 再按层级从上往下创建, 同一层级的目录并行创建
+        每个上级目录按页列出一次内容来判断子目录是否存在, 创建过或确认存在的目录会被记录, 之后上传时不再检查
+
+        :param dir_list: 目录列表
+        :param max_workers: 同一层级同时创建的最大数量
+        :return: 新创建的目录数
+        """
+        # 所有需要的目录, 包括上级目录
+        all_dirs = set()
+        for dir_path in dir_list:
+            dir_path = dir_path.replace("\\", "/").rstrip("/")
+            while dir_path and dir_path != "/" and dir_path not in all_dirs:
+                all_dirs.add(dir_path)
+                dir_path = os.path.dirname(dir_path)
+        levels = {}     # 层级 -> {上级目录: [目录名]}
+        for dir_path in all_dirs:
+            if self._dir_known(dir_path):
+                continue
+            levels.setdefault(dir_path.count("/"), {}).setdefault(os.path.dirname(dir_path), []).append(
+                os.path.basename(dir_path))
+
+        created = 0
+
+        def create(dir_path):
+            json_data = {
+                'path': dir_path,
+            }
+            self.rate_limiter.request(dir_path)
+            response = self.s.post(self._MKDIR_URL, json=json_data)
+            if json.loads(response.text)['code'] != 200:
+                raise AlistException.MkdirError(f"创建目录失败: {dir_path}, 响应结果: {response.text}")
+            log.info(f"已创建alist文件夹: {dir_path}")
+            self.cache.invalidate(dir_path)
+
+        def confirm(parent, names):
+            """
+            下一层级创建前确认本层级的目录已生效, 每个上级目录每轮只列出一次
+            """
+            refresh = self.consistency.get(parent)["refresh"]
+
+            def check():
+                self.cache.invalidate(parent)
+                return set(names) <= self._existing_names(parent, names, is_dir=True, refresh=refresh)
+            if not self.consistency.wait(parent, check, desc=f"在{parent}中创建{len(names)}个目录"):
+                raise AlistException.MkdirError(f"创建目录未生效: {parent}, {names}")
+            for name in names:
+                self._add_known_dir(f"{parent.rstrip('/')}/{name}")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for level in sorted(levels):
+                # 每个上级目录列出一次, 找出不存在的目录
+                missing = {}    # 上级目录 -> [不存在的目录名]
+                for parent, names in levels[level].items():
+                    exist = self._existing_names(parent, names, is_dir=True)
+                    for name in names:
+                        dir_path = f"{parent.rstrip('/')}/{name}"
+                        if name in exist:
+                            self._add_known_dir(dir_path)
+                        else:
+                            missing.setdefault(parent, []).append(name)
+                futures = [pool.submit(create, f"{parent.rstrip('/')}/{name}")
+                           for parent, names in missing.items() for name in names]
+                for future in as_completed(futures):
+                    future.result()
+                for future in as_completed([pool.submit(confirm, parent, names)
+                                            for parent, names in missing.items()]):
+                    future.result()
+                created += len(futures)
+        return created
+
     @AlistException(AlistException.DelError)
     def delete(self, file_path):
         """
@@ -369,13 +722,54 @@ class AlistV3:
             ],
             'dir': folder_path,
         }
+        self.rate_limiter.request(file_path)
         res = self.s.post(self._DEL_URL, json=json_data).text
         if json.loads(res)['code'] == 200:
             log.info(f"已删除alist文件: {file_path}")
+            self._forget_dirs(file_path)
+            self.cache.invalidate(file_path, recursive=True)
             return
         else:
             raise AlistException.DelError(f"删除失败, 响应结果: {res}")
 
+    @AlistException(AlistException.DelError)
+    def delete_many(self, file_path_list, batch_size=1000) -> list:
+        """
+        批量删除, 按所在目录分组, 每个目录只列出一次目录内容检查是否存在, 并用一个请求删除多个文件
+
+        :param file_path_list: 文件路径列表
+        :param batch_size: 每个删除请求最多包含的文件数
+        :return: 不存在的文件路径列表
+        """
+        groups = {}     # 目录 -> 文件名列表
+        for file_path in file_path_list:
+            file_path = file_path.replace("\\", "/")
+            groups.setdefault(os.path.dirname(file_path), []).append(os.path.basename(file_path))
+
+        missing = []
+        for folder_path, names in groups.items():
+            exist_names = self._existing_names(folder_path, names)
+            for name in names:
+                if name not in exist_names:
+                    log.warning(f"要删除的文件不存在: {folder_path}/{name}")
+                    missing.append(f"{folder_path}/{name}")
+            names = [name for name in dict.fromkeys(names) if name in exist_names]
+            for i in range(0, len(names), batch_size):
+                batch = names[i:i + batch_size]
+                json_data = {
+                    'names': batch,
+                    'dir': folder_path,
+                }
+                self.rate_limiter.request(folder_path)
+                res = self.s.post(self._DEL_URL, json=json_data).text
+                if json.loads(res)['code'] != 200:
+                    raise AlistException.DelError(f"批量删除失败, 目录: {folder_path}, 响应结果: {res}")
+                log.info(f"已删除alist文件夹{folder_path}中的{len(batch)}个文件")
+                for name in batch:
+                    self._forget_dirs(f"{folder_path}/{name}")
+                    self.cache.invalidate(f"{folder_path}/{name}", recursive=True)
+        return missing
+
     def __local_copy(self, src_path, dst_dir, mkdir_flag=True):
         """
         本地复制，会把文件下载到本地，然后再上传，配置变量LocalDriver后如果移动发生在alist链接目录, 则可免下载上传
@@ -387,16 +781,15 @@ class AlistV3:
         """
         name = os.path.basename(src_path)
 
-        basedir = src_path[:src_path[1:].find("/") + 1]
-        if basedir in self.local_driver:  # 本地存在, 直接对本地进行操作
-            local_p = self.local_driver[basedir]
-            self.upload(src_path.replace(basedir, local_p), dst_dir, mkdir_flag=mkdir_flag)
-            time.sleep(1)
+        local_p = self.local_path(src_path)
+        if local_p is not None:  # 本地存在, 直接对本地进行操作
+            self.upload(local_p, dst_dir, mkdir_flag=mkdir_flag)
+            self._wait_exists(f"{dst_dir}/{name}")
         else:
             self.download_file(src_path, save_path="../cache", mkdir_flag=mkdir_flag)
             self.upload(f"./cache/{name}", dst_dir, mkdir_flag=mkdir_flag)
-            time.sleep(1)
-            os.remove(f"./cache/{name}")
+            self._wait_exists(f"{dst_dir}/{name}")
+            self._remove_local(f"./cache/{name}")
             log.info(f"已删除临时文件./cache/{name}")
             log.info("跨账号文件复制成功")
 
@@ -432,67 +825,211 @@ class AlistV3:
                 name,
             ],
         }
+        self.rate_limiter.request(src_path)
         res = self.s.post(self._MOVE_URL, json=json_data).text
         if json.loads(res)["code"] == 200:  # 跨存储账号移动
             log.info("同账号文件移动操作成功")
+            self._forget_dirs(src_path)
+            self.cache.invalidate(src_path, recursive=True)
+            self.cache.invalidate(f"{dst_dir}/{name}")
             return 1
         elif json.loads(res)["code"] == 500 and "between two storages" in json.loads(res)["message"]:
             log.info("这是跨账号移动")
             if local_move is False:  # 不允许使用本地移动，直接退出，返回移动失败状态数0
                 return 0
-            self.__local_copy(src_path, dst_dir, mkdir_flag)    # 开始本地移动
-            time.sleep(1)
+            self.__local_copy(src_path, dst_dir, mkdir_flag)    # 开始本地移动, 复制生效后才返回
             self.delete(src_path)   # 因为是移动操作，在复制成功后，删除源文件
         else:
             raise AlistException.MoveError(res)
 
+    @staticmethod
+    def _response_tasks(res, task_type):
+        """
+        响应中alist创建的后台任务
+
+        :param res: 响应内容
+        :param task_type: 任务类型, copy/upload
+        :return: [(任务类型, 任务信息)]
+        """
+        data = json.loads(res).get('data') or {}
+        tasks = data.get('tasks') or ([data['task']] if data.get('task') else [])
+        return [(task_type, task) for task in tasks]
+
+    def wait_tasks(self, tasks, timeout=None) -> dict:
+        """
+        等待alist的后台任务完成, 多个任务一起批量查询状态并输出进度
+
+        :param tasks: [(任务类型, 任务信息)], copy/upload等接口返回的任务
+        :param timeout: 最长等待时间(秒), 默认为None, 一直等待
+        :return: {任务id: 最终的任务信息}, 无法查询或超时的任务为None
+        """
+        return self.task_watcher.wait(tasks, timeout=timeout)
+
+    def _failed_tasks(self, tasks, timeout=None) -> list:
+        """
+        等待任务完成, 返回失败的任务名, 无法确认结果的任务不算失败
+        """
+        results = self.wait_tasks(tasks, timeout=timeout)
+        return [info.get('name') for info in results.values()
+                if info is not None and info.get('state') != TaskWatcher.SUCCEEDED]
+
     @AlistException(AlistException.CopyError)
-    def copy(self, src_path, dst_dir, mkdir_flag=True, local_copy=False):
+    def copy(self, src_path, dst_dir, mkdir_flag=True, local_copy=False, wait=True):
         """
-        复制文件, 支持跨账号复制
+        复制文件, 支持跨账号复制, 由alist的复制接口完成, 跨账号复制时alist在服务端创建复制任务, 不经过本地
 
         :param src_path: 源文件地址
         :param dst_dir: 目标目录地址
         :param mkdir_flag: 没有文件夹时是否创建文件夹
-        :param local_copy: 跨账号复制时是否使用本地复制。(默认True)为True时，此时复制是下载到本地并上传到另一个存储空间。为False时，使用alist的跨盘复制功能
-        :return: =1成功， =0失败
+        :param local_copy: 是否使用本地复制。(默认False)为True时，下载到本地再上传，源文件在local_driver中时直接从本地上传
+        :param wait: 是否等待alist的复制任务完成, 为False时提交任务后立即返回
+        :return: =1成功
         """
         log.info(f"{src_path} --copy--> {dst_dir}")
+        self._prepare_dst_dir(dst_dir, mkdir_flag, AlistException.CopyError)
+        if local_copy is True:
+            self.__local_copy(src_path, dst_dir, mkdir_flag)    # 开始本地复制
+            return 1
+
+        src_dir = os.path.dirname(src_path)
+        name = os.path.basename(src_path)
+        json_data = {
+            'src_dir': src_dir,
+            'dst_dir': dst_dir,
+            'names': [
+                name,
+            ],
+        }
+        self.rate_limiter.request(src_path)
+        res = self.s.post(self._COPY_URL, json=json_data)
+        if res.status_code != 200 or json.loads(res.text)["code"] != 200:
+            raise AlistException.CopyError(res.text)
+        self.cache.invalidate(f"{dst_dir}/{name}")
+        if wait is True:
+            tasks = self._response_tasks(res.text, "copy")
+            if tasks and self._failed_tasks(tasks):
+                raise AlistException.CopyError(f"alist复制任务失败: {src_path}")
+            self._wait_exists(f"{dst_dir}/{name}")     # 等待复制生效
+        return 1
+
+    def _prepare_dst_dir(self, dst_dir, mkdir_flag, exp):
+        """
+        检查目标目录是否存在, 不存在时按mkdir_flag创建
+
+        :param dst_dir: 目标目录
+        :param mkdir_flag: 没有文件夹时是否创建文件夹
+        :param exp: 出错时抛出的异常类型
+        """
+        if self._dir_known(dst_dir):
+            return
         with lock:
-            # 目标路径是否存在
             dst_path_res = self.getpath(dst_dir)
             if dst_path_res['code'] != 200:
                 if mkdir_flag is False:
-                    raise AlistException.CopyError("目标路径不存在，请检查目标路径是否正确，或选择启用本函数mkdir_flag")
+                    raise exp("目标路径不存在，请检查目标路径是否正确，或选择启用本函数mkdir_flag")
                 self.mkdir(dst_dir)
+            elif dst_path_res['data']['is_dir'] is False:
+                raise exp("目标路径实际为文件，请确认输入是否正确")
             else:
-                if dst_path_res['data']['is_dir'] is False:
-                    raise AlistException.CopyError("目标路径实际为文件，请确认输入是否正确")
+                self._add_known_dir(dst_dir)
+
+    @staticmethod
+    def _group_by_dir(src_path_list, batch_size):
+        """
+        按所在目录分组, 每组最多batch_size个文件
+
+        :return: [(目录, [文件名, ...]), ...]
+        """
+        groups = {}
+        for src_path in src_path_list:
+            src_path = src_path.replace("\\", "/")
+            groups.setdefault(os.path.dirname(src_path), []).append(os.path.basename(src_path))
+        return [
+            (src_dir, names[i:i + batch_size])
+            for src_dir, names in groups.items()
+            for i in range(0, len(names), batch_size)
+        ]
+
+    @AlistException(AlistException.MoveError)
+    def move_many(self, src_path_list, dst_dir, mkdir_flag=True, local_move=True, batch_size=1000) -> int:
+        """
+        批量移动文件, 按源目录分组, 每组用一个请求移动
+
+        :param src_path_list: 源文件地址列表
+        :param dst_dir: 目标目录地址
+        :param mkdir_flag: 没有文件夹时是否创建文件夹
+        :param local_move: 跨账号移动时是否逐个使用本地移动, 为False时跨账号的文件不移动
+        :param batch_size: 每个请求最多包含的文件数
+        :return: 移动成功的文件数
+        """
+        log.info(f"{len(src_path_list)}个文件 --move--> {dst_dir}")
+        self._prepare_dst_dir(dst_dir, mkdir_flag, AlistException.MoveError)
+        moved = 0
+        for src_dir, names in self._group_by_dir(src_path_list, batch_size):
+            json_data = {
+                'src_dir': src_dir,
+                'dst_dir': dst_dir,
+                'names': names,
+            }
+            self.rate_limiter.request(src_dir)
+            res = self.s.post(self._MOVE_URL, json=json_data).text
+            res_json = json.loads(res)
+            if res_json["code"] == 200:
+                log.info(f"已移动{src_dir}中的{len(names)}个文件")
+                moved += len(names)
+                for name in names:
+                    self._forget_dirs(f"{src_dir}/{name}")
+                    self.cache.invalidate(f"{src_dir}/{name}", recursive=True)
+                    self.cache.invalidate(f"{dst_dir}/{name}")
+            elif res_json["code"] == 500 and "between two storages" in res_json["message"]:
+                log.info("这是跨账号移动")
+                if local_move is False:
+                    continue
+                for name in names:
+                    self.move(f"{src_dir}/{name}", dst_dir, mkdir_flag, local_move=True)
+                    moved += 1
+            else:
+                raise AlistException.MoveError(res)
+        return moved
+
+    @AlistException(AlistException.CopyError)
+    def copy_many(self, src_path_list, dst_dir, mkdir_flag=True, batch_size=1000, wait=False) -> int:
+        """
+        批量复制文件, 按源目录分组, 每组用一个请求复制, 跨账号复制由alist的复制任务完成
 
-        move_result = self.move(src_path, dst_dir, mkdir_flag, local_move=False)    # 尝试移动，如果是跨账号，则无法移动成功
-        if move_result == 1:    # 移动成功，说明是同存储账号，开始还原源目录
-            time.sleep(1)   # 等待1秒
-            src_dir = os.path.dirname(src_path)
-            name = os.path.basename(src_path)
+        :param src_path_list: 源文件地址列表
+        :param dst_dir: 目标目录地址
+        :param mkdir_flag: 没有文件夹时是否创建文件夹
+        :param batch_size: 每个请求最多包含的文件数
+        :param wait: 是否等待所有复制任务完成, 默认为False, 提交后立即返回
+        :return: 提交复制的文件数, wait为True时为复制成功的文件数
+        """
+        log.info(f"{len(src_path_list)}个文件 --copy--> {dst_dir}")
+        self._prepare_dst_dir(dst_dir, mkdir_flag, AlistException.CopyError)
+        copied = 0
+        tasks = []
+        for src_dir, names in self._group_by_dir(src_path_list, batch_size):
             json_data = {
-                'src_dir': dst_dir,
-                'dst_dir': src_dir,
-                'names': [
-                    name,
-                ],
+                'src_dir': src_dir,
+                'dst_dir': dst_dir,
+                'names': names,
             }
+            self.rate_limiter.request(src_dir)
             res = self.s.post(self._COPY_URL, json=json_data)
             if res.status_code == 200 and json.loads(res.text)["code"] == 200:
-                return 1
+                log.info(f"已复制{src_dir}中的{len(names)}个文件")
+                copied += len(names)
+                tasks += self._response_tasks(res.text, "copy")
+                for name in names:
+                    self.cache.invalidate(f"{dst_dir}/{name}")
             else:
                 raise AlistException.CopyError(res.text)
-        else:   # 跨账号复制
-            if local_copy is False:
-                return 0
-            self.__local_copy(src_path, dst_dir, mkdir_flag)    # 开始本地复制
+        if wait is True and tasks:
+            copied -= len(self._failed_tasks(tasks))
+        return copied
 
     @AlistException(AlistException.DownloadError)
-    def download_file(self, file_path: str, save_path: str, mkdir_flag=False, rename=None):
+    def download_file(self, file_path: str, save_path: str, mkdir_flag=False, rename=None, segments=1):
         """
         下载单个文件
 
@@ -500,6 +1037,7 @@ class AlistV3:
         :param save_path: 保存路径
         :param mkdir_flag: 当保存路径不存在时是否创建路径，如果为True则自动创建路径，默认为False
         :param rename: 下载文件是否重命名，默认为None, 不重命名
+        :param segments: 分段下载的连接数，默认为1, 不分段
         :return:
         """
         log.info(f'{file_path} --正在下载--> {save_path}')
@@ -511,7 +1049,7 @@ class AlistV3:
             :param save_p: 保存路径
             :return:
             """
-            d = Downloader(down_url, save_p)
+            d = Downloader(down_url, save_p, segments=segments, session=self._down_s)
             d.start()
             log.info(f"下载完毕, 文件地址: {save_p}")
 
@@ -532,20 +1070,25 @@ class AlistV3:
         save_file_p = os.path.join(save_path, os.path.basename(file_path) if rename is None else rename)  # 是否重命名
         log.info(f"正在下载文件: {file_path}")
         url = res.get('data').get('raw_url')
+        self.rate_limiter.request(file_path)
+        self.rate_limiter.transfer(file_path, res.get('data').get('size'))
 
         # 开始下载
         log.debug("正在使用request下载")
+        start = time.monotonic()
         _download_request(down_url=url, save_p=save_file_p)
+        self.metrics.transfer("download", file_path, res.get('data').get('size'), time.monotonic() - start)
 
     @AlistException(AlistException.UploadError)
-    def upload(self, file_path: str, dst_path: str, mkdir_flag: bool = False, rename=None):
+    def upload(self, file_path: str, dst_path: str, mkdir_flag: bool = False, rename=None, as_task=False):
         """
         上传文件
         :param file_path: 上传的文件路径
         :param dst_path: 目标路径
         :param mkdir_flag: 当目标路径不存在时是否创建路径，如果为True则自动创建路径，默认为False
         :param rename: 上传文件后重命名
-        :return:
+        :param as_task: 是否作为alist的上传任务, 为True时alist收到文件后立即返回, 再由alist上传到存储
+        :return: as_task为True时返回alist的上传任务 [(任务类型, 任务信息)], 可以用wait_tasks等待
         """
 
         def random_string_generator(str_size):
@@ -567,16 +1110,8 @@ class AlistV3:
         if not os.path.exists(file_path):
             raise AlistException.UploadError("需要上传的文件不存在, 请检查上传的文件路径是否正确")
 
-        # 目标路径是否存在
-        with lock:
-            dst_path_res = self.getpath(dst_path)
-            if dst_path_res['code'] != 200:
-                if mkdir_flag is False:
-                    raise AlistException.CopyError("目标路径不存在，请检查目标路径是否正确，或选择启用本函数mkdir_flag")
-                self.mkdir(dst_path)
-            else:
-                if dst_path_res['data']['is_dir'] is False:
-                    raise AlistException.CopyError("目标路径实际为文件，请确认输入是否正确")
+        # 目标路径是否存在, 已确认存在的目录不再检查
+        self._prepare_dst_dir(dst_path, mkdir_flag, AlistException.CopyError)
 
         # 构建上传数据
         random_16 = random_string_generator(16)
@@ -585,47 +1120,210 @@ class AlistV3:
         file_size = os.path.getsize(file_path)
         log.debug(f"文件大小: {file_size}")
         headers['Content-Length'] = f"{file_size}"      # 指定文件大小
+        upload_file = open(file_path, 'rb')
         multipart_encoder = MultipartEncoder(
             fields={
-                "file": (filename, open(file_path, 'rb'), 'application/octet-stream'),
+                "file": (filename, upload_file, 'application/octet-stream'),
             },
             boundary=f'----WebKitFormBoundary{random_16}',
             encoding="utf-8"
         )
         headers['File-Path'] = parse.quote(dst_path + "/" + filename, safe="/")
-        headers['As-Task'] = 'false'
+        headers['As-Task'] = 'true' if as_task is True else 'false'
 
         # 发送上传请求
+        self.rate_limiter.request(dst_path)
+        self.rate_limiter.transfer(dst_path, file_size)
+        start = time.monotonic()
         try:
-            result = requests.put(self._UPLOAD_URL,
-                                  headers=headers,
-                                  data=multipart_encoder, timeout=None).text
+            result = self.s.put(self._UPLOAD_URL,
+                                headers=headers,
+                                data=multipart_encoder, timeout=None).text
             res_code = json.loads(result)['code']
         except json.decoder.JSONDecodeError:
             raise AlistException.UploadError(f"json读取异常, result: {result}")
+        finally:
+            upload_file.close()     # 及时释放文件, 上传后可以马上删除
         if res_code == 200:
             log.info(f"上传完毕, 文件地址: {dst_path}/{filename}")
-            self.getpath(f'{dst_path}/{filename}')  # 刷新一次
+            self.cache.invalidate(f'{dst_path}/{filename}')
+            self.metrics.transfer("upload", dst_path, file_size, time.monotonic() - start)
+            if as_task is True:
+                return self._response_tasks(result, "upload")
             return
         else:
             # 天翼云盘判定，改非秒传上传
-            if "MissingContentLength" not in result:
-                raise AlistException.UploadError(result)
-            if "Cloud189" not in dst_path:  # 说明是天翼云盘
+            new_dst_path = cloud189_sub_path(dst_path, result)
+            if new_dst_path is None:
                 raise AlistException.UploadError(result)
-            if "Cloud189Sub" in dst_path:  # 说明天翼云盘关闭秒传上传也失败了
-                raise AlistException.UploadError(result)
-            new_dst_path = dst_path.replace("Cloud189", "Cloud189Sub")
-            self.upload(file_path, new_dst_path, mkdir_flag)
+            tasks = self.upload(file_path, new_dst_path, mkdir_flag, as_task=as_task)
 
         if rename is not None:  # 需要rename
-            time.sleep(1)   # 等待1秒
+            self._wait_exists(f"{dst_path}/{filename}")    # 等待上传生效
             self.rename(dst_path + '/' + filename, rename)
+        return tasks
+
+    @AlistException(AlistException.UploadError)
+    def relay(self, src_path: str, dst_path, mkdir_flag: bool = False, chunk_size=1024 * 1024, max_chunks=16):
+        """
+        中转上传, 源文件的下载数据经过有界内存缓冲直接上传到目标路径, 不写入本地磁盘, 下载和上传同时进行
+        有多个目标路径时只下载一次, 同时上传到所有目标路径
+        配置变量LocalDriver后如果源文件在alist链接目录, 则直接上传本地文件
+
+        :param src_path: 源文件路径(alist路径)
+        :param dst_path: 目标路径(可以是多个目标路径的列表)
+        :param mkdir_flag: 当目标路径不存在时是否创建路径，如果为True则自动创建路径，默认为False
+        :param chunk_size: 每块数据大小(字节)
+        :param max_chunks: 内存中每个目标最多缓存的块数
+        :return:
+        """
+        if type(dst_path) != list:
+            dst_path = [dst_path]
+        errors = self._relay(src_path, dst_path, mkdir_flag, chunk_size, max_chunks)
+        if errors:
+            raise AlistException.UploadError(f"中转失败: { {dst: str(e) for dst, e in errors.items()} }")
+
+    def _relay(self, src_path, dst_path_list, mkdir_flag=False, chunk_size=1024 * 1024, max_chunks=16, dst_sems=None):
+        """
+        中转上传到多个目标路径
+
+        :param dst_sems: 每个目标路径的并发数限制 {目标路径: Semaphore}
+        :return: 失败的目标路径 {目标路径: 异常}
+        """
+        errors = {}
+        dst_sems = {} if dst_sems is None else dst_sems
+        local_path = self.local_path(src_path)
+
+        def run(func, *args):
+            try:
+                func(*args)
+            except Exception as e:
+                log.error(e)
+                errors[args[-1]] = e
+
+        if local_path is not None:  # 本地存在, 直接对本地进行操作
+            def local_upload(dst):
+                with dst_sems.get(dst, nullcontext()):
+                    self.upload(local_path, dst, mkdir_flag=mkdir_flag)
+            threads = [myThread(run, local_upload, dst) for dst in dst_path_list]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            return errors
+
+        log.info(f"正在中转: {src_path} -> {dst_path_list}")
+        filename = os.path.basename(src_path)
+        dst_path_list = [dst[:-1] if dst[-1] == "/" else dst for dst in dst_path_list]
+
+        # 源文件是否存在
+        src_res = self.getpath(src_path)
+        if src_res['code'] != 200 or src_res['data']['is_dir'] is True:
+            raise AlistException.UploadError("需要中转的源文件不存在, 请检查源文件路径是否正确")
+        file_size = src_res['data']['size']
+
+        # 目标路径是否存在, 已确认存在的目录不再检查
+        for dst in list(dst_path_list):
+            if self._dir_known(dst):
+                continue
+            with lock:
+                dst_path_res = self.getpath(dst)
+                if dst_path_res['code'] != 200:
+                    if mkdir_flag is True:
+                        self.mkdir(dst)
+                        continue
+                    errors[dst] = AlistException.UploadError("目标路径不存在，请检查目标路径是否正确，或选择启用本函数mkdir_flag")
+                elif dst_path_res['data']['is_dir'] is False:
+                    errors[dst] = AlistException.UploadError("目标路径实际为文件，请确认输入是否正确")
+                else:
+                    self._add_known_dir(dst)
+                    continue
+            dst_path_list.remove(dst)
+        if not dst_path_list:
+            return errors
+
+        # 开始下载前先取得源和各目标的限速令牌, 避免下载后等待上传
+        self.rate_limiter.request(src_path)
+        self.rate_limiter.transfer(src_path, file_size)
+        for dst in dst_path_list:
+            self.rate_limiter.request(dst)
+            self.rate_limiter.transfer(dst, file_size)
+
+        # 按固定顺序占用各目标的并发数, 避免多个中转互相等待
+        sems = [dst_sems[dst] for dst in sorted(dst_path_list) if dst in dst_sems]
+        for sem in sems:
+            sem.acquire()
+        try:
+            if file_size > 0:
+                stream = RelayStream(src_res['data']['raw_url'], file_size, session=self._down_s,
+                                     chunk_size=chunk_size, max_chunks=max_chunks, branches=len(dst_path_list))
+                branches = stream.branches
+            else:   # 空文件不需要中转
+                stream = None
+                branches = [b""] * len(dst_path_list)
+            threads = [myThread(run, self._relay_put, branch, filename, dst)
+                       for branch, dst in zip(branches, dst_path_list)]
+            start = time.monotonic()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            if stream is not None:
+                stream.close()
+            for dst in dst_path_list:
+                if dst not in errors:
+                    self.metrics.transfer("relay", dst, file_size, time.monotonic() - start)
+        finally:
+            for sem in sems:
+                sem.release()
+
+        # 天翼云盘判定，改非秒传上传
+        for dst, e in list(errors.items()):
+            sub_dst = cloud189_sub_path(dst, str(e))
+            if sub_dst is not None:
+                # 改非秒传后仍是同一个目标存储, 沿用原目标路径的并发数限制
+                sub_sems = {**dst_sems, sub_dst: dst_sems[dst]} if dst in dst_sems else dst_sems
+                sub_errors = self._relay(src_path, [sub_dst], mkdir_flag, chunk_size, max_chunks, sub_sems)
+                if not sub_errors:
+                    errors.pop(dst)
+        return errors
+
+    def _relay_put(self, data, filename, dst_path):
+        """
+        把中转数据上传到目标路径
+
+        :param data: 中转流分支, 空文件时为b""
+        :param filename: 文件名
+        :param dst_path: 目标路径
+        """
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'File-Path': parse.quote(dst_path + "/" + filename, safe="/"),
+            'As-Task': 'false',
+        }
+        if not data:
+            headers['Content-Length'] = '0'
+        try:
+            result = self.s.put(self._PUT_URL, headers=headers, data=data, timeout=None).text
+            res_code = json.loads(result)['code']
+        except json.decoder.JSONDecodeError:
+            raise AlistException.UploadError(f"json读取异常, result: {result}")
+        finally:
+            if data:
+                data.close()
+        if res_code != 200:
+            # 天翼云盘需要改非秒传上传, 数据已被读取, 交给调用方重新中转
+            raise AlistException.UploadError(result)
+        log.info(f"中转完毕, 文件地址: {dst_path}/{filename}")
+        self.cache.invalidate(f'{dst_path}/{filename}')
 
     @AlistException(AlistException.SyncError)
-    def sync(self, src_path, dst_path_list, rclone_space="alistv3", filter_file=None, auto=False, thread_max_num=None):
+    def sync(self, src_path, dst_path_list, rclone_space="alistv3", filter_file=None, auto=False, thread_max_num=None,
+             engine="rclone", check_max_num=None, relay=False, upload_max_num=None, bulk_delete=False,
+             index_file=None, journal_file=None, compare="size", prune=False, detect_moves=None,
+             index_ttl=7 * 86400, list_max_num=8):
         """
-        同步命令，需要rclone用webdav绑定alist, 配置变量LocalDriver后如果同步发生在alist链接目录, 则直接调用本地文件资源进行检测
+        同步命令，engine为rclone时需要rclone用webdav绑定alist, 配置变量LocalDriver后如果同步发生在alist链接目录, 则直接调用本地文件资源进行检测
         支持多线程, 通过设置thread_max_num参数启用, 最小设置为2 最大设置为16,
 
         :param src_path: 源路径
@@ -634,125 +1332,294 @@ class AlistV3:
         :param filter_file: 同步文件过滤器
         :param auto: =True 自动进行，无需确认 默认为False
         :param thread_max_num: 同时进行的最大数量, 默认为None, 不开启多线程, 最小设置为1 最大设置为16
+        :param engine: 差异检查方式, "rclone"使用rclone check, "alist"直接通过alist接口比较(不需要rclone)
+        :param check_max_num: 同时检查的目标路径数量, 默认为None, 即所有目标路径同时检查
+        :param relay: =True 使用中转上传, 源文件直接转发到目标路径, 不下载到本地缓存 默认为False
+        :param upload_max_num: 每个目标路径同时上传的最大数量, 默认为None, 与thread_max_num相同
+        :param bulk_delete: =True 批量删除- 文件, 同一目录下的文件用一个请求删除 默认为False
+        :param index_file: 同步状态索引文件(SQLite), 只支持engine="alist", 记录上次同步后的目标目录状态,
+                           之后的同步不再列出索引中已有的目标目录, 默认为None, 不使用索引
+        :param journal_file: 同步任务日志文件(SQLite), 记录每个同步项已完成的步骤, 同步中断后再次执行时从日志继续,
+                             不重新比较差异, 已下载的缓存文件不会被清除, 默认为None, 不记录日志
+        :param compare: 比较方式, "size"只比较大小(默认), "hash"大小相同时再比较哈希,
+                        alist方式使用列表中的哈希, local_driver中的文件在本地计算哈希并缓存
+        :param prune: =True 源目录的修改时间和大小与上次子树已同步时相同时, 跳过整个子树, 需要index_file,
+                      只适用于子目录变化时上级目录修改时间也会变化的存储 默认为False
+        :param detect_moves: 移动检测, 把源中被移动或重命名的文件在目标中直接移动, 不再删除后重新上传,
+                             "name"按文件名和大小配对- 文件和+ 文件, "hash"再按大小和哈希配对(可以找出改名的文件),
+                             只在[y]同步所有差异时执行, 默认为None, 不检测
+        :param index_ttl: 索引中目录记录的有效时间(秒), 过期后重新列出目标目录, 发现在同步之外被修改的目标文件,
+                          默认为7天, 为None时一直有效
+        :param list_max_num: engine="alist"时每个目标路径同时列出的最大目录数 默认为8
         """
         if thread_max_num is None:
             thread_max_num = 1
         if not (1 <= thread_max_num <= 16):
             raise AlistException.SyncError("你输入的并行数有问题, 最小设置为1, 最大设置为16")
+        if engine not in ("rclone", "alist"):
+            raise AlistException.SyncError(f"不支持的差异检查方式: engine={engine}")
+        if check_max_num is not None and check_max_num < 1:
+            raise AlistException.SyncError("你输入的检查并行数有问题, 最小设置为1")
+        if list_max_num < 1:
+            raise AlistException.SyncError("你输入的列出目录并行数有问题, 最小设置为1")
+        if compare not in ("size", "hash"):
+            raise AlistException.SyncError(f"不支持的比较方式: compare={compare}")
+        if index_file is not None and engine != "alist":
+            raise AlistException.SyncError("同步状态索引只支持engine=\"alist\"")
+        if prune is True and index_file is None:
+            raise AlistException.SyncError("跳过未变化的子树需要设置index_file")
+        if detect_moves not in (None, "name", "hash"):
+            raise AlistException.SyncError(f"不支持的移动检测方式: detect_moves={detect_moves}")
 
         # 统一dst_path为列表
         if type(dst_path_list) != list:
             dst_path_list = [dst_path_list]
 
         # 检查源同步目录是否正确
-        src_res = self.getpath(src_path)
+        src_res = self.getpath(src_path, refresh=True)
         if src_res.get('code') != 200:
             raise AlistException.SyncError("输入的文件夹路径不存在，或输入的不是文件夹")
 
         # 检查目标同步目录是否正确
         err_dst_path_list = []
         for index, dst_path in enumerate(dst_path_list, start=0):
-            dst_res = self.getpath(dst_path)
+            dst_res = self.getpath(dst_path, refresh=True)
             if dst_res["code"] != 200:
                 log.warning(f'此目标路径存在错误: {dst_path}')
                 err_dst_path_list.append(index)
         # 删除错误的目标路径
         for err_dst_path in err_dst_path_list:
             dst_path_list.pop(err_dst_path)
+        # 连接池按同时进行的请求数扩大, 每个同步项可能同时上传到所有目标路径, 比较差异时每个目标路径同时列出多个目录
+        self._resize_pool(max(thread_max_num, list_max_num if engine == "alist" else 1) * max(len(dst_path_list), 1))
 
-        r = RcloneOperation()  # 调用Rclone检测
-        src = dst = rclone_space  # 设置为alist存储符
-
-        sync_msg = {
-            dst_path: r.check(src_path, dst_path, src=src, dst=dst, filter_file=filter_file)
-            for dst_path in dst_path_list
-        }
-        union_sync = {}
-
-        for dst_path, file_msg_list in sync_msg.items():
-            for file_msg in file_msg_list:
-                if not union_sync.get(file_msg):
-                    union_sync[file_msg] = [dst_path]
-                else:
-                    union_sync[file_msg].append(dst_path)
-
-        if not union_sync:
-            log.info("已同步")
-            return
-
-        add_union_sync = {}
-        sub_union_sync = {}
-        dif_union_sync = {}
-        err_union_sync = {}
-        for file in union_sync:
-            if file[0] == "+":
-                add_union_sync[file] = union_sync[file]
-            elif file[0] == "-":
-                sub_union_sync[file] = union_sync[file]
-            elif file[0] == "*":
-                dif_union_sync[file] = union_sync[file]
-            elif file[0] == "!":
-                err_union_sync[file] = union_sync[file]
+        sync_index = None if index_file is None else SyncIndex(index_file, ttl=index_ttl)
+        journal = None if journal_file is None else SyncJournal(journal_file)
+        try:
+            # 有未完成的同步任务时, 不再比较差异, 直接继续
+            resume_sync = None if journal is None else journal.resume(src_path, dst_path_list)
+            if resume_sync is not None:
+                log.info(f"继续上次未完成的同步任务, 剩余{len(resume_sync)}个同步项")
+                if sync_index is not None:  # 没有重新比较差异, 从日志恢复源文件信息, 同步成功后写入索引
+                    for file, info in journal.infos.items():
+                        sync_index.stage(src_path, file[2:], info)
+                self.__sync_work(src_path, resume_sync, thread_max_num, relay, upload_max_num, bulk_delete,
+                                 sync_index, journal)
+                return
+
+            if engine == "alist":
+                d = AlistDiff(self, index=sync_index, compare=compare, prune=prune,
+                              max_workers=list_max_num)  # 直接通过alist接口检测, 有索引时只列出索引中没有的目标目录
+                sync_msg = {
+                    dst_path: d.check_iter(src_path, dst_path, filter_file=filter_file)
+                    for dst_path in dst_path_list
+                }
             else:
-                raise AlistException.SyncError(f"差异性文件列表出错: {file}")
-
-        if auto is False:   # 需要输入
-            log.info(f"已发现{len(union_sync)}个差异性文件\n"
-                     f"{r.SYNC_TIPS}\n"
-                     f"+ 文件有{len(add_union_sync)}个, "
-                     f"- 文件有{len(sub_union_sync)}个, "
-                     f"* 文件有{len(dif_union_sync)}个, "
-                     f"! 文件有{len(err_union_sync)}个。\n"
-                     f"[+]仅打印+文件, [-][*][!]同理\n"
-                     f"[p]打印所有差异性内容\n"
-                     f"[+y]将+ 文件从源路径同步内容到目标路径\n"
-                     f"[-y]将- 文件从源路径同步内容到目标路径\n"
-                     f"[*y]将* 文件从源路径同步内容到目标路径\n"
-                     f"[y]从源路径到目标路径同步所有差异性内容\n"
-                     f"[n]退出")
-            while True:
-                flag = input("请输入命令操作: ")
-                if flag == "p":
-                    for file in union_sync:
-                        print(f'{file} -> {union_sync.get(file)}')
-                elif flag in ["+", "-", "*", "!"]:
-                    for file in union_sync:
-                        if file[0] == flag:
-                            print(f'{file} -> {union_sync.get(file)}')
-                elif flag in ["y", "+y", "-y", "*y"]:
-                    break
-                elif flag == "n":
-                    return
-        else:   # 自动进行同步 auto=True
-            flag = "y"
-            # 打印一次所有要同步的文件
+                r = RcloneOperation()  # 调用Rclone检测
+                src = dst = rclone_space  # 设置为alist存储符
+                sync_msg = {
+                    dst_path: r.check_iter(src_path, dst_path, src=src, dst=dst, filter_file=filter_file,
+                                           compare=compare)
+                    for dst_path in dst_path_list
+                }
+            union_sync = {}
+            union_lock = threading.Lock()
+
+            def check_func(dst_p):
+                for file_msg in sync_msg[dst_p]:     # 边检查边合并
+                    with union_lock:
+                        if not union_sync.get(file_msg):
+                            union_sync[file_msg] = [dst_p]
+                        else:
+                            union_sync[file_msg].append(dst_p)
+
+            # 多个目标路径并行检查
+            with ThreadPoolExecutor(max_workers=check_max_num or max(len(dst_path_list), 1)) as pool:
+                for future in as_completed([pool.submit(check_func, dst_path) for dst_path in dst_path_list]):
+                    future.result()
+
+            if not union_sync:
+                log.info("已同步")
+                return
+
+            # 配对的- 文件和+ 文件在目标中移动完成
+            move_sync, moved_union_sync = {}, union_sync
+            if detect_moves is not None:
+                move_sync, moved_union_sync = MoveDetector(self, match=detect_moves, index=sync_index).detect(
+                    src_path, union_sync)
+            move_count = sum(len(pairs) for pairs in move_sync.values())
+
+            add_union_sync = {}
+            sub_union_sync = {}
+            dif_union_sync = {}
+            err_union_sync = {}
             for file in union_sync:
-                print(f'{file} -> {union_sync.get(file)}')
-
-        if flag == "y":
-            self.__sync_work(src_path, union_sync, thread_max_num)
-        elif flag == "+y":
-            self.__sync_work(src_path, add_union_sync, thread_max_num)
-        elif flag == "-y":
-            self.__sync_work(src_path, sub_union_sync, thread_max_num)
-        elif flag == "*y":
-            self.__sync_work(src_path, dif_union_sync, thread_max_num)
-        else:
-            raise AlistException.SyncError(f"操作标识符出错: flag={flag}")
+                if file[0] == "+":
+                    add_union_sync[file] = union_sync[file]
+                elif file[0] == "-":
+                    sub_union_sync[file] = union_sync[file]
+                elif file[0] == "*":
+                    dif_union_sync[file] = union_sync[file]
+                elif file[0] == "!":
+                    err_union_sync[file] = union_sync[file]
+                else:
+                    raise AlistException.SyncError(f"差异性文件列表出错: {file}")
+
+            if auto is False:   # 需要输入
+                log.info(f"已发现{len(union_sync)}个差异性文件\n"
+                         f"{RcloneOperation.SYNC_TIPS}\n"
+                         f"+ 文件有{len(add_union_sync)}个, "
+                         f"- 文件有{len(sub_union_sync)}个, "
+                         f"* 文件有{len(dif_union_sync)}个, "
+                         f"! 文件有{len(err_union_sync)}个。\n"
+                         f"其中{move_count}对- / + 文件可以在目标中移动完成\n"
+                         f"[+]仅打印+文件, [-][*][!]同理, [>]打印移动的文件\n"
+                         f"[p]打印所有差异性内容\n"
+                         f"[+y]将+ 文件从源路径同步内容到目标路径\n"
+                         f"[-y]将- 文件从源路径同步内容到目标路径\n"
+                         f"[*y]将* 文件从源路径同步内容到目标路径\n"
+                         f"[y]从源路径到目标路径同步所有差异性内容\n"
+                         f"[n]退出")
+                while True:
+                    flag = input("请输入命令操作: ")
+                    if flag == "p":
+                        for file in union_sync:
+                            print(f'{file} -> {union_sync.get(file)}')
+                    elif flag in ["+", "-", "*", "!"]:
+                        for file in union_sync:
+                            if file[0] == flag:
+                                print(f'{file} -> {union_sync.get(file)}')
+                    elif flag == ">":
+                        self.__print_moves(move_sync)
+                    elif flag in ["y", "+y", "-y", "*y"]:
+                        break
+                    elif flag == "n":
+                        return
+            else:   # 自动进行同步 auto=True
+                flag = "y"
+                # 打印一次所有要同步的文件
+                for file in moved_union_sync:
+                    print(f'{file} -> {moved_union_sync.get(file)}')
+                self.__print_moves(move_sync)
+
+            if flag == "y":
+                work_sync = moved_union_sync
+                if move_sync:
+                    work_sync = self.__sync_moves(src_path, move_sync, moved_union_sync, sync_index)
+            elif flag == "+y":
+                work_sync = add_union_sync
+            elif flag == "-y":
+                work_sync = sub_union_sync
+            elif flag == "*y":
+                work_sync = dif_union_sync
+            else:
+                raise AlistException.SyncError(f"操作标识符出错: flag={flag}")
+            if journal is not None:
+                infos = None if sync_index is None else {
+                    file: sync_index.staged(src_path, file[2:]) for file in work_sync if file[0] in ("+", "*")
+                }
+                journal.plan(src_path, dst_path_list, work_sync, infos)    # 先记录计划, 中断后可以继续
+            self.__sync_work(src_path, work_sync, thread_max_num, relay, upload_max_num, bulk_delete,
+                             sync_index, journal)
+        finally:
+            if sync_index is not None:
+                sync_index.close()
+            if journal is not None:
+                journal.close()
+
+    @staticmethod
+    def __print_moves(move_sync):
+        for dst, pairs in move_sync.items():
+            for sub, add in pairs:
+                print(f'> {sub} -> {add} -> {dst}')
+
+    def __sync_moves(self, src_path, move_sync, union_sync, sync_index=None):
+        """
+        在目标中移动/重命名配对的文件, 同一对目录间的文件用一个请求移动, 失败的文件放回同步计划, 按删除后上传处理
+
+        :param src_path: 源目录
+        :param move_sync: 移动计划 {目标地址: [(- 文件相对路径, + 文件相对路径)]}
+        :param union_sync: 其余的同步计划
+        :param sync_index: 同步状态索引, 移动成功的文件会更新索引
+        :return: 加上移动失败的文件后的同步计划
+        """
+        union_sync = dict(union_sync)
+
+        def fallback(dst, *files):
+            for file in files:
+                union_sync[file] = union_sync.get(file, []) + [dst]
+
+        for dst, pairs in move_sync.items():
+            root = dst.rstrip("/")
+            groups = {}     # (- 文件目录, + 文件目录) -> [(- 文件, + 文件)]
+            for sub, add in pairs:
+                groups.setdefault((os.path.dirname(sub), os.path.dirname(add)), []).append((sub, add))
+            for (sub_dir, add_dir), group in groups.items():
+                new_dir = f"{root}/{add_dir}" if add_dir else root
+                if sub_dir != add_dir:
+                    try:
+                        moved = self.move_many([f"{root}/{sub}" for sub, _ in group], new_dir, mkdir_flag=True,
+                                               local_move=False)
+                    except Exception as e:
+                        log.error(e)
+                        moved = 0
+                    if moved != len(group):
+                        log.warning(f"无法在{dst}中移动{len(group)}个文件, 改为删除后重新上传")
+                        for sub, add in group:
+                            fallback(dst, f"- {sub}", f"+ {add}")
+                        continue
+                for sub, add in group:
+                    name, new_name = os.path.basename(sub), os.path.basename(add)
+                    if name != new_name:
+                        try:
+                            self._wait_exists(f"{new_dir}/{name}")
+                            self.rename(f"{new_dir}/{name}", new_name)
+                        except Exception as e:
+                            log.error(e)
+                            if sub_dir == add_dir:
+                                fallback(dst, f"- {sub}", f"+ {add}")
+                            else:   # 已移动到新目录, 多出的文件在下次比较差异时删除
+                                log.warning(f"重命名失败, 重新上传: {new_dir}/{new_name}")
+                                fallback(dst, f"+ {add}")
+                            continue
+                    if sync_index is not None:
+                        sync_index.removed(src_path, dst, sub)
+                        sync_index.synced(src_path, dst, add)
+                log.info(f"已在{dst}中移动{len(group)}个文件: {sub_dir or '/'} -> {add_dir or '/'}")
+        return union_sync
 
     @AlistException(AlistException.CopyError)
-    def __sync_work(self, src_path, union_sync, thread_max_num):
+    def __sync_work(self, src_path, union_sync, thread_max_num, relay=False, upload_max_num=None, bulk_delete=False,
+                    sync_index=None, journal=None):
         """
         复制文件, 支持跨账号复制
 
         :param src_path: 源文件地址
         :param union_sync: 统合的同步信息
         :param thread_max_num: 同时进行的最大数量, 默认为None, 不开启多线程, 最小设置为1 最大设置为16
+        :param relay: 是否使用中转上传
+        :param upload_max_num: 每个目标地址同时上传的最大数量, 默认与thread_max_num相同
+        :param bulk_delete: 是否批量删除- 文件
+        :param sync_index: 同步状态索引, 同步成功的同步项会写入索引
+        :param journal: 同步任务日志, 已完成的步骤会被跳过, 完成的步骤会写入日志
         """
+        # 每个目标地址的上传并发数限制
+        dst_sems = {
+            dst: threading.Semaphore(upload_max_num or thread_max_num)
+            for dst_list in union_sync.values() for dst in dst_list
+        }
 
-        # 清除缓存文件
-        shutil.rmtree('../cache', ignore_errors=True)
-        os.makedirs('../cache', exist_ok=True)
+        # 清除缓存文件, 有日志时保留, 未下载完的文件会断点续传
+        if journal is None:
+            shutil.rmtree('./cache', ignore_errors=True)
+        os.makedirs('./cache', exist_ok=True)
+
+        def done(f, step):
+            return journal is not None and journal.done(f, step)
+
+        def mark(f, step):
+            if journal is not None:
+                journal.mark(f, step)
 
         class _SyncTryAgain:
             """
@@ -798,11 +1665,10 @@ class AlistV3:
             """
             down_path = f"{src}/{f[2:]}"
             down_dir = os.path.dirname(down_path)
-            basedir = src[:src[1:].find("/") + 1]
-            if basedir in self.local_driver:  # 本地存在, 直接对本地进行操作
-                local_p = self.local_driver[basedir]
+            local_p = self.local_path(down_path)
+            if local_p is not None:  # 本地存在, 直接对本地进行操作
                 os.makedirs(f"./cache{down_dir}", exist_ok=True)
-                shutil.copy(down_path.replace(basedir, local_p), f"./cache{down_path}")
+                shutil.copy(local_p, f"./cache{down_path}")
             else:
                 self.download_file(down_path, save_path=f"./cache{down_dir}", mkdir_flag=True)
 
@@ -828,10 +1694,52 @@ class AlistV3:
             :param src: 源文件目录
             :param f: 临时文件
             """
-            with lock:
-                time.sleep(1)   # 等待1秒，确保文件被解除占用。
-                cache_path = f"{src}/{f[2:]}"
-                os.remove(f'./cache{cache_path}')
+            cache_path = f"{src}/{f[2:]}"
+            self._remove_local(f'./cache{cache_path}')    # 文件被占用时按退避重试
+
+        def sync_upload_all(src, f, dst_list):
+            """
+            同一个缓存文件同时上传到所有目标地址
+
+            :param src: 源文件目录
+            :param f: 从临时文件夹上传文件
+            :param dst_list: 目标地址列表
+            """
+            errors = []
+
+            def upload_to(dst):
+                try:
+                    with dst_sems[dst]:
+                        sync_upload(src, f, dst)
+                    mark(f, f"uploaded:{dst}")
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [myThread(upload_to, dst) for dst in dst_list]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            if errors:
+                raise errors[0]
+
+        @_SyncTryAgain("relay")
+        def sync_relay(src, f, pending):
+            """
+            中转操作，源文件只下载一次，同时上传到所有目标地址，成功的目标地址会从pending中移除，重试时只中转失败的目标地址
+
+            :param src: 源文件目录
+            :param f: 需要中转的文件
+            :param pending: 还未完成的目标地址列表
+            """
+            dst_dirs = {os.path.dirname(dst + '/' + f[2:]): dst for dst in pending}
+            errors = self._relay(f"{src}/{f[2:]}", list(dst_dirs), mkdir_flag=True,
+                                 dst_sems={d: dst_sems[dst] for d, dst in dst_dirs.items()})
+            for d, dst in dst_dirs.items():
+                if d not in errors:
+                    pending.remove(dst)
+            if errors:
+                raise AlistException.UploadError(f"中转失败: {list(errors)}")
 
         @_SyncTryAgain("delete")
         def sync_delete(f, dst_dir):
@@ -841,37 +1749,125 @@ class AlistV3:
             :param dst_dir: 目标地址
             :return:
             """
-            self.delete(f"{dst_dir}/{f[2:]}")
-            time.sleep(1)   # 等待1秒
+            self.cache.invalidate(f"{dst_dir}/{f[2:]}")    # 重新列出目录确认是否存在
+            if self.delete_many([f"{dst_dir}/{f[2:]}"]):   # 目标文件已不存在, 视为已删除
+                return
+            self._wait_exists(f"{dst_dir}/{f[2:]}", exists=False)     # 等待删除生效
 
-        def sync_func(f, union, sem, count):
-            with sem:
-                log.info(f"正在执行第{count}/{len(union_sync)}个同步项")
-                if f[0] == "+":      # + 型同步
-                    sync_download(src_path, f)                 # 下载差异文件
-                    for dst in union.get(f):    # 上传差异文件
-                        sync_upload(src_path, f, dst)
-                    sync_clear_cache(src_path, f)              # 删除下载缓存
-                elif f[0] == "-":    # - 型同步
-                    for dst in union.get(f):
-                        sync_delete(f, dst)                   # 删除差异文件
-                elif f[0] == "*":    # * 型同步
-                    for dst in union.get(f):
-                        sync_delete(f, dst)                   # 删除差异文件
+        @_SyncTryAgain("bulk_delete")
+        def sync_delete_many(file_list, dst_dir):
+            """
+            批量删除操作
+            :param file_list: 需要删除的目标文件列表
+            :param dst_dir: 目标地址
+            :return:
+            """
+            self.delete_many([f"{dst_dir}/{f[2:]}" for f in file_list])
+
+        def sync_transfer(f, dst_list):
+            """
+            把源文件同步到目标地址列表, 跳过日志中已完成的步骤
+            """
+            pending = [dst for dst in dst_list if not done(f, f"uploaded:{dst}")]
+            if relay is True:
+                try:
+                    if pending:
+                        sync_relay(src_path, f, pending)    # 中转差异文件
+                finally:
+                    for dst in dst_list:
+                        if dst not in pending:
+                            mark(f, f"uploaded:{dst}")
+                return
+            cache_file = f"./cache{src_path}/{f[2:]}"
+            if pending:
+                if not (done(f, "downloaded") and os.path.exists(cache_file)):
                     sync_download(src_path, f)                 # 下载差异文件
-                    for dst in union.get(f):    # 上传差异文件
-                        sync_upload(src_path, f, dst)
-                    sync_clear_cache(src_path, f)              # 删除下载缓存
-
-        semaphore = threading.Semaphore(thread_max_num)
-        for c, file in enumerate(union_sync, start=1):
-            t = myThread(sync_func, file, union_sync, semaphore, c)
-            t.start()
-            if c % 200 == 0:     # 每同步超过200个文件，则休息半小时
-                t.join()        # 阻塞
-                log.info("已经同步了200个文件了，休息半小时！")
-                time.sleep(1800)    # 等待
-            # sync_func(file, union_sync, semaphore)
+                    mark(f, "downloaded")
+                sync_upload_all(src_path, f, pending)     # 上传差异文件
+            if not done(f, "cleared"):
+                if os.path.exists(cache_file):
+                    sync_clear_cache(src_path, f)          # 删除下载缓存
+                mark(f, "cleared")
+
+        def sync_func(f, union, count):
+            log.info(f"正在执行第{count}/{len(union_sync)}个同步项")
+            if f[0] in ("-", "*"):    # - 型和 * 型同步先删除差异文件
+                for dst in union.get(f):
+                    if not done(f, f"deleted:{dst}"):
+                        sync_delete(f, dst)
+                        mark(f, f"deleted:{dst}")
+                        if sync_index is not None:  # 删除成功立即更新索引, 之后上传失败时下次同步会重新发现
+                            sync_index.removed(src_path, dst, f[2:])
+            if f[0] in ("+", "*"):    # + 型和 * 型同步上传差异文件
+                sync_transfer(f, union.get(f))
+
+        def sync_item(f, union, count):
+            try:
+                sync_func(f, union, count)
+            except Exception:
+                self.metrics.inc("alist_sync_items_total", type=f[0], result="error")
+                raise
+            self.metrics.inc("alist_sync_items_total", type=f[0], result="ok")
+            mark(f, "done")
+            if sync_index is None or f[0] == "-":     # 删除在sync_func中已更新索引
+                return
+            for dst in union.get(f):     # 同步成功, 更新索引
+                sync_index.synced(src_path, dst, f[2:])
+
+        # 批量删除- 文件, 每个目标地址按目录分组删除
+        failed = 0      # 批量删除失败的文件数
+        if bulk_delete is True:
+            delete_groups = {}
+            for file in union_sync:
+                if file[0] == "-":
+                    for dst in union_sync[file]:
+                        if not done(file, f"deleted:{dst}"):
+                            delete_groups.setdefault(dst, []).append(file)
+            for dst, file_list in delete_groups.items():
+                log.info(f"正在批量删除{dst}中的{len(file_list)}个文件")
+                try:
+                    sync_delete_many(file_list, dst)
+                except Exception as e:
+                    log.error(e)
+                    failed += len(file_list)
+                    continue
+                for f in file_list:
+                    mark(f, f"deleted:{dst}")
+                    if sync_index is not None:
+                        sync_index.removed(src_path, dst, f[2:])
+            for file, dst_list in union_sync.items():
+                if file[0] == "-" and all(done(file, f"deleted:{dst}") for dst in dst_list):
+                    mark(file, "done")
+            union_sync = {file: dst_list for file, dst_list in union_sync.items() if file[0] != "-"}
+
+        # 预先创建所有需要的目标目录, 之后上传时不再检查目录
+        plan_dirs = {
+            os.path.dirname(dst + '/' + file[2:])
+            for file, dst_list in union_sync.items() if file[0] in ("+", "*")
+            for dst in dst_list
+        }
+        if plan_dirs:
+            try:
+                self.mkdirs(plan_dirs, max_workers=thread_max_num)
+            except Exception as e:  # 创建失败的目录在上传时会再次尝试
+                log.error(e)
+
+        # 固定数量的工作线程执行同步项, 队列满时等待
+        scheduler = SyncScheduler(thread_max_num, print_exc=TrackPrintEnable)
+        self.metrics.track_scheduler(scheduler)     # 同步期间导出队列长度和工作中的线程数
+        try:
+            with scheduler:
+                for c, file in enumerate(union_sync, start=1):
+                    scheduler.submit(sync_item, file, union_sync, c)     # 限速由rate_limiter按存储控制
+        finally:
+            self.metrics.track_scheduler(None)
+        failed += len(scheduler.errors)
+        if failed:  # 有失败的同步项时保留任务日志, 下次同步时继续执行失败的同步项
+            log.error(f"同步完成, 其中{failed}个同步项失败")
+            raise AlistException.SyncError(f"{failed}个同步项失败")
+        if journal is not None:
+            journal.finish()
+        log.info(f"同步完成, 共{len(union_sync)}个同步项")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,96 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : cache.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+"""
+import threading
+import time
+from collections import OrderedDict
+from copy import deepcopy
+
+
+class ListCache:
+    """
+    alist路径信息缓存, 以路径为键, 支持TTL过期和LRU淘汰, 线程安全
+    """
+
+    def __init__(self, ttl=60, max_size=4096):
+        """
+        :param ttl: 缓存有效时间(秒), <=0 表示不缓存
+        :param max_size: 最大缓存条目数, 超过后淘汰最久未使用的条目
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = OrderedDict()  # path -> (过期时间, 路径信息)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _norm(path):
+        """
+        统一路径格式, 去掉末尾的/
+        """
+        path = path.replace("\\", "/")
+        if len(path) > 1 and path[-1] == "/":
+            path = path[:-1]
+        return path
+
+    def get(self, path):
+        """
+        读取缓存, 不存在或已过期返回None
+
+        :param path: alist路径
+        :return: 路径信息的副本
+        """
+        path = self._norm(path)
+        with self._lock:
+            item = self._data.get(path)
+            if item is None:
+                return None
+            expire, value = item
+            if expire < time.monotonic():
+                del self._data[path]
+                return None
+            self._data.move_to_end(path)
+            return deepcopy(value)
+
+    def set(self, path, value):
+        """
+        写入缓存
+
+        :param path: alist路径
+        :param value: 路径信息
+        """
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        path = self._norm(path)
+        with self._lock:
+            self._data[path] = (time.monotonic() + self.ttl, deepcopy(value))
+            self._data.move_to_end(path)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, path, recursive=False):
+        """
+        使路径及其上级目录的缓存失效
+
+        :param path: 发生变化的alist路径
+        :param recursive: 为True时同时清除该路径下所有子路径的缓存(删除、移动目录时使用)
+        """
+        path = self._norm(path)
+        parent = self._norm(path.rsplit("/", 1)[0] or "/")
+        with self._lock:
+            self._data.pop(path, None)
+            self._data.pop(parent, None)
+            if recursive:
+                prefix = path.rstrip("/") + "/"
+                for key in [k for k in self._data if k.startswith(prefix)]:
+                    del self._data[key]
+
+    def clear(self):
+        """
+        清空缓存
+        """
+        with self._lock:
+            self._data.clear()
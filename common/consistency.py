@@ -0,0 +1,65 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : consistency.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+"""
+import time
+
+from common.log import log
+from common.storage import match_storage
+
+
+class ConsistencyWait:
+    """
+    一致性等待, 操作后轮询检查预期的状态, 状态生效立即返回, 否则按指数退避继续等待
+    config格式: {存储路径: {"initial": 0.2, "factor": 2, "max_delay": 5, "timeout": 30, "refresh": True}}
+    存储路径按最长前缀匹配, "default"为其余存储的配置, 未设置的项使用DEFAULT
+    """
+    DEFAULT = {
+        "initial": 0.1,     # 第一次重试前的等待时间(秒)
+        "factor": 2,        # 每次重试等待时间的倍数
+        "max_delay": 2,     # 单次最长等待时间(秒)
+        "timeout": 10,      # 最长总等待时间(秒)
+        "refresh": False,   # 检查时是否让alist刷新目录, 存储更新较慢时设为True
+    }
+
+    def __init__(self, config=None):
+        """
+        :param config: 各存储的等待配置
+        """
+        self.config = {} if config is None else config
+        for key, conf in self.config.items():
+            for item in conf:
+                if item not in self.DEFAULT:
+                    raise ValueError(f"不支持的一致性等待配置: {key}: {item}")
+
+    def get(self, path):
+        """
+        路径所属存储的等待配置
+        """
+        key = match_storage(path, self.config)
+        return {**self.DEFAULT, **(self.config[key] if key is not None else {})}
+
+    def wait(self, path, check, desc=None) -> bool:
+        """
+        轮询检查直到check返回True
+
+        :param path: 操作的alist路径, 用于选择等待配置
+        :param check: 检查函数, 返回True表示状态已生效
+        :param desc: 超时日志中的操作描述
+        :return: 状态是否已生效, 超时返回False
+        """
+        conf = self.get(path)
+        deadline = time.monotonic() + conf["timeout"]
+        delay = conf["initial"]
+        while True:
+            if check():
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                log.warning(f"等待{desc or path}生效超时({conf['timeout']}s)")
+                return False
+            time.sleep(min(delay, remaining))
+            delay = min(delay * conf["factor"], conf["max_delay"])
@@ -0,0 +1,397 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : diff.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+"""
+import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from common.hashcache import HASH_TYPES, entry_hashes
+from common.log import log
+
+
+class SyncFilter:
+    """
+    rclone过滤文件(--filter-from)的简易实现, 支持 + / - 规则, # 注释, ! 清空规则
+    """
+
+    def __init__(self, filter_file=None):
+        self.rules = []  # [(是否包含, 正则, 是否为目录规则)]
+        if filter_file is not None:
+            with open(filter_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    self._add_rule(line.strip())
+
+    @staticmethod
+    def _glob_to_regex(pattern):
+        """
+        把rclone的glob规则转换成正则, /开头表示从根目录匹配, 否则匹配路径的末尾部分
+        """
+        anchored = pattern.startswith("/")
+        if anchored:
+            pattern = pattern[1:]
+        i, regex = 0, ""
+        while i < len(pattern):
+            c = pattern[i]
+            if pattern[i:i + 2] == "**":
+                regex += ".*"
+                i += 2
+                continue
+            if c == "*":
+                regex += "[^/]*"
+            elif c == "?":
+                regex += "[^/]"
+            elif c == "{":
+                end = pattern.find("}", i)
+                if end == -1:
+                    regex += re.escape(c)
+                else:
+                    regex += "(" + "|".join(re.escape(p) for p in pattern[i + 1:end].split(",")) + ")"
+                    i = end
+            elif c == "[":
+                end = pattern.find("]", i)
+                if end == -1:
+                    regex += re.escape(c)
+                else:
+                    regex += pattern[i:end + 1]
+                    i = end
+            else:
+                regex += re.escape(c)
+            i += 1
+        return re.compile(("^" if anchored else "(^|/)") + regex + "$")
+
+    def _add_rule(self, line):
+        if not line or line[0] in "#;":
+            return
+        if line == "!":
+            self.rules.clear()
+            return
+        if line[:2] not in ("+ ", "- "):
+            log.warning(f"无法识别的过滤规则: {line}")
+            return
+        pattern = line[2:]
+        is_dir_rule = pattern.endswith("/") or pattern.endswith("/**")
+        if pattern.endswith("/"):
+            pattern += "**"
+        self.rules.append((line[0] == "+", self._glob_to_regex(pattern), is_dir_rule))
+
+    def include_file(self, rel_path):
+        """
+        文件是否需要同步
+
+        :param rel_path: 相对同步根目录的路径
+        """
+        for include, regex, _ in self.rules:
+            if regex.search(rel_path):
+                return include
+        return True
+
+    def include_dir(self, rel_path):
+        """
+        目录是否需要进入, 只有目录规则(以/或/**结尾)会排除整个目录
+
+        :param rel_path: 相对同步根目录的路径
+        """
+        for include, regex, is_dir_rule in self.rules:
+            if is_dir_rule and regex.search(rel_path + "/"):
+                return include
+        return True
+
+
+def compare_dir(rel, src_files, dst_files, flt):
+    """
+    比较源和目标中同一个目录的内容
+
+    :param rel: 目录相对同步根目录的路径
+    :param src_files: 源目录内容 {名称: 文件信息}, 读取失败时为None
+    :param dst_files: 目标目录内容 {名称: 文件信息}, 目录不存在时为None
+    :param flt: SyncFilter过滤器
+    :return: (差异信息列表, 需要继续比较的子目录列表[(相对路径, 源目录是否存在, 目标目录是否存在)])
+    """
+    lines, sub_dirs = [], []
+    if src_files is None:
+        return [f"! {rel}"], []
+    if dst_files is None:
+        if rel == "":
+            return [f"! {rel}"], []
+        dst_files = {}
+
+    for name, src_f in src_files.items():
+        rel_p = f"{rel}/{name}" if rel else name
+        dst_f = dst_files.get(name)
+        if src_f['is_dir']:
+            if not flt.include_dir(rel_p):
+                continue
+            if dst_f is not None and not dst_f['is_dir']:
+                lines.append(f"! {rel_p}")
+                continue
+            sub_dirs.append((rel_p, True, dst_f is not None))
+            continue
+        if not flt.include_file(rel_p):
+            continue
+        if dst_f is None:
+            lines.append(f"+ {rel_p}")
+        elif dst_f['is_dir']:
+            lines.append(f"! {rel_p}")
+        elif dst_f['size'] != src_f['size']:
+            lines.append(f"* {rel_p}")
+
+    for name, dst_f in dst_files.items():
+        if name in src_files:
+            continue
+        rel_p = f"{rel}/{name}" if rel else name
+        if dst_f['is_dir']:
+            if flt.include_dir(rel_p):
+                sub_dirs.append((rel_p, False, True))
+        elif flt.include_file(rel_p):
+            lines.append(f"- {rel_p}")
+    return lines, sub_dirs
+
+
+class AlistDiff:
+    """
+    通过alist的/api/fs/list直接比较源目录和目标目录, 结果格式与rclone check --combined相同
+    目录按层从上往下比较, 待比较的目录在线程池中同时列出, 列出结果在调用方线程中按提交顺序比较
+    """
+
+    def __init__(self, alist, index=None, compare="size", prune=False, max_workers=8):
+        """
+        :param alist: AlistV3实例
+        :param index: SyncIndex同步状态索引, 索引中已有的目录不再列出目标目录
+        :param compare: 比较方式, "size"只比较大小, "hash"大小相同时再比较哈希
+        :param prune: 是否按目录签名跳过未变化的子树, 需要index, 只适用于目录修改时间可靠的存储
+        :param max_workers: 同时列出的最大目录数
+        """
+        if compare not in ("size", "hash"):
+            raise ValueError(f"不支持的比较方式: compare={compare}")
+        if prune is True and index is None:
+            raise ValueError("按目录签名跳过子树需要同步状态索引")
+        if max_workers < 1:
+            raise ValueError(f"同时列出的目录数最小为1: max_workers={max_workers}")
+        self.alist = alist
+        self.index = index
+        self.compare = compare
+        self.prune = prune
+        self.max_workers = max_workers
+
+    @staticmethod
+    def _join(root, rel):
+        return f"{root.rstrip('/')}/{rel}" if rel else root
+
+    def _list(self, root, rel):
+        """
+        列出目录内容
+
+        :return: {名称: 文件信息}, 目录不存在或读取失败时返回None
+        """
+        files = self.alist.listdir(self._join(root, rel))
+        if files is None:
+            return None
+        return {f['name']: f for f in files}
+
+    def _list_dst(self, src_path, dst_path, rel, src_files, in_dst):
+        """
+        列出目标目录内容, 有索引时优先使用索引, 索引中没有的目录列出后记入索引, 不存在的目录记为空目录
+        """
+        if self.index is None:
+            return self._list(dst_path, rel) if in_dst else {}
+        dst_files = self.index.list_dir(src_path, dst_path, rel)
+        if dst_files is None:
+            dst_files = self._list(dst_path, rel) if in_dst else {}
+            if dst_files is not None and src_files is not None:
+                self.index.record_dir(src_path, dst_path, rel, dst_files, src_files)
+                dst_files = self.index.list_dir(src_path, dst_path, rel)    # 与索引中的记录比较
+        return dst_files
+
+    def _fetch(self, src_path, dst_path, rel, in_src, in_dst):
+        """
+        列出同一个目录在源和目标中的内容, 在线程池中执行
+
+        :return: (源目录内容, 目标目录内容)
+        """
+        src_files = self._list(src_path, rel) if in_src else {}
+        return src_files, self._list_dst(src_path, dst_path, rel, src_files, in_dst)
+
+    def _hash_diff(self, candidates):
+        """
+        比较大小相同的文件的哈希, 优先使用alist列表中的哈希, 没有共同的哈希类型时, 本地存储上的文件在本地计算哈希
+
+        :param candidates: [(相对路径, 源文件信息, 目标文件信息, 源文件路径, 目标文件路径)]
+        :return: 哈希不同的文件的相对路径列表
+        """
+        result, local_jobs, skipped = [], [], 0
+        for rel_p, src_f, dst_f, src_p, dst_p in candidates:
+            src_h, dst_h = entry_hashes(src_f), entry_hashes(dst_f)
+            common = [t for t in src_h if t in dst_h]
+            if common:
+                if src_h[common[0]] != dst_h[common[0]]:
+                    result.append(rel_p)
+                continue
+            src_local, dst_local = self.alist.local_path(src_p), self.alist.local_path(dst_p)
+            hash_type = next((t for t in HASH_TYPES if t in src_h or t in dst_h), "md5")
+            src_ok = src_local is not None or hash_type in src_h
+            dst_ok = dst_local is not None or hash_type in dst_h
+            if not (src_ok and dst_ok):     # 无法比较, 按大小相同处理
+                skipped += 1
+                continue
+            local_jobs.append((rel_p, hash_type,
+                               src_h.get(hash_type) if src_local is None else src_local,
+                               dst_h.get(hash_type) if dst_local is None else dst_local,
+                               src_local is not None, dst_local is not None))
+        if skipped:
+            log.warning(f"{skipped}个文件没有可比较的哈希, 只比较了大小")
+
+        hashes = self.alist.hash_cache.get_many(
+            [(p, t) for _, t, src, dst, src_l, dst_l in local_jobs for p, is_local in ((src, src_l), (dst, dst_l))
+             if is_local]
+        )
+        for rel_p, hash_type, src, dst, src_l, dst_l in local_jobs:
+            src_h = hashes.get((src, hash_type)) if src_l else src
+            dst_h = hashes.get((dst, hash_type)) if dst_l else dst
+            if src_h is None or dst_h is None:
+                continue
+            if src_h != dst_h:
+                result.append(rel_p)
+        return result
+
+    @staticmethod
+    def _signature(entry):
+        """
+        目录在上级目录列表中的签名(修改时间, 大小), 存储没有提供修改时间时返回None
+        """
+        modified = entry.get('modified')
+        if not modified or modified.startswith("0001-"):
+            return None
+        return modified, entry.get('size')
+
+    def _finish_dir(self, src_path, dst_path, nodes, rel):
+        """
+        目录及其所有子目录比较完后, 子树没有差异时记录签名, 有差异时删除签名, 并通知上级目录
+
+        :param nodes: 未完成的目录 {相对路径: [未完成的子目录数, 是否有差异, 签名]}
+        """
+        while True:
+            pending, dirty, sig = nodes[rel]
+            if pending > 0:
+                return
+            del nodes[rel]
+            self.index.record_signature(src_path, dst_path, rel, None if dirty or sig is None else sig)
+            if rel == "":
+                return
+            rel = os.path.dirname(rel)
+            nodes[rel][0] -= 1
+            nodes[rel][1] = nodes[rel][1] or dirty
+
+    def check_iter(self, src_path: str, dst_path: str, filter_file=None):
+        """
+        逐个产出差异文件信息, 不同的文件才会输出, 格式为"<标识> <相对路径>"
+        - 表示源上缺少路径，因此仅在目标中
+        + 表示目标上缺少路径，因此仅在源中
+        * 意味着路径存在于源和目标中，但二者不同
+        ! 表示读取源或目标时出错
+
+        :param src_path: 源目录
+        :param dst_path: 目标目录
+        :param filter_file: 排除目录文件, 与rclone的--filter-from格式相同
+        """
+        flt = SyncFilter(filter_file)
+        candidates = []     # 需要比较哈希的文件, 所有目录比较完后一起计算
+        staged = {}         # 相对路径 -> 源文件信息, 用于写入索引
+        prune = self.prune
+        nodes = {}          # 未完成的目录 {相对路径: [未完成的子目录数, 是否有差异, 签名]}
+        sigs = {}           # 相对路径 -> 目录在上级目录列表中的签名
+        if prune is True:
+            root_res = self.alist.getpath(src_path)
+            sigs[""] = self._signature(root_res['data']) if root_res.get('code') == 200 else None
+        skipped = 0
+        # (相对路径, 源目录是否存在, 目标目录是否存在)
+        todo = deque([("", True, True)])    # 待列出的目录
+        running = deque()                   # 正在列出的目录, 按提交顺序比较
+        pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="diff-list")
+        try:
+            while todo or running:
+                # 列出结果等待比较的目录数有上限, 避免目录很多时占用过多内存
+                while todo and len(running) < self.max_workers * 2:
+                    sub_dir = todo.popleft()
+                    running.append((sub_dir, pool.submit(self._fetch, src_path, dst_path, *sub_dir)))
+                (rel, in_src, in_dst), future = running.popleft()
+                src_files, dst_files = future.result()
+                if prune is True and rel == "" and src_files is not None and sigs[""] is not None:
+                    # 根目录总是列出, 修改时间不变但子项数变化时, 说明这个存储的目录修改时间不可靠
+                    rec = self.index.dir_signature(src_path, dst_path, "")
+                    if rec is not None and tuple(rec[:2]) == sigs[""] and rec[2] != len(src_files):
+                        log.warning(f"{src_path}的目录修改时间不可靠, 本次不跳过子树")
+                        prune = False
+                lines, sub_dirs = compare_dir(rel, src_files, dst_files, flt)
+                if self.index is not None and src_files:
+                    if dst_files:
+                        lines += [f"* {rel_p}" for rel_p in self.index.changed(rel, src_files, dst_files)
+                                  if flt.include_file(rel_p)]
+                    for line in lines:
+                        if line[0] in "+*":
+                            self.index.stage(src_path, line[2:], src_files[os.path.basename(line[2:])])
+                if self.compare == "hash" and src_files and dst_files:
+                    flagged = {line[2:] for line in lines}
+                    for name, src_f in src_files.items():
+                        dst_f = dst_files.get(name)
+                        rel_p = f"{rel}/{name}" if rel else name
+                        if (dst_f is None or src_f['is_dir'] or dst_f['is_dir'] or dst_f['size'] != src_f['size']
+                                or rel_p in flagged or not flt.include_file(rel_p)):
+                            continue
+                        candidates.append((rel_p, src_f, dst_f,
+                                           self._join(src_path, rel_p), self._join(dst_path, rel_p)))
+                        staged[rel_p] = src_f
+                yield from lines
+
+                if self.prune is True:
+                    if prune is True:   # 签名与上次子树已同步时相同的子目录不再进入
+                        kept = []
+                        for sub_dir in sub_dirs:
+                            sub_rel, sub_in_src, sub_in_dst = sub_dir
+                            if sub_in_src and sub_in_dst:
+                                sig = self._signature(src_files[os.path.basename(sub_rel)])
+                                rec = self.index.dir_signature(src_path, dst_path, sub_rel)
+                                if sig is not None and rec is not None and tuple(rec[:2]) == sig:
+                                    skipped += 1
+                                    continue
+                                sigs[sub_rel] = sig
+                            kept.append(sub_dir)
+                        sub_dirs = kept
+                    sig = sigs.pop(rel, None)
+                    nodes[rel] = [len(sub_dirs), bool(lines) or src_files is None,
+                                  None if sig is None or not in_src else sig + (len(src_files or {}),)]
+                    self._finish_dir(src_path, dst_path, nodes, rel)
+                todo.extend(sub_dirs)
+        finally:
+            pool.shutdown(cancel_futures=True)     # 调用方提前结束读取时不再列出剩余的目录
+
+        if skipped:
+            log.info(f"跳过了{skipped}个未变化的子目录")
+        if candidates:
+            for rel_p in self._hash_diff(candidates):
+                if self.index is not None:
+                    self.index.stage(src_path, rel_p, staged[rel_p])
+                    if self.prune is True:  # 所在的各级目录都有差异
+                        parent = rel_p
+                        while parent:
+                            parent = os.path.dirname(parent)
+                            self.index.record_signature(src_path, dst_path, parent, None)
+                yield f"* {rel_p}"
+
+    def check(self, src_path: str, dst_path: str, filter_file=None) -> list:
+        """
+        检查同步某一文件夹, 返回差异文件信息列表
+
+        :param src_path: 源目录，同步时不变
+        :param dst_path: 目标目录，会根据目标目录增删改等
+        :param filter_file: 排除目录文件
+        :return:
+        """
+        if filter_file is not None:
+            filter_file = os.path.abspath(filter_file)
+        log.info(f"正在比较: {src_path} <-> {dst_path}")
+        return list(self.check_iter(src_path, dst_path, filter_file))
@@ -1,22 +1,80 @@
 # -*- coding: UTF-8 -*-
 """
-@Project  : sync 
+@Project  : sync
 @File     : down.py
 @Author   : Sorami
 @GitHub   : https://github.com/Soramik
 """
 import requests
+import json
 import os
+import re
 import sys
+import threading
+import time
+from requests.adapters import HTTPAdapter
+
+# 下载用的连接池会话, 所有Downloader默认共用
+_SESSION = requests.session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=32))
+_SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=32))
 
 
 class Downloader:
-    def __init__(self, url, file_path):
+    _HEADERS = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:81.0) Gecko/20100101 Firefox/81.0",
+        "Accept-Encoding": "identity",   # 不压缩, 保证下载大小与Content-Length一致
+    }
+    _MIN_SEGMENT_SIZE = 8 * 1024 * 1024     # 分段下载时每段的最小大小
+
+    def __init__(self, url, file_path, segments=1, session=None, buffer_size=1024 * 1024,
+                 checkpoint_size=64 * 1024 * 1024, progress_interval=0.5):
+        """
+        :param url: 下载链接
+        :param file_path: 保存的文件路径
+        :param segments: 分段数, 大于1时把文件按字节范围分成多段并行下载
+        :param session: 请求会话, 默认使用模块内的连接池会话
+        :param buffer_size: 读写缓冲区大小(字节)
+        :param checkpoint_size: 每下载多少字节把数据写入磁盘并记录一次进度
+        :param progress_interval: 打印进度的最小间隔(秒)
+        """
         self.url = url
-        res_length = requests.get(self.url, stream=True)
-        self.total_size = int(res_length.headers['Content-Length'])
+        self.s = _SESSION if session is None else session
+        self.segments = segments
+        self.buffer_size = buffer_size
+        self.checkpoint_size = checkpoint_size
+        self.progress_interval = progress_interval
+        self._first_res = None      # 获取大小时顺带打开的下载响应, 单连接下载时直接复用
+        self.accept_ranges = False
+        self.total_size = self._get_size()
         self.ori_file_path = file_path
         self.downloading_file_path = file_path+f"_temp_size_{self.total_size}"
+        self.state_file_path = self.downloading_file_path + ".seg"     # 分段下载进度文件
+        self._last_print = 0
+
+    def _get_size(self):
+        """
+        用HEAD请求获取文件大小, 服务器不支持HEAD时, 从第一个下载响应中获取
+        """
+        res = self.s.head(self.url, headers=self._HEADERS, allow_redirects=True)
+        if res.status_code == 200 and res.headers.get('Content-Length'):
+            self.accept_ranges = res.headers.get('Accept-Ranges', '').lower() == 'bytes'
+            return int(res.headers['Content-Length'])
+        res = self.s.get(self.url, stream=True, headers={'Range': 'bytes=0-', **self._HEADERS})
+        res.raise_for_status()
+        content_range = re.match(r"bytes \d+-\d+/(\d+)", res.headers.get('Content-Range', ''))
+        if res.status_code == 206 and content_range:
+            self.accept_ranges = True
+            total_size = int(content_range.group(1))
+        else:
+            total_size = int(res.headers['Content-Length'])
+        self._first_res = res
+        return total_size
+
+    def _close_first_res(self):
+        if self._first_res is not None:
+            self._first_res.close()
+            self._first_res = None
 
     def start(self, print_flag=False):
         """
@@ -24,6 +82,64 @@ class Downloader:
         :param print_flag: 如果为True, 则打印进度
         :return:
         """
+        if os.path.exists(self.state_file_path):   # 存在分段进度, 继续分段下载
+            self._start_segmented(print_flag)
+        elif self.segments > 1 and self.accept_ranges and not os.path.exists(self.downloading_file_path) \
+                and self.total_size >= 2 * self._MIN_SEGMENT_SIZE:
+            self._start_segmented(print_flag)
+        else:
+            self._start_single(print_flag)
+
+    def _print_progress(self, temp_size, force=False):
+        """
+        打印进度, 两次打印至少间隔progress_interval秒
+        """
+        now = time.monotonic()
+        if force is False and now - self._last_print < self.progress_interval:
+            return
+        self._last_print = now
+        done = int(50 * temp_size / self.total_size) if self.total_size else 50
+        percent = 100 * temp_size / self.total_size if self.total_size else 100
+        sys.stdout.write("\r[%s%s] %d%%" % ('█' * done, ' ' * (50 - done), percent))
+        sys.stdout.flush()
+
+    def _copy_stream(self, res, f, limit, on_data, on_checkpoint):
+        """
+        把响应内容读入复用的缓冲区后写入文件
+
+        :param res: 下载响应
+        :param f: 已定位好的文件对象
+        :param limit: 最多读取的字节数, None为读完为止
+        :param on_data: 每读取一次数据的回调, 参数为读取的字节数
+        :param on_checkpoint: 数据写入磁盘后的回调, 参数为自上次回调以来写入的字节数
+        """
+        res.raw.decode_content = True
+        buf = bytearray(self.buffer_size)
+        view = memoryview(buf)
+        unsaved = 0
+        try:
+            while limit is None or limit > 0:
+                size = self.buffer_size if limit is None else min(self.buffer_size, limit)
+                n = res.raw.readinto(view[:size])
+                if not n:
+                    break
+                f.write(view[:n])
+                unsaved += n
+                if limit is not None:
+                    limit -= n
+                on_data(n)
+                if unsaved >= self.checkpoint_size:
+                    f.flush()
+                    on_checkpoint(unsaved)
+                    unsaved = 0
+        finally:
+            f.flush()
+            on_checkpoint(unsaved)
+
+    def _start_single(self, print_flag=False):
+        """
+        单连接下载, 支持断点续传
+        """
         if os.path.exists(self.downloading_file_path):
             temp_size = os.path.getsize(self.downloading_file_path)
             print(f"当前：{temp_size} 字节， 总：{self.total_size} 字节， 已下载：{round(100 * temp_size / self.total_size)} ")
@@ -31,20 +147,126 @@ class Downloader:
             temp_size = 0
             print(f"总：{self.total_size} 字节，开始下载...")
 
-        headers = {'Range': 'bytes=%d-' % temp_size,
-                   "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:81.0) Gecko/20100101 Firefox/81.0"}
-        res_left = requests.get(self.url, stream=True, headers=headers)
+        if temp_size > self.total_size:     # 临时文件与当前文件不符, 从头下载
+            temp_size = 0
+            open(self.downloading_file_path, "wb").close()
+        if temp_size == self.total_size and temp_size > 0:  # 上次已下载完, 只差重命名
+            self._close_first_res()
+            os.rename(self.downloading_file_path, self.ori_file_path)
+            return
+        if temp_size == 0 and self._first_res is not None:
+            res_left = self._first_res
+        else:
+            self._close_first_res()
+            headers = {'Range': 'bytes=%d-' % temp_size, **self._HEADERS}
+            res_left = self.s.get(self.url, stream=True, headers=headers)
+        try:
+            res_left.raise_for_status()
+        except Exception:
+            res_left.close()
+            self._first_res = None
+            raise
+        if temp_size > 0 and res_left.status_code != 206:   # 服务器不支持续传, 返回的是完整内容, 从头下载
+            temp_size = 0
+            open(self.downloading_file_path, "wb").close()
+
+        def on_data(n):
+            nonlocal temp_size
+            temp_size += n
+            if print_flag is True:
+                self._print_progress(temp_size)
+
+        with res_left, open(self.downloading_file_path, "ab", buffering=self.buffer_size) as f:
+            self._copy_stream(res_left, f, None, on_data, lambda n: None)
+        if print_flag is True:
+            self._print_progress(temp_size, force=True)
+        self._first_res = None
+        size = os.path.getsize(self.downloading_file_path)
+        if size != self.total_size:     # 连接中断等原因没有读完, 保留临时文件, 下次续传
+            raise IOError(f"下载未完成, 已下载{size}字节, 总{self.total_size}字节")
+        os.rename(self.downloading_file_path, self.ori_file_path)   # 下载完成，重命名
+        print("\n")
+
+    def _load_state(self):
+        """
+        读取分段进度, 不存在时按分段数新建
+
+        :return: [[起始位置, 结束位置, 已下载字节数], ...]
+        """
+        if os.path.exists(self.state_file_path) and os.path.exists(self.downloading_file_path):
+            with open(self.state_file_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        segments = max(1, min(self.segments, self.total_size // self._MIN_SEGMENT_SIZE))
+        seg_size = self.total_size // segments
+        state = []
+        for i in range(segments):
+            start = i * seg_size
+            end = self.total_size - 1 if i == segments - 1 else start + seg_size - 1
+            state.append([start, end, 0])
+        # 预分配文件
+        with open(self.downloading_file_path, "wb") as f:
+            f.truncate(self.total_size)
+        return state
+
+    def _save_state(self, state):
+        tmp_path = self.state_file_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_file_path)
+
+    def _start_segmented(self, print_flag=False):
+        """
+        分段多连接下载, 每段写入预分配文件的对应位置, 每段单独断点续传
+        """
+        self._close_first_res()
+        state = self._load_state()
+        self._save_state(state)
+        temp_size = sum(seg[2] for seg in state)
+        print(f"当前：{temp_size} 字节， 总：{self.total_size} 字节， 分{len(state)}段下载...")
+
+        state_lock = threading.Lock()
+        errors = []
+
+        def download_segment(seg):
+            start, end, done = seg
+            if start + done > end:
+                return
+
+            def on_data(n):
+                nonlocal temp_size
+                with state_lock:
+                    temp_size += n
+                    if print_flag is True:
+                        self._print_progress(temp_size)
+
+            def on_checkpoint(n):   # 数据写入文件后才记录进度
+                with state_lock:
+                    seg[2] += n
+                    self._save_state(state)
 
-        with open(self.downloading_file_path, "ab") as f:
-            for chunk in res_left.iter_content(chunk_size=1024):
-                temp_size += len(chunk)
-                f.write(chunk)
-                f.flush()
+            headers = {'Range': f'bytes={start + done}-{end}', **self._HEADERS}
+            try:
+                with self.s.get(self.url, stream=True, headers=headers) as res:
+                    if res.status_code != 206:
+                        raise IOError(f"服务器不支持分段下载, 状态码: {res.status_code}")
+                    with open(self.downloading_file_path, "r+b", buffering=self.buffer_size) as f:
+                        f.seek(start + done)
+                        self._copy_stream(res, f, end + 1 - start - done, on_data, on_checkpoint)
+            except Exception as e:
+                errors.append(e)
 
-                done = int(50 * temp_size / self.total_size)
-                if print_flag is True:
-                    sys.stdout.write("\r[%s%s] %d%%" % ('█' * done, ' ' * (50 - done), 100 * temp_size / self.total_size))
-                    sys.stdout.flush()
+        threads = [threading.Thread(target=download_segment, args=(seg,)) for seg in state]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self._save_state(state)
+        if print_flag is True:
+            self._print_progress(temp_size, force=True)
+        if errors:
+            raise errors[0]
+        if any(seg[0] + seg[2] <= seg[1] for seg in state):
+            raise IOError("分段下载未完成")
+        os.remove(self.state_file_path)
         os.rename(self.downloading_file_path, self.ori_file_path)   # 下载完成，重命名
         print("\n")
-        f.close()
\ No newline at end of file
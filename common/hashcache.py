@@ -0,0 +1,123 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : hashcache.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from common.log import log
+
+# alist的hash_info中可以在本地计算的哈希类型
+HASH_TYPES = ("md5", "sha1", "sha256")
+
+
+def file_hash(file_path, hash_type, chunk_size=1024 * 1024):
+    """
+    计算本地文件的哈希, 在进程池中执行
+
+    :param file_path: 本地文件路径
+    :param hash_type: 哈希类型, md5/sha1/sha256
+    :param chunk_size: 每次读取的字节数
+    :return: 小写十六进制哈希
+    """
+    h = hashlib.new(hash_type)
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def entry_hashes(entry):
+    """
+    文件信息中的哈希
+
+    :param entry: alist文件信息, 或SyncIndex中的记录
+    :return: {哈希类型: 小写十六进制哈希}, 没有哈希时返回{}
+    """
+    hash_info = entry.get('hash_info')
+    if hash_info is None and isinstance(entry.get('hash'), str):    # SyncIndex中的记录
+        hash_info = json.loads(entry['hash'])
+    if not isinstance(hash_info, dict):
+        return {}
+    return {k.lower(): v.lower() for k, v in hash_info.items() if isinstance(v, str) and v}
+
+
+class HashCache:
+    """
+    本地文件哈希缓存, 按(路径, 大小, 修改时间)缓存, 文件没有变化时不会重复计算
+    需要计算的文件在进程池中并行计算
+    """
+
+    def __init__(self, db_path=None, workers=None):
+        """
+        :param db_path: 缓存文件路径(SQLite), 默认为None, 只缓存在内存中
+        :param workers: 计算哈希的进程数, 默认为CPU核数
+        """
+        self.db_path = ":memory:" if db_path is None else os.path.abspath(db_path)
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS hashes (
+                path TEXT NOT NULL,
+                hash_type TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (path, hash_type)
+            );
+        """)
+
+    def get_many(self, items):
+        """
+        获取多个本地文件的哈希, 缓存中没有或文件已变化的才计算
+
+        :param items: [(本地文件路径, 哈希类型)]
+        :return: {(本地文件路径, 哈希类型): 哈希}, 无法读取的文件不在结果中
+        """
+        result, todo = {}, []
+        for file_path, hash_type in dict.fromkeys(items):
+            try:
+                st = os.stat(file_path)
+            except OSError as e:
+                log.warning(f"无法读取本地文件: {e}")
+                continue
+            with self._lock:
+                row = self._conn.execute("SELECT size, mtime, hash FROM hashes WHERE path=? AND hash_type=?",
+                                         (file_path, hash_type)).fetchone()
+            if row is not None and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+                result[(file_path, hash_type)] = row[2]
+            else:
+                todo.append((file_path, hash_type, st.st_size, st.st_mtime_ns))
+        if not todo:
+            return result
+
+        log.info(f"正在计算{len(todo)}个本地文件的哈希")
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(file_hash, file_path, hash_type) for file_path, hash_type, _, _ in todo]
+            with self._lock, self._conn:
+                for (file_path, hash_type, size, mtime), future in zip(todo, futures):
+                    try:
+                        h = future.result()
+                    except OSError as e:
+                        log.warning(f"计算哈希失败: {e}")
+                        continue
+                    result[(file_path, hash_type)] = h
+                    self._conn.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)",
+                                       (file_path, hash_type, size, mtime, h))
+        return result
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,254 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : index.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from common.hashcache import entry_hashes
+
+
+class SyncIndex:
+    """
+    同步状态索引, 用SQLite记录每对(源目录, 目标目录)中目标目录的已知状态
+    每条记录为目标中的一个文件或目录, size为目标中的大小, synced为最后同步时间
+    modified和hash为同步时源文件的修改时间和哈希, 未经同步或确认一致的文件modified为NULL, hash为目标文件自己的哈希
+    目录被列出过一次后记入索引, 之后比较时直接使用索引中的内容, 不再列出目标目录
+    src_dirs记录整个子树已同步时源目录的签名(修改时间, 大小, 子项数), 签名不变时可以跳过整个子树
+    只有同步成功的同步项才会更新索引, 记录超过ttl的目录会重新列出, 目标被其他程序修改后最迟在ttl后被发现
+    """
+    _COMMIT_EVERY = 1000    # 每写入多少条记录提交一次
+
+    def __init__(self, db_path, ttl=None):
+        """
+        :param db_path: 索引文件路径
+        :param ttl: 目录记录的有效时间(秒), 过期的目录重新列出, 过期的签名不再用来跳过子树, 默认为None, 一直有效
+        """
+        self.db_path = os.path.abspath(db_path)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._pending = {}      # (源目录, 相对路径) -> 差异文件的源文件信息, 同步成功后写入索引
+        self._writes = 0
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS files (
+                src_root TEXT NOT NULL,
+                dst_root TEXT NOT NULL,
+                dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                is_dir INTEGER NOT NULL,
+                size INTEGER,
+                modified TEXT,
+                hash TEXT,
+                synced REAL,
+                PRIMARY KEY (src_root, dst_root, dir, name)
+            );
+            CREATE TABLE IF NOT EXISTS dirs (
+                src_root TEXT NOT NULL,
+                dst_root TEXT NOT NULL,
+                dir TEXT NOT NULL,
+                synced REAL,
+                PRIMARY KEY (src_root, dst_root, dir)
+            );
+            CREATE TABLE IF NOT EXISTS src_dirs (
+                src_root TEXT NOT NULL,
+                dst_root TEXT NOT NULL,
+                dir TEXT NOT NULL,
+                modified TEXT,
+                size INTEGER,
+                count INTEGER,
+                synced REAL,
+                PRIMARY KEY (src_root, dst_root, dir)
+            );
+        """)
+
+    @staticmethod
+    def _root(path):
+        return path.replace("\\", "/").rstrip("/") or "/"
+
+    @staticmethod
+    def _split(rel_path):
+        return os.path.dirname(rel_path), os.path.basename(rel_path)
+
+    @staticmethod
+    def entry_hash(entry):
+        """
+        alist文件信息中的哈希, 没有时返回None
+        """
+        hash_info = entry.get('hash_info')
+        return json.dumps(hash_info, sort_keys=True) if hash_info else None
+
+    def _expired(self, synced):
+        return self.ttl is not None and (synced is None or synced < time.time() - self.ttl)
+
+    def _write(self, sql, params):
+        """
+        写入一条记录, 调用方需持有self._lock
+        """
+        self._conn.execute(sql, params)
+        self._writes += 1
+        if self._writes >= self._COMMIT_EVERY:
+            self._conn.commit()
+            self._writes = 0
+
+    def list_dir(self, src_root, dst_root, rel):
+        """
+        索引中的目标目录内容
+
+        :param src_root: 源目录
+        :param dst_root: 目标目录
+        :param rel: 相对同步根目录的路径
+        :return: {名称: 文件信息}, 目录不在索引中或记录已过期时返回None
+        """
+        key = (self._root(src_root), self._root(dst_root), rel)
+        with self._lock:
+            row = self._conn.execute("SELECT synced FROM dirs WHERE src_root=? AND dst_root=? AND dir=?", key).fetchone()
+            if row is None or self._expired(row[0]):
+                return None
+            rows = self._conn.execute("SELECT name, is_dir, size, modified, hash FROM files "
+                                      "WHERE src_root=? AND dst_root=? AND dir=?", key).fetchall()
+        return {
+            name: {'name': name, 'is_dir': bool(is_dir), 'size': size, 'modified': modified, 'hash': h}
+            for name, is_dir, size, modified, h in rows
+        }
+
+    @staticmethod
+    def _verified(src_f, dst_f):
+        """
+        源文件和目标文件大小相同, 且有同类型的哈希并全部一致
+        """
+        if src_f is None or src_f['is_dir'] or dst_f['is_dir'] or src_f['size'] != dst_f['size']:
+            return False
+        src_h, dst_h = entry_hashes(src_f), entry_hashes(dst_f)
+        common = src_h.keys() & dst_h.keys()
+        return bool(common) and all(src_h[t] == dst_h[t] for t in common)
+
+    def record_dir(self, src_root, dst_root, rel, dst_files, src_files):
+        """
+        记录列出的目标目录内容, 用列表中的哈希确认与源文件一致的文件记为已同步
+        其余文件不记录源文件的修改时间, 与没有索引时一样按大小(和哈希)比较, 同步成功后才按修改时间发现变化
+
+        :param src_root: 源目录
+        :param dst_root: 目标目录
+        :param rel: 相对同步根目录的路径
+        :param dst_files: 目标目录内容 {名称: 文件信息}
+        :param src_files: 源目录内容 {名称: 文件信息}
+        """
+        src_root, dst_root = self._root(src_root), self._root(dst_root)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE src_root=? AND dst_root=? AND dir=?", (src_root, dst_root, rel))
+            for name, f in dst_files.items():
+                src_f = (src_files or {}).get(name)
+                verified = self._verified(src_f, f)
+                self._write("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (src_root, dst_root, rel, name, int(f['is_dir']), f['size'],
+                             src_f.get('modified') if verified else None,
+                             self.entry_hash(src_f if verified else f), now))
+            self._write("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)", (src_root, dst_root, rel, now))
+
+    @staticmethod
+    def changed(rel, src_files, dst_files):
+        """
+        大小相同但源文件修改时间与索引记录不同的文件
+
+        :param rel: 目录相对同步根目录的路径
+        :param src_files: 源目录内容 {名称: 文件信息}
+        :param dst_files: 索引中的目标目录内容 {名称: 文件信息}
+        :return: 相对路径列表
+        """
+        result = []
+        for name, src_f in src_files.items():
+            dst_f = dst_files.get(name)
+            if (dst_f is None or src_f['is_dir'] or dst_f['is_dir'] or dst_f['size'] != src_f['size']
+                    or dst_f['modified'] is None):
+                continue
+            if dst_f['modified'] != src_f.get('modified'):
+                result.append(f"{rel}/{name}" if rel else name)
+        return result
+
+    def dir_signature(self, src_root, dst_root, rel):
+        """
+        源目录上次整个子树已同步时的签名
+
+        :return: (修改时间, 大小, 子项数), 没有记录或记录已过期时返回None
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT modified, size, count, synced FROM src_dirs "
+                                     "WHERE src_root=? AND dst_root=? AND dir=?",
+                                     (self._root(src_root), self._root(dst_root), rel)).fetchone()
+        if row is None or self._expired(row[3]):
+            return None
+        return row[:3]
+
+    def record_signature(self, src_root, dst_root, rel, signature):
+        """
+        记录源目录的签名, 为None时删除记录(子树有差异)
+
+        :param signature: (修改时间, 大小, 子项数)
+        """
+        key = (self._root(src_root), self._root(dst_root), rel)
+        with self._lock:
+            if signature is None:
+                self._write("DELETE FROM src_dirs WHERE src_root=? AND dst_root=? AND dir=?", key)
+            else:
+                self._write("INSERT OR REPLACE INTO src_dirs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            key + tuple(signature) + (time.time(),))
+
+    def stage(self, src_root, rel_path, src_f):
+        """
+        暂存差异文件的源文件信息, 同步成功后由synced写入索引
+        """
+        with self._lock:
+            self._pending[(self._root(src_root), rel_path)] = src_f
+
+    def staged(self, src_root, rel_path):
+        """
+        暂存的源文件信息, 没有时返回None
+        """
+        with self._lock:
+            return self._pending.get((self._root(src_root), rel_path))
+
+    def synced(self, src_root, dst_root, rel_path):
+        """
+        文件已同步到目标目录
+
+        :param src_root: 源目录
+        :param dst_root: 目标目录
+        :param rel_path: 相对同步根目录的路径
+        """
+        src_root, dst_root = self._root(src_root), self._root(dst_root)
+        rel_dir, name = self._split(rel_path)
+        with self._lock:
+            src_f = self._pending.get((src_root, rel_path))
+            if src_f is None:
+                return
+            self._write("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (src_root, dst_root, rel_dir, name, 0, src_f['size'], src_f.get('modified'),
+                         self.entry_hash(src_f), time.time()))
+
+    def removed(self, src_root, dst_root, rel_path):
+        """
+        文件已从目标目录删除
+        """
+        rel_dir, name = self._split(rel_path)
+        with self._lock:
+            self._write("DELETE FROM files WHERE src_root=? AND dst_root=? AND dir=? AND name=?",
+                        (self._root(src_root), self._root(dst_root), rel_dir, name))
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+            self._writes = 0
+
+    def close(self):
+        self.commit()
+        self._conn.close()
@@ -0,0 +1,134 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : journal.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class SyncJournal:
+    """
+    同步任务日志, 用SQLite记录每个同步项的计划和已完成的步骤, 进程中断后重新同步时从日志继续
+    步骤: downloaded(已下载到缓存), uploaded:<目标地址>, deleted:<目标地址>, cleared(已删除缓存), done(同步项完成)
+    同一组(源目录, 目标目录列表)同时只有一个未完成的任务
+    """
+
+    def __init__(self, db_path):
+        """
+        :param db_path: 日志文件路径
+        """
+        self.db_path = os.path.abspath(db_path)
+        self.job_id = None
+        self.infos = {}         # 继续的任务中同步项的源文件信息 {差异信息: 文件信息}
+        self._steps = set()     # 当前任务已完成的步骤 {(同步项, 步骤)}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL,
+                created REAL,
+                finished REAL
+            );
+            CREATE TABLE IF NOT EXISTS items (
+                job_id INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                file TEXT NOT NULL,
+                dst_list TEXT NOT NULL,
+                info TEXT,
+                PRIMARY KEY (job_id, seq)
+            );
+            CREATE TABLE IF NOT EXISTS steps (
+                job_id INTEGER NOT NULL,
+                file TEXT NOT NULL,
+                step TEXT NOT NULL,
+                finished REAL,
+                PRIMARY KEY (job_id, file, step)
+            );
+        """)
+        if "info" not in {row[1] for row in self._conn.execute("PRAGMA table_info(items)")}:    # 旧版本的日志文件
+            self._conn.execute("ALTER TABLE items ADD COLUMN info TEXT")
+
+    @staticmethod
+    def _key(src_path, dst_path_list):
+        return json.dumps([src_path.rstrip("/"), sorted(dst.rstrip("/") for dst in dst_path_list)])
+
+    def resume(self, src_path, dst_path_list):
+        """
+        读取未完成的任务
+
+        :param src_path: 源目录
+        :param dst_path_list: 目标目录列表
+        :return: 未完成的同步项 {差异信息: 目标地址列表}, 没有未完成的任务时返回None, 同步项的源文件信息见infos
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT id FROM jobs WHERE key=? AND finished IS NULL ORDER BY id DESC",
+                                     (self._key(src_path, dst_path_list),)).fetchone()
+            if row is None:
+                return None
+            self.job_id = row[0]
+            self._steps = set(self._conn.execute("SELECT file, step FROM steps WHERE job_id=?", (self.job_id,)))
+            items = self._conn.execute("SELECT file, dst_list, info FROM items WHERE job_id=? ORDER BY seq",
+                                       (self.job_id,)).fetchall()
+        items = [item for item in items if (item[0], "done") not in self._steps]
+        self.infos = {file: json.loads(info) for file, _, info in items if info is not None}
+        return {file: json.loads(dst_list) for file, dst_list, _ in items}
+
+    def plan(self, src_path, dst_path_list, union_sync, infos=None):
+        """
+        记录新的同步任务, 之前未完成的任务作废
+
+        :param src_path: 源目录
+        :param dst_path_list: 目标目录列表
+        :param union_sync: 同步项 {差异信息: 目标地址列表}
+        :param infos: 同步项的源文件信息 {差异信息: 文件信息}, 继续任务时用来更新同步状态索引
+        """
+        key = self._key(src_path, dst_path_list)
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET finished=? WHERE key=? AND finished IS NULL", (time.time(), key))
+            self.job_id = self._conn.execute("INSERT INTO jobs (key, created) VALUES (?, ?)",
+                                             (key, time.time())).lastrowid
+            self._conn.executemany("INSERT INTO items (job_id, seq, file, dst_list, info) VALUES (?, ?, ?, ?, ?)",
+                                   ((self.job_id, seq, file, json.dumps(dst_list),
+                                     None if (infos or {}).get(file) is None else json.dumps(infos[file]))
+                                    for seq, (file, dst_list) in enumerate(union_sync.items())))
+            self._steps = set()
+
+    def done(self, file, step):
+        """
+        步骤是否已完成
+        """
+        with self._lock:
+            return (file, step) in self._steps
+
+    def mark(self, file, step):
+        """
+        记录已完成的步骤, 立即写入磁盘
+        """
+        with self._lock, self._conn:
+            if (file, step) in self._steps:
+                return
+            self._conn.execute("INSERT OR IGNORE INTO steps VALUES (?, ?, ?, ?)",
+                               (self.job_id, file, step, time.time()))
+            self._steps.add((file, step))
+
+    def finish(self):
+        """
+        任务完成, 删除任务的同步项和步骤记录
+        """
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET finished=? WHERE id=?", (time.time(), self.job_id))
+            self._conn.execute("DELETE FROM items WHERE job_id=?", (self.job_id,))
+            self._conn.execute("DELETE FROM steps WHERE job_id=?", (self.job_id,))
+            self._steps = set()
+
+    def close(self):
+        self._conn.close()
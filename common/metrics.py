@@ -0,0 +1,248 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : metrics.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+"""
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import parse
+
+from common.log import log
+from common.storage import match_storage
+
+
+class Metrics:
+    """
+    进程内的指标收集, 按操作和存储分别统计请求数、请求耗时、传输字节数和传输耗时, 以Prometheus文本格式导出
+    请求指标由requests会话的response钩子收集, 传输指标由AlistV3在传输完成后记录, 同步调度器的状态在导出时读取
+    """
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)     # 耗时直方图的分桶(秒)
+    _HELP = {
+        "alist_requests_total": ("counter", "alist请求数"),
+        "alist_request_seconds": ("histogram", "alist请求耗时(到收到响应头为止)"),
+        "alist_transfer_bytes_total": ("counter", "传输完成的字节数"),
+        "alist_transfer_seconds": ("histogram", "单个文件的传输耗时"),
+        "alist_sync_items_total": ("counter", "执行完的同步项数"),
+        "alist_sync_queue_depth": ("gauge", "同步调度器队列中等待执行的同步项数"),
+        "alist_sync_active_workers": ("gauge", "正在执行同步项的工作线程数"),
+    }
+
+    def __init__(self, storages=None):
+        """
+        :param storages: 存储路径列表, 按最长前缀匹配路径所属的存储, 没有匹配时使用路径的第一级目录
+        """
+        self.storages = [] if storages is None else [s for s in storages if s != "default"]
+        self._lock = threading.Lock()
+        self._counters = {}     # (名称, 标签) -> 值
+        self._histograms = {}   # (名称, 标签) -> [各分桶计数, 总和, 次数]
+        self._gauges = {}       # 名称 -> 返回当前值的函数
+        self._server = None
+        self._writer = None
+
+    @staticmethod
+    def _labels(labels):
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def storage(self, path):
+        """
+        路径所属的存储
+        """
+        if not path:
+            return ""
+        path = "/" + path.replace("\\", "/").strip("/")
+        key = match_storage(path, self.storages)
+        if key is not None:
+            return key.rstrip("/")
+        return path[:path.find("/", 1)] if path.find("/", 1) > 0 else path
+
+    def inc(self, name, value=1, **labels):
+        key = (name, self._labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, self._labels(labels))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [[0] * len(self.BUCKETS), 0.0, 0]
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+
+    def gauge(self, name, func):
+        """
+        注册实时指标, 导出时调用func取值, func为None时取消注册
+        """
+        with self._lock:
+            if func is None:
+                self._gauges.pop(name, None)
+            else:
+                self._gauges[name] = func
+
+    @staticmethod
+    def _operation(url):
+        """
+        请求对应的操作, /api/fs/list为list, 其他alist接口取最后一级, 非alist接口(下载直链)为raw
+        """
+        path = parse.urlsplit(url).path
+        if "/api/" not in path:
+            return "raw"
+        parts = path[path.find("/api/") + 5:].strip("/").split("/")
+        if "task" in parts:
+            return "task"
+        return parts[-1] if parts else "api"
+
+    def _request_path(self, request):
+        """
+        请求操作的alist路径, 从上传请求的File-Path或json请求体中读取
+        """
+        file_path = request.headers.get("File-Path")
+        if file_path:
+            return parse.unquote(file_path)
+        body = request.body
+        if isinstance(body, bytes) and body[:1] == b"{":
+            try:
+                body = json.loads(body)
+            except ValueError:
+                return ""
+            for key in ("path", "dir", "src_dir"):
+                if isinstance(body.get(key), str):
+                    return body[key]
+        return ""
+
+    def response_hook(self, res, *args, **kwargs):
+        """
+        requests会话的response钩子, 记录请求数和耗时
+        """
+        op = self._operation(res.request.url)
+        storage = self.storage(self._request_path(res.request)) if op != "raw" else ""
+        self.inc("alist_requests_total", op=op, storage=storage, code=res.status_code)
+        self.observe("alist_request_seconds", res.elapsed.total_seconds(), op=op, storage=storage)
+        return res
+
+    def transfer(self, op, path, size, seconds):
+        """
+        记录一次完成的传输
+
+        :param op: 传输方式, download/upload/relay
+        :param path: 传输的alist路径
+        :param size: 字节数
+        :param seconds: 耗时(秒)
+        """
+        storage = self.storage(path)
+        self.inc("alist_transfer_bytes_total", size or 0, op=op, storage=storage)
+        self.observe("alist_transfer_seconds", seconds, op=op, storage=storage)
+
+    def track_scheduler(self, scheduler):
+        """
+        导出同步调度器的队列长度和工作中的线程数, scheduler为None时取消
+        """
+        self.gauge("alist_sync_queue_depth", None if scheduler is None else lambda: scheduler.queue_depth)
+        self.gauge("alist_sync_active_workers", None if scheduler is None else lambda: scheduler.active)
+
+    @staticmethod
+    def _escape(value):
+        """
+        转义标签值中的反斜杠、双引号和换行, 存储路径中可能包含这些字符
+        """
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    @classmethod
+    def _format(cls, name, labels, value):
+        if labels:
+            label_str = ",".join(f'{k}="{cls._escape(v)}"' for k, v in labels)
+            return f"{name}{{{label_str}}} {value}"
+        return f"{name} {value}"
+
+    def render(self) -> str:
+        """
+        Prometheus文本格式的全部指标
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {k: (list(v[0]), v[1], v[2]) for k, v in self._histograms.items()}
+            gauges = dict(self._gauges)
+        lines = []
+        for name, (kind, help_text) in self._HELP.items():
+            samples = []
+            if kind == "counter":
+                samples = [self._format(name, labels, value) for (n, labels), value in counters.items() if n == name]
+            elif kind == "histogram":
+                for (n, labels), (buckets, total, count) in histograms.items():
+                    if n != name:
+                        continue
+                    for bound, c in zip(self.BUCKETS, buckets):
+                        samples.append(self._format(f"{name}_bucket", labels + (("le", str(bound)),), c))
+                    samples.append(self._format(f"{name}_bucket", labels + (("le", "+Inf"),), count))
+                    samples.append(self._format(f"{name}_sum", labels, total))
+                    samples.append(self._format(f"{name}_count", labels, count))
+            elif name in gauges:
+                try:
+                    samples = [self._format(name, (), gauges[name]())]
+                except Exception as e:
+                    log.warning(f"读取指标{name}失败: {e}")
+            if samples:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines += samples
+        return "\n".join(lines) + "\n"
+
+    def write(self, file_path):
+        """
+        写入文件, 先写临时文件再替换, 读取方(如node_exporter的textfile)不会读到写了一半的文件
+        """
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, file_path)
+
+    def export_file(self, file_path, interval=15):
+        """
+        后台线程每隔interval秒写入一次文件
+        """
+        def run():
+            while True:
+                try:
+                    self.write(file_path)
+                except OSError as e:
+                    log.warning(f"写入指标文件失败: {e}")
+                time.sleep(interval)
+
+        self._writer = threading.Thread(target=run, name="metrics-writer", daemon=True)
+        self._writer.start()
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        在后台线程启动HTTP服务, 通过 http://host:port/metrics 读取指标
+
+        :return: HTTP服务
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):   # 不输出访问日志
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+        log.info(f"指标服务已启动: http://{host}:{self._server.server_port}/metrics")
+        return self._server
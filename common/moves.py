@@ -0,0 +1,194 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : moves.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+"""
+import os
+
+from common.hashcache import entry_hashes
+from common.log import log
+
+
+class MoveDetector:
+    """
+    找出源目录中被移动或重命名的文件
+    同一目标地址的- 文件和+ 文件按(文件名, 大小)配对, match为"hash"时还按(大小, 哈希)配对, 可以找出改了名的文件
+    两边都有同类型哈希但不相同的不配对, 只有一一对应的文件才会配对, 有多个候选的仍然删除后重新上传
+    需要先移动到新目录再重命名的文件, 新目录中已有同名文件时不配对, 避免覆盖目标中的其他文件
+    """
+
+    def __init__(self, alist, match="name", index=None):
+        """
+        :param alist: AlistV3实例, 用来列出候选文件所在的目录
+        :param match: 配对方式, "name"按文件名和大小, "hash"再加上按大小和哈希
+        :param index: SyncIndex同步状态索引, 有索引时目标文件信息从索引读取
+        """
+        if match not in ("name", "hash"):
+            raise ValueError(f"不支持的配对方式: match={match}")
+        self.alist = alist
+        self.match = match
+        self.index = index
+
+    @staticmethod
+    def _join(root, rel):
+        return f"{root.rstrip('/')}/{rel}" if rel else root
+
+    def _listing(self, rel_dir, root, src_path=None, dst_path=None):
+        """
+        列出目录内容, 有索引时目标目录优先从索引读取
+
+        :return: {名称: 文件信息}, 目录不存在时返回{}
+        """
+        files = None
+        if self.index is not None and dst_path is not None:
+            files = self.index.list_dir(src_path, dst_path, rel_dir)
+        if files is None:
+            files = {f['name']: f for f in self.alist.listdir(self._join(root, rel_dir)) or []}
+        return files
+
+    def _entries(self, rel_paths, root, src_path=None, dst_path=None):
+        """
+        列出文件所在的目录, 每个目录只列出一次
+
+        :param rel_paths: 相对同步根目录的路径
+        :param root: 根目录
+        :param src_path: 源目录, 和dst_path一起用于读取索引
+        :param dst_path: 目标目录
+        :return: {相对路径: 文件信息}, 不存在的文件不在结果中
+        """
+        groups = {}
+        for rel_path in rel_paths:
+            groups.setdefault(os.path.dirname(rel_path), []).append(rel_path)
+        result = {}
+        for rel_dir, paths in groups.items():
+            files = self._listing(rel_dir, root, src_path, dst_path)
+            for rel_path in paths:
+                f = files.get(os.path.basename(rel_path))
+                if f is not None and not f['is_dir']:
+                    result[rel_path] = f
+        return result
+
+    def _keys(self, rel_path, entry):
+        keys = [("name", entry['size'], os.path.basename(rel_path))]
+        if self.match == "hash":
+            keys += [("hash", entry['size'], t, h) for t, h in entry_hashes(entry).items()]
+        return keys
+
+    @staticmethod
+    def _same_hash(a, b):
+        """
+        两边同类型的哈希是否一致, 没有同类型的哈希时视为一致
+        """
+        ha, hb = entry_hashes(a), entry_hashes(b)
+        return all(ha[t] == hb[t] for t in ha.keys() & hb.keys())
+
+    def _pair(self, sub_entries, add_entries):
+        """
+        一一配对
+
+        :param sub_entries: 目标中的- 文件 {相对路径: 文件信息}
+        :param add_entries: 源中的+ 文件 {相对路径: 文件信息}
+        :return: [(- 文件相对路径, + 文件相对路径)]
+        """
+        by_key = {}
+        for rel_path, entry in add_entries.items():
+            for key in self._keys(rel_path, entry):
+                by_key.setdefault(key, set()).add(rel_path)
+        candidates = {}     # - 文件 -> {+ 文件}
+        matched_by = {}     # + 文件 -> {- 文件}
+        for rel_path, entry in sub_entries.items():
+            adds = set()
+            for key in self._keys(rel_path, entry):
+                adds |= by_key.get(key, set())
+            adds = {a for a in adds if self._same_hash(entry, add_entries[a])}
+            candidates[rel_path] = adds
+            for a in adds:
+                matched_by.setdefault(a, set()).add(rel_path)
+        return [
+            (sub, next(iter(adds))) for sub, adds in candidates.items()
+            if len(adds) == 1 and len(matched_by[next(iter(adds))]) == 1
+        ]
+
+    @staticmethod
+    def _via(sub, add):
+        """
+        移动到新目录后、重命名前的临时路径, 不需要先移动再重命名时返回None
+        """
+        sub_dir, name = os.path.split(sub)
+        add_dir, new_name = os.path.split(add)
+        if sub_dir == add_dir or name == new_name:
+            return None
+        return f"{add_dir}/{name}" if add_dir else name
+
+    def _safe_pairs(self, src_path, dst, pairs):
+        """
+        去掉会覆盖其他文件的配对: 先移动再重命名时, 新目录中已有同名文件, 或与其他配对用到的路径相同
+
+        :return: 可以执行的配对
+        """
+        claimed = {}    # 配对会占用的路径 -> 次数
+        for sub, add in pairs:
+            for path in (add, self._via(sub, add)):
+                if path is not None:
+                    claimed[path] = claimed.get(path, 0) + 1
+        listings = {}
+        result = []
+        for sub, add in pairs:
+            via = self._via(sub, add)
+            if via is not None:
+                via_dir = os.path.dirname(via)
+                if via_dir not in listings:
+                    listings[via_dir] = self._listing(via_dir, dst, src_path=src_path, dst_path=dst)
+                if os.path.basename(via) in listings[via_dir] or claimed[via] > 1:
+                    log.warning(f"移动时会覆盖{dst}中的{via}, 不移动: {sub} -> {add}")
+                    continue
+            if claimed[add] > 1:
+                continue
+            result.append((sub, add))
+        return result
+
+    def detect(self, src_path, union_sync):
+        """
+        在同步计划中找出可以在目标中移动完成的文件
+
+        :param src_path: 源目录
+        :param union_sync: 同步计划 {差异信息: 目标地址列表}
+        :return: (移动计划 {目标地址: [(- 文件相对路径, + 文件相对路径)]}, 去掉已配对部分后的同步计划)
+        """
+        per_dst = {}    # 目标地址 -> ([- 文件], [+ 文件])
+        for file, dst_list in union_sync.items():
+            if file[0] in ("-", "+"):
+                for dst in dst_list:
+                    per_dst.setdefault(dst, ([], []))[file[0] == "+"].append(file[2:])
+
+        src_entries = {}    # 源文件信息, 多个目标地址共用
+        moves = {}
+        for dst, (subs, adds) in per_dst.items():
+            if self.match == "name":    # 只有同名的文件才可能配对, 不用列出其他文件所在的目录
+                names = {os.path.basename(p) for p in subs} & {os.path.basename(p) for p in adds}
+                subs = [p for p in subs if os.path.basename(p) in names]
+                adds = [p for p in adds if os.path.basename(p) in names]
+            if not subs or not adds:
+                continue
+            todo = [p for p in adds if p not in src_entries]
+            src_entries.update(dict.fromkeys(todo))
+            src_entries.update(self._entries(todo, src_path))
+            pairs = self._pair(self._entries(subs, dst, src_path=src_path, dst_path=dst),
+                               {p: src_entries[p] for p in adds if src_entries[p] is not None})
+            pairs = self._safe_pairs(src_path, dst, pairs)
+            if pairs:
+                moves[dst] = pairs
+
+        if not moves:
+            return {}, union_sync
+        consumed = {(f"- {sub}", dst) for dst, pairs in moves.items() for sub, _ in pairs}
+        consumed |= {(f"+ {add}", dst) for dst, pairs in moves.items() for _, add in pairs}
+        result = {}
+        for file, dst_list in union_sync.items():
+            dst_list = [dst for dst in dst_list if (file, dst) not in consumed]
+            if dst_list:
+                result[file] = dst_list
+        log.info(f"发现{sum(len(pairs) for pairs in moves.values())}个可以在目标中移动完成的文件")
+        return moves, result
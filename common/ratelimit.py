@@ -0,0 +1,117 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : ratelimit.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+"""
+import threading
+import time
+
+from common.storage import match_storage
+
+
+class TokenBucket:
+    """
+    令牌桶, 每秒补充rate个令牌, 最多存capacity个
+    一次申请超过capacity的令牌时(如大文件的字节数), 等到桶满后申请成功并记为欠账, 之后的申请要先还清欠账
+    """
+
+    def __init__(self, rate, per=1.0, capacity=None):
+        """
+        :param rate: 每per秒补充的令牌数
+        :param per: 补充周期(秒)
+        :param capacity: 桶容量, 默认为一个周期的令牌数的1/60, 最少为1, 避免周期开始时突发
+        """
+        self.rate = rate / per      # 每秒补充的令牌数
+        self.capacity = capacity if capacity is not None else max(1.0, rate / 60)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, n=1):
+        """
+        申请n个令牌, 令牌不足时阻塞等待
+
+        :param n: 申请的令牌数
+        """
+        need = min(n, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= need:
+                    self._tokens -= n   # 超出容量的部分记为欠账
+                    return
+                wait = (need - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """
+    按存储分别限速, 支持每秒请求数、每小时文件数、每天字节数
+    limits格式: {存储路径: {"rps": 5, "files_per_hour": 500, "bytes_per_day": 100 * 1024 ** 3}}
+    存储路径按最长前缀匹配, "default"为未匹配时使用的限制, 未设置的项不限制
+    """
+    _PERIODS = {
+        "rps": 1,
+        "files_per_hour": 3600,
+        "bytes_per_day": 86400,
+    }
+
+    def __init__(self, limits=None):
+        """
+        :param limits: 各存储的限速配置
+        """
+        self.limits = {} if limits is None else limits
+        self._buckets = {}      # 存储路径 -> {限速项: TokenBucket}
+        self._lock = threading.Lock()
+        for key, limit in self.limits.items():
+            for item in limit:
+                if item not in self._PERIODS:
+                    raise ValueError(f"不支持的限速项: {key}: {item}")
+
+    def storage(self, path):
+        """
+        路径所属的存储, 没有匹配的限速配置时返回None
+        """
+        return match_storage(path, self.limits)
+
+    def _bucket(self, path, item):
+        key = self.storage(path)
+        if key is None or not self.limits[key].get(item):
+            return None
+        with self._lock:
+            buckets = self._buckets.setdefault(key, {})
+            if item not in buckets:
+                buckets[item] = TokenBucket(self.limits[key][item], per=self._PERIODS[item])
+            return buckets[item]
+
+    def request(self, path, n=1):
+        """
+        发送请求前调用
+
+        :param path: 请求的alist路径
+        :param n: 请求数
+        """
+        bucket = self._bucket(path, "rps")
+        if bucket is not None:
+            bucket.acquire(n)
+
+    def transfer(self, path, size):
+        """
+        传输一个文件前调用
+
+        :param path: 传输的alist路径
+        :param size: 文件大小(字节)
+        """
+        bucket = self._bucket(path, "files_per_hour")
+        if bucket is not None:
+            bucket.acquire(1)
+        bucket = self._bucket(path, "bytes_per_day")
+        if bucket is not None and size:
+            bucket.acquire(size)
@@ -15,7 +15,6 @@ from config import RCLONE_PATH
 class RcloneOperation:
     _RCLONE_PATH = None
     _WORKSPACE = os.path.dirname(os.path.realpath(__file__)).replace("\\", "/")
-    _SYNC_CACHE_LOG = os.path.abspath(f"{_WORKSPACE}/log.txt")
     _CONFIG_FILE = f"{_WORKSPACE}/config/rclone.conf"
 
     SYNC_TIPS = "- 表示源上缺少路径，因此仅在目标中 \n" \
@@ -100,50 +99,69 @@ class RcloneOperation:
         self.transfers = transfers
         self._setRclonePath()
 
-    @_Exp(_Exp.CheckError)
-    def check(self, src_path: str, dst_path: str, src=None, dst=None, filter_file=None) -> list:
+    def check_iter(self, src_path: str, dst_path: str, src=None, dst=None, filter_file=None, compare="size"):
         """
-        检查同步某一文件夹
+        检查同步某一文件夹, rclone的--combined结果通过管道逐行读取, 每次调用互不影响
         :param filter_file: 排除目录文件
+        :param compare: 比较方式, "size"只比较大小(--size-only), "hash"由rclone比较大小和哈希
         :param src_path: 源目录，同步时不变
         :param dst_path: 目标目录，会根据目标目录增删改等
         :param src: 源存储符，可以是本地盘符，可留空
         :param dst: 目标存储符，可以是本地盘符，可留空
-        :return:
+        :return: 逐个产出不同文件的信息, rclone异常退出时读取完后抛出CheckError
+        生成器在读取时才执行, 异常装饰器包不住, 错误在函数内直接抛出CheckError
         """
         # 设置存储符
         if src is not None:
             src_path = f"{src}:{src_path}"
         if dst is not None:
             dst_path = f"{dst}:{dst_path}"
+        size_only = " --size-only" if compare == "size" else ""
         # 绝对路径化filter_file
         if filter_file is not None:
             filter_file = os.path.abspath(filter_file)
-            check_cmd = f'{self._RCLONE_PATH} check "{src_path}" "{dst_path}" --size-only --combined={self._SYNC_CACHE_LOG} --filter-from="{filter_file}"'
+            check_cmd = f'{self._RCLONE_PATH} check "{src_path}" "{dst_path}"{size_only} --combined=- --filter-from="{filter_file}"'
         else:
-            check_cmd = f'{self._RCLONE_PATH} check "{src_path}" "{dst_path}" --size-only --combined={self._SYNC_CACHE_LOG}'
+            check_cmd = f'{self._RCLONE_PATH} check "{src_path}" "{dst_path}"{size_only} --combined=-'
         # 检查不同的文件
         try:
             log.info(check_cmd)
-            sbp.call(
+            p = sbp.Popen(
                 check_cmd,
-                # stdout=sbp.PIPE, stderr=sbp.PIPE,
-                shell=True)
+                stdout=sbp.PIPE,
+                shell=True, encoding='utf-8')
         except Exception as e:
             log.error(e)
             # traceback.print_exc()
             raise self._Exp.CheckError("rclone检查差异性文件时出现错误")
 
-        with open(self._SYNC_CACHE_LOG, 'r', encoding='utf-8') as f:
-            ck_msg_str = f.read()
-        os.remove(self._SYNC_CACHE_LOG)
-        ck_msg_list = ck_msg_str.split("\n")
-        diff_file_list = []  # 不同文件信息的列表
-        for ck_msg in ck_msg_list:
-            if ck_msg == "":
-                continue
-            if ck_msg[0] != "=":
-                diff_file_list.append(ck_msg)
-        if not diff_file_list:  # 如果没找到需要同步的文件，则退出
-            return []
-        return diff_file_list
+        finished = False
+        try:
+            for ck_msg in p.stdout:
+                ck_msg = ck_msg.rstrip("\r\n")
+                if ck_msg == "":
+                    continue
+                if ck_msg[0] != "=":
+                    yield ck_msg
+            finished = True
+        finally:
+            if finished is False and p.poll() is None:  # 调用方提前结束读取
+                p.kill()
+            p.stdout.close()
+            p.wait()
+        if p.returncode not in (0, 1):  # 1 表示存在差异, 其他返回值说明检查没有完成, 结果不可信
+            raise self._Exp.CheckError(f"rclone check 异常退出, 返回值: {p.returncode}")
+
+    @_Exp(_Exp.CheckError)
+    def check(self, src_path: str, dst_path: str, src=None, dst=None, filter_file=None, compare="size") -> list:
+        """
+        检查同步某一文件夹
+        :param filter_file: 排除目录文件
+        :param compare: 比较方式, "size"或"hash"
+        :param src_path: 源目录，同步时不变
+        :param dst_path: 目标目录，会根据目标目录增删改等
+        :param src: 源存储符，可以是本地盘符，可留空
+        :param dst: 目标存储符，可以是本地盘符，可留空
+        :return:
+        """
+        return list(self.check_iter(src_path, dst_path, src=src, dst=dst, filter_file=filter_file, compare=compare))
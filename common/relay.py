@@ -0,0 +1,126 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : relay.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+"""
+import queue
+import threading
+
+import requests
+
+
+class RelayBranch:
+    """
+    中转流的一个分支, 作为一个上传请求的数据
+    """
+
+    def __init__(self, stream, max_chunks):
+        self.stream = stream
+        self.queue = queue.Queue(maxsize=max_chunks)
+        self.closed = threading.Event()
+
+    def put(self, item):
+        """
+        放入队列, 上传方已关闭时放弃
+
+        :return: 是否放入成功
+        """
+        while not self.closed.is_set():
+            try:
+                self.queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __len__(self):
+        return self.stream.size
+
+    def __iter__(self):
+        sent = 0
+        try:
+            while True:
+                item = self.queue.get()
+                if item is RelayStream.END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                sent += len(item)
+                yield item
+            if sent != self.stream.size:
+                raise IOError(f"中转数据大小不一致, 应为{self.stream.size}字节, 实际为{sent}字节")
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        不再接收数据
+        """
+        self.closed.set()
+
+
+class RelayStream:
+    """
+    中转流, 后台线程读取下载响应放入有界队列, 上传请求从队列中取数据发送, 下载和上传同时进行且不写入磁盘
+    有多个分支时, 同一份下载数据会同时发给每个分支, 最慢的分支决定下载速度
+    """
+    _HEADERS = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:81.0) Gecko/20100101 Firefox/81.0",
+        "Accept-Encoding": "identity",
+    }
+    END = object()     # 下载结束标记
+
+    def __init__(self, url, size, session=None, chunk_size=1024 * 1024, max_chunks=16, branches=1):
+        """
+        :param url: 源文件下载链接(raw_url)
+        :param size: 文件大小, 作为上传的Content-Length
+        :param session: 下载用的请求会话, 默认使用requests
+        :param chunk_size: 每块数据大小(字节)
+        :param max_chunks: 每个分支队列中最多缓存的块数, 内存占用最多为 chunk_size * max_chunks
+        :param branches: 分支数, 即同时上传的目标数
+        """
+        self.url = url
+        self.size = size
+        self.s = requests if session is None else session
+        self.chunk_size = chunk_size
+        self.branches = [RelayBranch(self, max_chunks) for _ in range(branches)]
+        self._thread = threading.Thread(target=self._reader, daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        """
+        放入所有分支
+
+        :return: 是否还有分支在接收数据
+        """
+        alive = False
+        for branch in self.branches:
+            if branch.put(item):
+                alive = True
+        return alive
+
+    def _reader(self):
+        try:
+            with self.s.get(self.url, stream=True, headers=self._HEADERS) as res:
+                res.raise_for_status()
+                for chunk in res.iter_content(chunk_size=self.chunk_size):
+                    if not self._put(chunk):
+                        return
+            self._put(self.END)
+        except Exception as e:
+            self._put(e)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter(self.branches[0])
+
+    def close(self):
+        """
+        停止读取, 释放下载连接
+        """
+        for branch in self.branches:
+            branch.close()
@@ -0,0 +1,128 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : scheduler.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+"""
+import queue
+import threading
+import traceback
+
+from common.log import log
+
+
+class SyncScheduler:
+    """
+    同步任务调度器, 固定数量的工作线程从有界队列中取任务执行
+    队列满时提交任务会阻塞, 线程数和内存占用与任务总数无关
+    """
+    _STOP = object()    # 工作线程退出标记
+
+    def __init__(self, worker_num=4, queue_size=None, print_exc=True):
+        """
+        :param worker_num: 工作线程数
+        :param queue_size: 任务队列长度, 默认为工作线程数的2倍
+        :param print_exc: 任务出错时是否打印异常栈
+        """
+        self.worker_num = worker_num
+        self.print_exc = print_exc
+        self._queue = queue.Queue(maxsize=queue_size or worker_num * 2)
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._workers = []
+        self.active = 0         # 正在执行的任务数
+        self.done = 0           # 已完成的任务数
+        self.errors = []        # 出错的任务 [(任务, 异常)]
+
+    def start(self):
+        for i in range(self.worker_num):
+            t = threading.Thread(target=self._worker, name=f"sync-worker-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
+        return self
+
+    @property
+    def queue_depth(self):
+        """
+        队列中等待执行的任务数
+        """
+        return self._queue.qsize()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def _worker(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is self._STOP:
+                    return
+                if self._cancel.is_set():   # 已取消, 丢弃剩余任务
+                    continue
+                func, args, kwargs = task
+                with self._lock:
+                    self.active += 1
+                try:
+                    func(*args, **kwargs)
+                except Exception as e:
+                    log.error(e)
+                    if self.print_exc is True:
+                        traceback.print_exc()
+                    with self._lock:
+                        self.errors.append((task, e))
+                finally:
+                    with self._lock:
+                        self.active -= 1
+                        self.done += 1
+            finally:
+                self._queue.task_done()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        提交任务, 队列已满时阻塞等待
+
+        :return: 是否提交成功, 调度器已取消时返回False
+        """
+        task = (func, args, kwargs)
+        while not self._cancel.is_set():
+            try:
+                self._queue.put(task, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def join(self):
+        """
+        等待已提交的任务全部完成
+        """
+        self._queue.join()
+
+    def cancel(self):
+        """
+        取消还未开始的任务, 正在执行的任务会继续执行完
+        """
+        self._cancel.set()
+
+    def shutdown(self, wait=True, cancel=False):
+        """
+        关闭调度器
+
+        :param wait: 是否等待工作线程退出
+        :param cancel: 是否取消还未开始的任务
+        """
+        if cancel is True:
+            self.cancel()
+        for _ in self._workers:
+            self._queue.put(self._STOP)
+        if wait is True:
+            for t in self._workers:
+                t.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True, cancel=exc_type is not None)
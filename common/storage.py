@@ -0,0 +1,54 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : storage.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+"""
+
+
+def match_storage(path, keys):
+    """
+    按最长前缀找出路径所属的存储配置
+
+    :param path: alist路径
+    :param keys: 配置中的存储路径, "default"为未匹配时使用的配置
+    :return: 匹配的存储路径, 没有匹配时返回None
+    """
+    match = None
+    for key in keys:
+        if key == "default":
+            continue
+        prefix = key.rstrip("/")
+        if (path == prefix or path.startswith(prefix + "/")) and (match is None or len(prefix) > len(match.rstrip("/"))):
+            match = key
+    if match is None and "default" in keys:
+        return "default"
+    return match
+
+
+def local_path(path, local_driver):
+    """
+    alist路径在本地挂载的存储中对应的本地路径
+
+    :param path: alist路径
+    :param local_driver: 本地挂载的存储, {alist目录: 本地目录}
+    :return: 本地路径, 不在本地挂载的存储中时返回None
+    """
+    basedir = path[:path[1:].find("/") + 1]
+    if basedir in local_driver:
+        return path.replace(basedir, local_driver[basedir], 1)
+    return None
+
+
+def cloud189_sub_path(dst_path, err_msg):
+    """
+    天翼云盘秒传上传失败(MissingContentLength)时, 改用关闭秒传的存储(Cloud189Sub)重新上传的目标路径
+
+    :param dst_path: 上传的目标路径
+    :param err_msg: 上传失败的响应结果或异常信息
+    :return: 改用的目标路径, 不是天翼云盘的秒传失败或已经是关闭秒传的存储时返回None
+    """
+    if "MissingContentLength" not in err_msg or "Cloud189" not in dst_path or "Cloud189Sub" in dst_path:
+        return None
+    return dst_path.replace("Cloud189", "Cloud189Sub")
@@ -0,0 +1,97 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : task.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+"""
+import json
+import time
+
+from common.log import log
+
+
+class TaskWatcher:
+    """
+    等待alist的后台任务(复制/上传)完成
+    多个任务一起查询, 每轮每种任务只请求一次未完成列表, 有任务离开未完成列表时再请求一次已完成列表, 请求数与任务数无关
+    任务状态: 0等待, 1运行中, 2成功, 3取消中, 4已取消, 5出错(会重试), 6失败中, 7失败, 8等待重试, 9准备重试
+    """
+    SUCCEEDED = 2
+
+    def __init__(self, alist, interval=2, timeout=None, task_api="/api/admin/task"):
+        """
+        :param alist: AlistV3实例, 用它的会话请求任务接口
+        :param interval: 查询间隔(秒)
+        :param timeout: 最长等待时间(秒), 默认为None, 一直等待
+        :param task_api: 任务接口前缀, 查询需要管理员权限
+        """
+        self.alist = alist
+        self.interval = interval
+        self.timeout = timeout
+        self.task_api = task_api
+
+    def _list(self, task_type, kind):
+        """
+        任务列表
+
+        :param task_type: 任务类型, copy/upload
+        :param kind: undone/done
+        :return: {任务id: 任务信息}, 查询失败时返回None
+        """
+        res = self.alist.s.get(f"{self.alist._MAIN_URL}{self.task_api}/{task_type}/{kind}")
+        try:
+            res = json.loads(res.text)
+        except json.decoder.JSONDecodeError:
+            return None
+        if res.get('code') != 200:
+            log.warning(f"查询{task_type}任务失败, 响应结果: {res}")
+            return None
+        return {str(t['id']): t for t in res.get('data') or []}
+
+    def wait(self, tasks, timeout=None):
+        """
+        等待任务完成, 每轮输出一次进度
+
+        :param tasks: [(任务类型, 任务信息)], 任务信息为alist返回的任务, 至少包含id
+        :param timeout: 本次最长等待时间(秒), 默认为None, 使用实例的timeout
+        :return: {任务id: 最终的任务信息}, 无法查询或超时的任务为None
+        """
+        pending = {}    # 任务类型 -> {任务id: 任务名}
+        for task_type, task in tasks:
+            pending.setdefault(task_type, {})[str(task['id'])] = task.get('name')
+        result = {tid: None for ids in pending.values() for tid in ids}
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while pending:
+            for task_type in list(pending):
+                ids = pending[task_type]
+                undone = self._list(task_type, "undone")
+                if undone is None:
+                    log.warning(f"无法查询{task_type}任务状态, 不再等待{len(ids)}个任务")
+                    del pending[task_type]
+                    continue
+                finished = [tid for tid in ids if tid not in undone]
+                if finished:
+                    done = self._list(task_type, "done") or {}
+                    for tid in finished:
+                        info = done.get(tid)
+                        result[tid] = info
+                        if info is None:
+                            log.warning(f"任务已不在任务列表中, 无法确认结果: {ids[tid]}")
+                        elif info.get('state') != self.SUCCEEDED:
+                            log.error(f"{task_type}任务失败: {info.get('name')}, {info.get('error')}")
+                        del ids[tid]
+                running = [undone[tid] for tid in ids]
+                total = sum(1 for t, _ in tasks if t == task_type)
+                log.info(f"{task_type}任务: {total - len(running)}/{total}已完成"
+                         + "".join(f", {t.get('name')} {t.get('progress') or 0:.0f}%" for t in running[:3]))
+                if not ids:
+                    del pending[task_type]
+            if not pending:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                log.warning(f"等待任务超时, 还有{sum(len(ids) for ids in pending.values())}个任务未完成")
+                break
+            time.sleep(self.interval)
+        return result
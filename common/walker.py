@@ -0,0 +1,110 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : walker.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+"""
+import queue
+import threading
+
+from common.log import log
+
+
+class AlistWalker:
+    """
+    并行广度优先遍历alist目录树, 同时列出多个目录
+    待列出的目录放在共享队列中, 空闲的工作线程取下一个目录, 列出过程中发现的子目录立即入队, 其他线程可以马上开始列出
+    结果按(路径, 大小, 修改时间, 是否为目录)逐条返回, 结果队列有界, 调用方处理不过来时工作线程会等待
+    """
+    _STOP = object()    # 工作线程退出标记
+    _DONE = object()    # 遍历结束标记
+
+    def __init__(self, alist, max_workers=16, queue_size=10000):
+        """
+        :param alist: AlistV3实例, 用iterdir列出目录
+        :param max_workers: 同时列出的最大目录数
+        :param queue_size: 结果队列长度
+        """
+        self.alist = alist
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self.errors = []        # 列出失败的目录 [(目录, 异常)]
+        self.dirs = 0           # 已列出的目录数
+
+    def _put(self, q, item, cancel):
+        """
+        放入结果队列, 队列已满时等待, 遍历已取消时返回False
+        """
+        while not cancel.is_set():
+            try:
+                q.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def walk(self, root):
+        """
+        遍历目录树, 不包括根目录本身
+
+        :param root: 根目录
+        :return: (路径, 大小, 修改时间, 是否为目录)的迭代器, 列出失败的目录记录在errors中并跳过
+        """
+        root = root.replace("\\", "/").rstrip("/") or "/"
+        dirs = queue.Queue()
+        results = queue.Queue(maxsize=self.queue_size)
+        cancel = threading.Event()
+        lock = threading.Lock()
+        pending = [1]   # 已入队但还没列完的目录数, 为0时遍历结束
+        dirs.put(root)
+
+        def finish_dir():
+            with lock:
+                pending[0] -= 1
+                finished = pending[0] == 0
+            if finished:
+                for _ in range(self.max_workers):
+                    dirs.put(self._STOP)
+                self._put(results, self._DONE, cancel)
+
+        def worker():
+            while True:
+                dir_path = dirs.get()
+                if dir_path is self._STOP:
+                    return
+                try:
+                    if cancel.is_set():
+                        continue
+                    for f in self.alist.iterdir(dir_path):
+                        path = f"{dir_path.rstrip('/')}/{f['name']}"
+                        if f['is_dir']:
+                            with lock:
+                                pending[0] += 1
+                            dirs.put(path)
+                        if not self._put(results, (path, f['size'], f.get('modified'), f['is_dir']), cancel):
+                            break
+                    with lock:
+                        self.dirs += 1
+                except Exception as e:
+                    log.warning(f"列出目录失败: {dir_path}, {e}")
+                    with lock:
+                        self.errors.append((dir_path, e))
+                finally:
+                    finish_dir()
+
+        threads = [threading.Thread(target=worker, name=f"walk-worker-{i}", daemon=True)
+                   for i in range(self.max_workers)]
+        for t in threads:
+            t.start()
+        try:
+            while True:
+                item = results.get()
+                if item is self._DONE:
+                    break
+                yield item
+        finally:
+            # 遍历完成或调用方提前停止, 通知工作线程退出
+            cancel.set()
+            for _ in threads:
+                dirs.put(self._STOP)
@@ -0,0 +1,56 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : stub.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+"""
+import os
+
+from common.hashcache import HashCache
+
+
+class StubAlist:
+    """
+    内存中的alist目录树, 只实现比较和配对用到的listdir/getpath/local_path/hash_cache, 并记录列出过的目录
+    """
+
+    def __init__(self):
+        self.files = {"/": self._entry("/", True, 0)}    # 路径 -> 文件信息
+        self.listed = []
+        self.hash_cache = HashCache()
+
+    @staticmethod
+    def _entry(path, is_dir, size, modified="2024-01-01T00:00:00Z", hash_info=None):
+        return {'name': os.path.basename(path), 'is_dir': is_dir, 'size': size, 'modified': modified,
+                'hash_info': hash_info}
+
+    def add(self, path, size=0, modified="2024-01-01T00:00:00Z", hash_info=None, is_dir=False):
+        """
+        添加文件或目录, 自动创建上级目录
+        """
+        parent = os.path.dirname(path)
+        if parent not in self.files:
+            self.add(parent, is_dir=True)
+        self.files[path] = self._entry(path, is_dir, size, modified, hash_info)
+
+    def remove(self, path):
+        for p in [p for p in self.files if p == path or p.startswith(path + "/")]:
+            del self.files[p]
+
+    def listdir(self, dir_path):
+        dir_path = dir_path.rstrip("/") or "/"
+        self.listed.append(dir_path)
+        if not self.files.get(dir_path, {}).get('is_dir'):
+            return None
+        return [dict(f) for p, f in self.files.items() if p != "/" and os.path.dirname(p) == dir_path]
+
+    def getpath(self, path):
+        f = self.files.get(path.rstrip("/") or "/")
+        if f is None:
+            return {'code': 500, 'message': "object not found", 'data': None}
+        return {'code': 200, 'message': "success", 'data': dict(f)}
+
+    @staticmethod
+    def local_path(path):
+        return None
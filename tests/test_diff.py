@@ -0,0 +1,196 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : test_diff.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+"""
+import threading
+import time
+
+from common.diff import AlistDiff
+from common.index import SyncIndex
+from tests.stub import StubAlist
+
+
+def check(alist, index=None, compare="size", prune=False):
+    return sorted(AlistDiff(alist, index=index, compare=compare, prune=prune).check_iter("/src", "/dst"))
+
+
+def test_hash_same_size_different_content(tmp_path):
+    alist = StubAlist()
+    alist.add("/src/a.bin", 10, hash_info={"md5": "aaaa"})
+    alist.add("/dst/a.bin", 10, hash_info={"md5": "bbbb"})
+    assert check(alist, compare="hash") == ["* a.bin"]
+
+    index = SyncIndex(str(tmp_path / "index.db"))
+    assert check(alist, index, compare="hash") == ["* a.bin"]
+    assert check(alist, index, compare="hash") == ["* a.bin"]   # 第二次从索引读取目标目录
+    index.close()
+
+
+def test_hash_equal_files_are_in_sync(tmp_path):
+    alist = StubAlist()
+    alist.add("/src/a.bin", 10, hash_info={"md5": "aaaa"})
+    alist.add("/dst/a.bin", 10, hash_info={"MD5": "AAAA"})
+    index = SyncIndex(str(tmp_path / "index.db"))
+    assert check(alist, compare="hash") == []
+    assert check(alist, index, compare="hash") == []
+    assert check(alist, index, compare="hash") == []
+    index.close()
+
+
+def make_tree():
+    alist = StubAlist()
+    alist.add("/src/same.txt", 5)
+    alist.add("/src/new.txt", 3)
+    alist.add("/src/size.txt", 4)
+    alist.add("/src/sub/deep/x.txt", 1)
+    alist.add("/src/only_src/y.txt", 2)
+    alist.add("/dst/same.txt", 5)
+    alist.add("/dst/size.txt", 7)
+    alist.add("/dst/old.txt", 1)
+    alist.add("/dst/sub/deep/x.txt", 1)
+    alist.add("/dst/only_dst/z.txt", 2)
+    return alist
+
+
+def test_index_matches_plain_diff(tmp_path):
+    alist = make_tree()
+    expected = ["* size.txt", "+ new.txt", "+ only_src/y.txt", "- old.txt", "- only_dst/z.txt"]
+    assert check(alist) == expected
+
+    index = SyncIndex(str(tmp_path / "index.db"))
+    assert check(alist, index) == expected
+    alist.listed.clear()
+    assert check(alist, index) == expected
+    assert not [p for p in alist.listed if p.startswith("/dst")]     # 目标目录全部从索引读取
+    index.close()
+
+
+def test_unverified_files_are_not_seeded(tmp_path):
+    alist = StubAlist()
+    alist.add("/src/a.bin", 10, hash_info={"md5": "aaaa"})
+    alist.add("/src/b.bin", 10, hash_info={"md5": "bbbb"})
+    alist.add("/dst/a.bin", 10)                             # 没有哈希, 无法确认
+    alist.add("/dst/b.bin", 10, hash_info={"md5": "bbbb"})  # 哈希一致
+    index = SyncIndex(str(tmp_path / "index.db"))
+    assert check(alist, index) == []
+    rows = index.list_dir("/src", "/dst", "")
+    assert rows["a.bin"]["modified"] is None
+    assert rows["b.bin"]["modified"] == alist.files["/src/b.bin"]["modified"]
+
+    alist.files["/src/b.bin"]["modified"] = "2024-02-01T00:00:00Z"
+    assert check(alist, index) == ["* b.bin"]
+    index.close()
+
+
+def test_synced_file_change_is_found_by_modified(tmp_path):
+    alist = StubAlist()
+    alist.add("/src/a.txt", 3)
+    alist.add("/dst", is_dir=True)
+    index = SyncIndex(str(tmp_path / "index.db"))
+    assert check(alist, index) == ["+ a.txt"]
+    alist.add("/dst/a.txt", 3)      # 上传成功
+    index.synced("/src", "/dst", "a.txt")
+    assert check(alist, index) == []
+
+    alist.files["/src/a.txt"]["modified"] = "2024-02-01T00:00:00Z"     # 大小不变的修改
+    assert check(alist, index) == ["* a.txt"]
+    index.close()
+
+
+def make_pruned_tree():
+    alist = StubAlist()
+    for root in ("/src", "/dst"):
+        alist.add(f"{root}/a/1.txt", 1)
+        alist.add(f"{root}/b/c/2.txt", 2)
+    return alist
+
+
+def test_prune_skips_unchanged_subtrees(tmp_path):
+    alist = make_pruned_tree()
+    index = SyncIndex(str(tmp_path / "index.db"))
+    assert check(alist, index, prune=True) == []
+    alist.listed.clear()
+    assert check(alist, index, prune=True) == []
+    assert "/src/a" not in alist.listed and "/src/b" not in alist.listed
+
+    # 目录修改时间变化后重新进入
+    alist.add("/src/b/c/3.txt", 3)
+    alist.files["/src/b"]["modified"] = "2024-02-01T00:00:00Z"
+    alist.files["/src/b/c"]["modified"] = "2024-02-01T00:00:00Z"
+    assert check(alist, index, prune=True) == ["+ b/c/3.txt"]
+    assert check(alist, index, prune=True) == ["+ b/c/3.txt"]   # 有差异的子树不记录签名
+    index.close()
+
+
+def test_prune_hash_diff_invalidates_parents(tmp_path):
+    alist = make_pruned_tree()
+    alist.files["/src/b/c/2.txt"]["hash_info"] = {"md5": "aaaa"}
+    alist.files["/dst/b/c/2.txt"]["hash_info"] = {"md5": "bbbb"}
+    index = SyncIndex(str(tmp_path / "index.db"))
+    assert check(alist, index, compare="hash", prune=True) == ["* b/c/2.txt"]
+    assert index.dir_signature("/src", "/dst", "b/c") is None
+    assert index.dir_signature("/src", "/dst", "b") is None
+    assert index.dir_signature("/src", "/dst", "a") is not None
+    assert check(alist, index, compare="hash", prune=True) == ["* b/c/2.txt"]
+    index.close()
+
+
+def test_prune_disabled_when_dir_modified_is_unreliable(tmp_path):
+    alist = make_pruned_tree()
+    index = SyncIndex(str(tmp_path / "index.db"))
+    assert check(alist, index, prune=True) == []
+    alist.add("/src/new.txt", 1)    # 子项数变化, 但根目录修改时间不变
+    alist.add("/src/a/2.txt", 1)
+    assert check(alist, index, prune=True) == ["+ a/2.txt", "+ new.txt"]
+    index.close()
+
+
+class SlowAlist(StubAlist):
+    """
+    每次列出目录等待一段时间, 记录同时列出的最大目录数
+    """
+
+    def __init__(self, delay=0.02):
+        super().__init__()
+        self.delay = delay
+        self.active = self.peak = 0
+        self._lock = threading.Lock()
+
+    def listdir(self, dir_path):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.delay)
+        try:
+            return super().listdir(dir_path)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def test_sibling_directories_are_listed_concurrently():
+    alist = SlowAlist()
+    for i in range(8):
+        alist.add(f"/src/d{i}/a.txt", 1)
+        alist.add(f"/dst/d{i}/a.txt", 1 if i % 2 else 2)
+    expected = [f"* d{i}/a.txt" for i in range(0, 8, 2)]
+    assert sorted(AlistDiff(alist, max_workers=1).check_iter("/src", "/dst")) == expected
+    assert alist.peak == 1
+    assert sorted(AlistDiff(alist, max_workers=8).check_iter("/src", "/dst")) == expected
+    assert alist.peak > 1
+
+
+def test_stop_reading_early():
+    alist = SlowAlist(delay=0)
+    for i in range(50):
+        alist.add(f"/src/d{i}/a.txt", 1)
+    alist.add("/dst", is_dir=True)
+    lines = AlistDiff(alist, max_workers=4).check_iter("/src", "/dst")
+    assert next(lines).startswith("+ ")
+    lines.close()
+    listed = len(alist.listed)
+    time.sleep(0.05)
+    assert len(alist.listed) == listed   # 不再列出剩余的目录
@@ -0,0 +1,79 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : test_journal.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+"""
+import sqlite3
+
+from common.journal import SyncJournal
+
+DSTS = ["/A", "/B"]
+INFO = {'name': "a.txt", 'is_dir': False, 'size': 3, 'modified': "2024-01-01T00:00:00Z", 'hash_info': None}
+
+
+def pending(journal, union_sync):
+    """
+    与同步时一样, 跳过日志中已上传的目标地址
+    """
+    return {f: [dst for dst in dst_list if not journal.done(f, f"uploaded:{dst}")]
+            for f, dst_list in union_sync.items()}
+
+
+def test_resume_uploads_only_failed_destination(tmp_path):
+    db = str(tmp_path / "journal.db")
+    journal = SyncJournal(db)
+    journal.plan("/src", DSTS, {"+ a.txt": DSTS, "+ b.txt": DSTS, "- c.txt": ["/A"]}, infos={"+ a.txt": INFO})
+    journal.mark("+ b.txt", "done")
+    journal.mark("- c.txt", "deleted:/A")
+    journal.mark("- c.txt", "done")
+    journal.mark("+ a.txt", "downloaded")
+    journal.mark("+ a.txt", "uploaded:/A")     # 上传到/B时中断
+    journal.close()
+
+    journal = SyncJournal(db)
+    resumed = journal.resume("/src/", ["/B", "/A/"])    # 目标地址的顺序和末尾的/不影响
+    assert resumed == {"+ a.txt": DSTS}
+    assert journal.infos == {"+ a.txt": INFO}
+    assert journal.done("+ a.txt", "downloaded")
+    assert pending(journal, resumed) == {"+ a.txt": ["/B"]}
+
+    journal.mark("+ a.txt", "uploaded:/B")
+    journal.mark("+ a.txt", "done")
+    journal.finish()
+    journal.close()
+    assert SyncJournal(db).resume("/src", DSTS) is None
+
+
+def test_unfinished_job_is_kept_until_finish(tmp_path):
+    db = str(tmp_path / "journal.db")
+    journal = SyncJournal(db)
+    journal.plan("/src", DSTS, {"+ a.txt": DSTS})
+    journal.mark("+ a.txt", "uploaded:/A")
+    journal.close()
+
+    journal = SyncJournal(db)
+    assert journal.resume("/src", DSTS) == {"+ a.txt": DSTS}
+    journal.plan("/src", DSTS, {"+ d.txt": DSTS})    # 新的计划作废之前的任务
+    assert pending(journal, {"+ a.txt": DSTS}) == {"+ a.txt": DSTS}
+    journal.close()
+    assert SyncJournal(db).resume("/src", DSTS) == {"+ d.txt": DSTS}
+    assert SyncJournal(db).resume("/src", ["/A"]) is None
+
+
+def test_old_journal_without_info_column(tmp_path):
+    db = str(tmp_path / "journal.db")
+    conn = sqlite3.connect(db)
+    conn.executescript("""
+        CREATE TABLE jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, created REAL, finished REAL);
+        CREATE TABLE items (job_id INTEGER NOT NULL, seq INTEGER NOT NULL, file TEXT NOT NULL,
+                            dst_list TEXT NOT NULL, PRIMARY KEY (job_id, seq));
+    """)
+    conn.close()
+    journal = SyncJournal(db)
+    journal.plan("/src", DSTS, {"+ a.txt": DSTS}, infos={"+ a.txt": INFO})
+    journal.close()
+    journal = SyncJournal(db)
+    assert journal.resume("/src", DSTS) == {"+ a.txt": DSTS}
+    assert journal.infos == {"+ a.txt": INFO}
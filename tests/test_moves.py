@@ -0,0 +1,72 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : test_moves.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+"""
+from common.moves import MoveDetector
+from tests.stub import StubAlist
+
+
+def entry(size, md5=None):
+    return {'is_dir': False, 'size': size, 'hash_info': None if md5 is None else {"md5": md5}}
+
+
+def test_pair_by_name_and_size():
+    detector = MoveDetector(StubAlist())
+    pairs = detector._pair({"old/a.txt": entry(1), "old/b.txt": entry(2)},
+                           {"new/a.txt": entry(1), "new/b.txt": entry(3)})
+    assert pairs == [("old/a.txt", "new/a.txt")]
+
+
+def test_pair_skips_ambiguous_candidates():
+    detector = MoveDetector(StubAlist())
+    # 一个- 文件对应两个+ 文件
+    assert detector._pair({"old/a.txt": entry(1)}, {"x/a.txt": entry(1), "y/a.txt": entry(1)}) == []
+    # 两个- 文件对应同一个+ 文件
+    assert detector._pair({"x/a.txt": entry(1), "y/a.txt": entry(1)}, {"new/a.txt": entry(1)}) == []
+
+
+def test_pair_by_hash():
+    detector = MoveDetector(StubAlist(), match="hash")
+    assert detector._pair({"a.txt": entry(5, "aaaa")}, {"b.txt": entry(5, "aaaa")}) == [("a.txt", "b.txt")]
+    # 同名同大小但哈希不同
+    assert detector._pair({"x/a.txt": entry(5, "aaaa")}, {"y/a.txt": entry(5, "bbbb")}) == []
+    assert MoveDetector(StubAlist())._pair({"a.txt": entry(5, "aaaa")}, {"b.txt": entry(5, "aaaa")}) == []
+
+
+def test_safe_pairs_rejects_collisions():
+    alist = StubAlist()
+    alist.add("/dst/old/a.txt", 1)
+    alist.add("/dst/old/b.txt", 1)
+    alist.add("/dst/new/a.txt", 9)      # 先移动再重命名时会覆盖
+    detector = MoveDetector(alist, match="hash")
+    # old/a.txt -> new/c.txt 需要先移动到new/a.txt
+    assert detector._safe_pairs("/src", "/dst", [("old/a.txt", "new/c.txt")]) == []
+    # 两个配对先移动到同一个临时路径
+    pairs = [("old/b.txt", "tmp/x.txt"), ("old2/b.txt", "tmp/y.txt")]
+    assert detector._safe_pairs("/src", "/dst", pairs) == []
+    # 临时路径是另一个配对的新路径, 两个都不移动
+    pairs = [("old/b.txt", "tmp/x.txt"), ("old3/z.txt", "tmp/b.txt")]
+    assert detector._safe_pairs("/src", "/dst", pairs) == []
+    # 同目录重命名和跨目录同名移动不需要临时路径
+    pairs = [("old/b.txt", "old/d.txt"), ("old/a.txt", "other/a.txt")]
+    assert detector._safe_pairs("/src", "/dst", pairs) == pairs
+
+
+def test_detect_removes_paired_items():
+    alist = StubAlist()
+    alist.add("/src/new/a.txt", 1)
+    alist.add("/src/new/b.txt", 2)
+    alist.add("/dst/old/a.txt", 1)
+    alist.add("/dst/old/b.txt", 5)
+    union_sync = {
+        "- old/a.txt": ["/dst"],
+        "- old/b.txt": ["/dst"],
+        "+ new/a.txt": ["/dst", "/dst2"],
+        "+ new/b.txt": ["/dst"],
+    }
+    moves, rest = MoveDetector(alist).detect("/src", union_sync)
+    assert moves == {"/dst": [("old/a.txt", "new/a.txt")]}
+    assert rest == {"- old/b.txt": ["/dst"], "+ new/a.txt": ["/dst2"], "+ new/b.txt": ["/dst"]}
@@ -0,0 +1,31 @@
+# -*- coding: UTF-8 -*-
+"""
+@Project  : sync
+@File     : test_storage.py
+@Author   : Sorami
+@GitHub   : https://github.com/Soramik
+"""
+from common.storage import cloud189_sub_path, local_path, match_storage
+
+
+def test_match_storage_longest_prefix():
+    keys = ["/Real", "/Real/Cloud189", "default"]
+    assert match_storage("/Real/Cloud189/a.txt", keys) == "/Real/Cloud189"
+    assert match_storage("/Real/Cloud1890/a.txt", keys) == "/Real"
+    assert match_storage("/Other/a.txt", keys) == "default"
+    assert match_storage("/Other/a.txt", ["/Real"]) is None
+
+
+def test_local_path():
+    local_driver = {"/Local": "/mnt/disk"}
+    assert local_path("/Local/a/b.txt", local_driver) == "/mnt/disk/a/b.txt"
+    assert local_path("/Local/Local/b.txt", local_driver) == "/mnt/disk/Local/b.txt"
+    assert local_path("/Remote/a.txt", local_driver) is None
+
+
+def test_cloud189_sub_path():
+    err = "failed: MissingContentLength"
+    assert cloud189_sub_path("/Real/Cloud189/a", err) == "/Real/Cloud189Sub/a"
+    assert cloud189_sub_path("/Real/Cloud189Sub/a", err) is None
+    assert cloud189_sub_path("/Real/Aliyun/a", err) is None
+    assert cloud189_sub_path("/Real/Cloud189/a", "other error") is None